@@ -0,0 +1,247 @@
+import shlex
+import sqlite3
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from typing import NamedTuple, Optional
+from diff import ADDED, REMOVED, AVAILABILITY_OPENED
+from models import Bedrooms, parse_rent_cents
+from config import SUBSCRIPTIONS_DB, SITES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    site TEXT,
+    bedrooms INTEGER,
+    max_rent_cents INTEGER,
+    min_sqft INTEGER,
+    available_only INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rules_user ON rules (user_id);
+"""
+
+# sorts after every real rent, for rules without a max and plans without a price
+NO_LIMIT = float('inf')
+
+class AlertRule(NamedTuple):
+    """One user's subscription. Fields left as None match anything."""
+    id: int
+    user_id: int
+    site: Optional[str] = None
+    bedrooms: Optional[Bedrooms] = None
+    max_rent_cents: Optional[int] = None
+    min_sqft: Optional[int] = None
+    available_only: bool = False
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['id'], row['user_id'], row['site'],
+                   None if row['bedrooms'] is None else Bedrooms(row['bedrooms']),
+                   row['max_rent_cents'], row['min_sqft'], bool(row['available_only']))
+
+    @property
+    def rent_ceiling(self):
+        return NO_LIMIT if self.max_rent_cents is None else self.max_rent_cents
+
+    def describe(self):
+        parts = [self.site or 'any site', self.bedrooms.label if self.bedrooms is not None else 'any size']
+        if self.max_rent_cents is not None:
+            parts.append(f"up to ${self.max_rent_cents // 100:,}")
+        if self.min_sqft is not None:
+            parts.append(f"{self.min_sqft:,}+ ft²")
+        if self.available_only:
+            parts.append("availability only")
+        return f"#{self.id}: " + ", ".join(parts)
+
+def parse_rule_args(text, site_names=None):
+    """`site="Big Complex" beds=1 max_rent=1500 min_sqft=600 available` -> AlertRule field values.
+
+    Raises ValueError with something to show the user when an argument doesn't make sense.
+    """
+    site_names = site_names if site_names is not None else [site['name'] for site in SITES]
+    fields = {}
+    for arg in shlex.split(text or ''):
+        key, _, value = arg.partition('=')
+        key = key.lower()
+        if key in ('available', 'available_only') and not value:
+            fields['available_only'] = True
+        elif not value:
+            raise ValueError(f"`{arg}` needs a value, like `{key}=...`")
+        elif key == 'site':
+            match = next((name for name in site_names if name.lower() == value.lower()), None)
+            if match is None:
+                raise ValueError(f"Unknown site `{value}`, try one of: {', '.join(site_names)}")
+            fields['site'] = match
+        elif key in ('beds', 'bedrooms'):
+            bedrooms = Bedrooms.parse(value)
+            if bedrooms == Bedrooms.UNKNOWN:
+                raise ValueError(f"`{value}` isn't a bedroom count, use studio, 1, 2, 3 or 4+")
+            fields['bedrooms'] = bedrooms
+        elif key == 'max_rent':
+            fields['max_rent_cents'] = parse_rent_cents(value)
+            if fields['max_rent_cents'] is None:
+                raise ValueError(f"`{value}` isn't a rent")
+        elif key == 'min_sqft':
+            if not value.replace(',', '').isdigit():
+                raise ValueError(f"`{value}` isn't a number of square feet")
+            fields['min_sqft'] = int(value.replace(',', ''))
+        else:
+            raise ValueError(f"Unknown option `{key}`, use site, beds, max_rent, min_sqft or available")
+    return fields
+
+def _plans_by_name(floor_plans):
+    plans = {}
+    for plan in floor_plans:
+        plans.setdefault(plan.name.strip().lower(), []).append(plan)
+    return plans
+
+def alert_events(floor_plans, changes):
+    """What an alert is about, as (plan, availability opened) pairs.
+
+    Field changes only carry the changed values, so their plan comes from the
+    current listing. No changes means a first check, which is about every plan.
+    """
+    if not changes:
+        return [(plan, plan.available) for plan in floor_plans]
+
+    current = None
+    events = []
+    for change in changes:
+        if change.kind == ADDED:
+            events.append((change.new, change.new.available))
+        elif change.kind == REMOVED:
+            events.append((change.old, False))
+        else:
+            if current is None:
+                current = _plans_by_name(floor_plans)
+            opened = change.kind == AVAILABILITY_OPENED
+            events.extend((plan, opened) for plan in current.get(change.name.strip().lower(), []))
+    return events
+
+class RuleIndex:
+    """All the rules, bucketed by (site, bedrooms) with None buckets for "any".
+
+    Each bucket is sorted by max rent, so the rules a plan's rent fits under
+    are one bisect away. A plan only ever looks at its own four buckets.
+    """
+
+    def __init__(self, rules):
+        self.buckets = {}
+        for rule in rules:
+            key = (rule.site.lower() if rule.site else None, rule.bedrooms)
+            self.buckets.setdefault(key, []).append(rule)
+        self.ceilings = {}
+        for key, bucket in self.buckets.items():
+            bucket.sort(key=lambda rule: rule.rent_ceiling)
+            self.ceilings[key] = [rule.rent_ceiling for rule in bucket]
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def candidates(self, site_name, plan):
+        """Rules whose site, bedrooms and max rent fit the plan."""
+        site = site_name.lower()
+        rent = NO_LIMIT if plan.rent_cents is None else plan.rent_cents
+        for key in ((site, plan.bedrooms), (site, None), (None, plan.bedrooms), (None, None)):
+            bucket = self.buckets.get(key)
+            if bucket:
+                yield from bucket[bisect_left(self.ceilings[key], rent):]
+
+    def users_to_ping(self, site_name, floor_plans, changes):
+        """Ids of the users with a rule matching at least one thing the alert is about."""
+        users = set()
+        for plan, opened in alert_events(floor_plans, changes):
+            for rule in self.candidates(site_name, plan):
+                if rule.user_id in users:
+                    continue
+                if rule.min_sqft is not None and (plan.sqft is None or plan.sqft < rule.min_sqft):
+                    continue
+                if rule.available_only and not opened:
+                    continue
+                users.add(rule.user_id)
+        return users
+
+class AlertRules:
+    """Users' alert rules, kept in SUBSCRIPTIONS_DB.
+
+    The bot's commands write them and whoever sends the alerts reads them, maybe
+    from another process. Every write bumps the database's user_version, so the
+    index is only rebuilt after something actually changed.
+    """
+
+    def __init__(self, path=SUBSCRIPTIONS_DB):
+        self.path = path
+        self._index = None
+        self._index_version = None
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _write(self, sql, params):
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(sql, params)
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            return cursor
+        finally:
+            conn.close()
+
+    def add(self, user_id, site=None, bedrooms=None, max_rent_cents=None, min_sqft=None, available_only=False):
+        cursor = self._write(
+            "INSERT INTO rules (user_id, site, bedrooms, max_rent_cents, min_sqft, available_only, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, site, None if bedrooms is None else int(bedrooms), max_rent_cents, min_sqft, int(available_only), datetime.now().isoformat())
+        )
+        return AlertRule(cursor.lastrowid, user_id, site, bedrooms, max_rent_cents, min_sqft, available_only)
+
+    def remove(self, user_id, rule_id=None):
+        """Remove one of a user's rules, or all of them without a rule_id. Returns how many went."""
+        if rule_id is None:
+            return self._write("DELETE FROM rules WHERE user_id = ?", (user_id,)).rowcount
+        return self._write("DELETE FROM rules WHERE user_id = ? AND id = ?", (user_id, rule_id)).rowcount
+
+    def for_user(self, user_id):
+        conn = self._connect()
+        try:
+            return [AlertRule.from_row(row) for row in conn.execute("SELECT * FROM rules WHERE user_id = ? ORDER BY id", (user_id,))]
+        finally:
+            conn.close()
+
+    def index(self):
+        """The current RuleIndex, rebuilt only when the rules changed since the last call."""
+        conn = self._connect()
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if self._index is None or version != self._index_version:
+                rows = conn.execute("SELECT * FROM rules").fetchall()
+                self._index = RuleIndex(AlertRule.from_row(row) for row in rows)
+                self._index_version = version
+            return self._index
+        finally:
+            conn.close()
+
+_alert_rules = None
+_alert_rules_lock = threading.Lock()
+
+def get_alert_rules():
+    global _alert_rules
+    with _alert_rules_lock:
+        if _alert_rules is None:
+            _alert_rules = AlertRules()
+    return _alert_rules
+
+def set_alert_rules(rules):
+    """Swap in a different AlertRules, the replay harness uses this to keep test rules out of the real database."""
+    global _alert_rules
+    with _alert_rules_lock:
+        _alert_rules = rules
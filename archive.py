@@ -0,0 +1,246 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from config import ARCHIVE_DIR, SITES, HISTORY_DB
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checks (
+    id INTEGER PRIMARY KEY,
+    site TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    pages TEXT NOT NULL,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_checks_site ON checks (site, fetched_at);
+"""
+
+HTML = 'html'
+API = 'api'  # json api responses, parsed with the site's api_mapping
+
+class SnapshotArchive:
+    """Every page a check fetched, kept so the floor plans can be parsed again later.
+
+    Pages are gzipped into ARCHIVE_DIR/objects/ under their sha256, so a page
+    that didn't change since the last check isn't stored again. index.db
+    lists each check with its time and the digests of its pages, in order.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        os.makedirs(self.objects, exist_ok=True)
+        self.index_path = os.path.join(root, 'index.db')
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # a connection per call, checks for several sites archive from their own threads
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _path(self, digest):
+        return os.path.join(self.objects, digest[:2], f"{digest[2:]}.gz")
+
+    def put(self, page):
+        """Store one page. Returns (digest, whether it was new), a page already here costs only a stat."""
+        data = page.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, a half-written object would poison every later reprocess
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=6))
+        os.replace(temp_path, path)
+        return digest, True
+
+    def get(self, digest):
+        with open(self._path(digest), 'rb') as f:
+            return gzip.decompress(f.read()).decode('utf-8')
+
+    def record(self, site_name, pages, kind=HTML, page_hash=None, fetched_at=None):
+        """Archive one check's pages. Returns how many of them were new."""
+        if isinstance(pages, str):
+            pages = [pages]
+        stored = [self.put(page) for page in pages]
+        digests = [digest for digest, _ in stored]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO checks (site, fetched_at, kind, pages, content_hash) VALUES (?, ?, ?, ?, ?)",
+                    (site_name, fetched_at or datetime.now().isoformat(), kind, json.dumps(digests), page_hash)
+                )
+        finally:
+            conn.close()
+        return sum(new for _, new in stored)
+
+    def checks(self, site_name):
+        """The site's archived checks, oldest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM checks WHERE site = ? ORDER BY fetched_at, id", (site_name,)).fetchall()
+        finally:
+            conn.close()
+        return [dict(row, pages=tuple(json.loads(row['pages']))) for row in rows]
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT site, COUNT(*) AS checks, MIN(fetched_at) AS first, MAX(fetched_at) AS last FROM checks GROUP BY site").fetchall()
+        finally:
+            conn.close()
+        objects = 0
+        size = 0
+        for directory, _, files in os.walk(self.objects):
+            for name in files:
+                objects += 1
+                size += os.path.getsize(os.path.join(directory, name))
+        return [dict(row) for row in rows], objects, size
+
+def _parse_check(job):
+    """Process pool worker: parse one archived snapshot with the current extractor.
+
+    Returns (floor plans, bytes of html parsed).
+    """
+    from crawl import parse_floor_plans
+    from extractors import JsonExtractor
+
+    root, kind, digests, api_mapping, max_rows = job
+    archive = _worker_archive(root)
+    pages = [archive.get(digest) for digest in digests]
+    extractor = JsonExtractor(api_mapping) if kind == API else None
+    return parse_floor_plans(pages, extractor, max_rows), sum(len(page) for page in pages)
+
+_worker_archives = {}
+
+def _worker_archive(root):
+    # one per worker process, not one per snapshot
+    if root not in _worker_archives:
+        _worker_archives[root] = SnapshotArchive(root)
+    return _worker_archives[root]
+
+def reprocess_site(site, archive, history, workers=None, dry_run=False):
+    """Parse every archived snapshot of a site again and rebuild its history and results from them.
+
+    Each distinct snapshot is parsed once, on a process pool. History
+    recorded before the archive starts is kept. Nothing is sent to Discord.
+    Returns a dict of counts and timings for the report.
+    """
+    from crawl import save_results, site_content_hash
+    from diff import diff_plans
+    from render import render_markdown
+
+    checks = archive.checks(site['name'])
+    report = {'site': site['name'], 'checks': len(checks), 'snapshots': 0, 'plans': 0, 'changes': 0, 'bytes': 0,
+              'parse': 0.0, 'history': 0.0}
+    if not checks:
+        return report
+
+    start = time.perf_counter()
+    snapshots = [(check['kind'], check['pages']) for check in checks]
+    unique = list(dict.fromkeys(snapshots))
+    jobs = [(archive.root, kind, digests, site['api_mapping'], site['max_rows']) for kind, digests in unique]
+    # a few chunks per worker, one snapshot per task spends more on pickling than on parsing
+    chunksize = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))
+    parsed = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for snapshot, (floor_plans, size) in zip(unique, executor.map(_parse_check, jobs, chunksize=chunksize)):
+            parsed[snapshot] = floor_plans
+            report['bytes'] += size
+    report['snapshots'] = len(unique)
+    report['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    previous = None
+    for snapshot in snapshots:
+        floor_plans = parsed[snapshot]
+        if previous is not None and floor_plans is not previous:
+            report['changes'] += len(diff_plans(previous, floor_plans))
+        if floor_plans:
+            previous = floor_plans
+    if not dry_run:
+        checks_to_record = []
+        previous_snapshot = None
+        last = None
+        for check, snapshot in zip(checks, snapshots):
+            floor_plans = parsed[snapshot]
+            if not floor_plans:
+                # a check that found nothing wasn't recorded when it ran either
+                continue
+            # same page as the check before, recorded the way the crawler records an unchanged page
+            checks_to_record.append((check['fetched_at'], None if snapshot == previous_snapshot else floor_plans))
+            previous_snapshot = snapshot
+            last = check
+        history.rebuild_since(site['name'], checks[0]['fetched_at'], checks_to_record)
+
+        if last is not None:
+            floor_plans = parsed[previous_snapshot]
+            # hashed with today's parser, so the next check can skip parsing the same page again
+            page_hash = site_content_hash(site, [archive.get(digest) for digest in last['pages']])
+            save_results(floor_plans, site['results_file'], page_hash, last['fetched_at'])
+            with open(site['markdown_file'], 'w', encoding='utf-8') as f:
+                f.write(render_markdown(floor_plans, site['name']))
+    report['plans'] = sum(len(plans) for plans in parsed.values())
+    report['history'] = time.perf_counter() - start
+    return report
+
+def main():
+    from history import HistoryStore
+
+    parser = argparse.ArgumentParser(description='The archive of fetched pages: what is in it, and parsing it all again')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    reprocess_parser = subparsers.add_parser('reprocess', help='Parse every archived page with the current extractor, rebuild results and history')
+    reprocess_parser.add_argument('--site', action='append', help='Only this site, can be repeated (default: all)')
+    reprocess_parser.add_argument('--workers', type=int, help='Parser processes (default: one per CPU)')
+    reprocess_parser.add_argument('--dry-run', action='store_true', help='Parse and count, but leave results and history alone')
+    subparsers.add_parser('stats', help='How much is archived')
+    args = parser.parse_args()
+
+    archive = SnapshotArchive()
+
+    if args.command == 'stats':
+        sites, objects, size = archive.stats()
+        for row in sites:
+            print(f"{row['site']:<24} {row['checks']:>7} checks  {row['first'][:16]} → {row['last'][:16]}")
+        print(f"{objects} distinct pages, {size / 1024 / 1024:.1f}MB compressed")
+        return
+
+    sites = [site for site in SITES if not args.site or site['name'] in args.site]
+    if not sites:
+        print("Error: No matching sites")
+        return
+
+    history = HistoryStore(HISTORY_DB)
+    print(f"{'site':<24} {'checks':>7} {'distinct':>9} {'plans':>8} {'changes':>8} {'parse':>8} {'history':>8} {'snap/s':>8} {'MB/s':>6}")
+    totals = {'checks': 0, 'snapshots': 0, 'bytes': 0, 'parse': 0.0, 'history': 0.0}
+    for site in sites:
+        report = reprocess_site(site, archive, history, args.workers, args.dry_run)
+        for key in totals:
+            totals[key] += report[key]
+        parse = report['parse'] or 1e-9
+        print(f"{site['name']:<24} {report['checks']:>7} {report['snapshots']:>9} {report['plans']:>8} {report['changes']:>8} "
+              f"{report['parse']:>7.2f}s {report['history']:>7.2f}s {report['snapshots'] / parse:>8.0f} {report['bytes'] / 1024 / 1024 / parse:>6.1f}")
+
+    elapsed = totals['parse'] + totals['history']
+    print(f"\n{totals['checks']} checks ({totals['snapshots']} distinct snapshots, {totals['bytes'] / 1024 / 1024:.1f}MB of html) "
+          f"in {elapsed:.2f}s, {totals['checks'] / (elapsed or 1e-9):.0f} checks/s")
+    if args.dry_run:
+        print("Dry run, results and history weren't touched")
+
+if __name__ == "__main__":
+    main()
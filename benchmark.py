@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import contextlib
+import resource
+import statistics
+import subprocess
+import tracemalloc
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PIPELINE_SIZES = [5, 50, 500, 5000]
+PIPELINE_STAGES = ['check', 'fetch', 'parse', 'diff', 'save', 'history', 'markdown', 'enqueue', 'send']
+
+def load_fixture(path, scale=1):
+    with open(path, 'r', encoding='utf-8') as f:
+        html_content = f.read()
+    # repeat the listing to simulate bigger pages
+    return html_content * scale
+
+def run_worker(backend, fixture, scale, repeat):
+    """Benchmark one backend on one fixture. Runs in its own process so RSS numbers don't mix."""
+    from crawl import parse_floor_plans
+    from extractors import get_extractor
+    from models import plans_to_dicts
+
+    extractor = get_extractor(backend)
+    html_content = load_fixture(fixture, scale)
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    floor_plans = parse_floor_plans(html_content, extractor)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse_floor_plans(html_content, extractor)
+        timings.append(time.perf_counter() - start)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # separate pass, tracemalloc slows everything down
+    tracemalloc.start()
+    parse_floor_plans(html_content, extractor)
+    _, peak_heap = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        'median_ms': statistics.median(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'rss_delta_kb': peak_rss - baseline_rss,
+        'py_heap_kb': peak_heap // 1024,
+        'floor_plans': plans_to_dicts(floor_plans),
+    }))
+
+def run_benchmark(backends, fixtures, scale, repeat):
+    results = []
+    for fixture in fixtures:
+        size_kb = len(load_fixture(fixture, scale).encode('utf-8')) // 1024
+        outputs = {}
+        for backend in backends:
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', backend, fixture,
+                 '--scale', str(scale), '--repeat', str(repeat)],
+                capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                print(f"{backend} failed on {fixture}:\n{proc.stderr}")
+                continue
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            outputs[backend] = result.pop('floor_plans')
+            results.append((os.path.basename(fixture), size_kb, backend, result, len(outputs[backend])))
+
+        # every backend has to agree with the others
+        if len({json.dumps(plans, sort_keys=True) for plans in outputs.values()}) > 1:
+            print(f"WARNING: backends disagree on {os.path.basename(fixture)}")
+
+    print(f"{'fixture':<24} {'size':>7} {'backend':<6} {'plans':>5} {'median':>10} {'min':>10} {'rss Δ':>9} {'py heap':>9}")
+    print("-" * 88)
+    for name, size_kb, backend, result, plans in results:
+        print(f"{name:<24} {size_kb:>5}kB {backend:<6} {plans:>5} {result['median_ms']:>8.2f}ms {result['min_ms']:>8.2f}ms "
+              f"{result['rss_delta_kb']:>7}kB {result['py_heap_kb']:>7}kB")
+
+def run_page_load_benchmark(url, xpath, loads):
+    """Load one page with the full and the lean profile and compare each stage."""
+    from crawl import BrowserSession, fetch_rendered_container
+
+    stages = ['startup', 'navigate', 'ready']
+    medians = {}
+    for profile, lean in (('full', False), ('lean', True)):
+        session = BrowserSession(recycle_after=loads + 1, lean=lean)
+        runs = []
+        try:
+            for _ in range(loads):
+                timings = {}
+                fetch_rendered_container(url, xpath, session, timings)
+                runs.append(timings)
+        finally:
+            session.close()
+        # chrome only starts on the first load
+        medians[profile] = {stage: statistics.median(run[stage] for run in (runs[:1] if stage == 'startup' else runs))
+                            for stage in stages}
+        medians[profile]['total'] = sum(medians[profile][stage] for stage in stages)
+
+    print(f"{'stage':<10} {'full':>9} {'lean':>9} {'saved':>9}")
+    print("-" * 40)
+    for stage in stages + ['total']:
+        full, lean = medians['full'][stage], medians['lean'][stage]
+        print(f"{stage:<10} {full:>8.2f}s {lean:>8.2f}s {full - lean:>8.2f}s")
+
+def run_pipeline_worker(size, checks, page_size=None):
+    """Run `checks` full checks of a synthetic listing through the replay harness, in its own process for RSS.
+
+    With `page_size` the listing is split over linked pages of that many plans.
+    """
+    from replay import Replay, synthetic_listing, synthetic_pages
+    from metrics import percentile
+
+    # every page is different from the last, so nothing gets skipped by the content hash
+    if page_size:
+        pages = [synthetic_pages(size, variant, page_size) for variant in range(checks + 1)]
+    else:
+        pages = [synthetic_listing(size, variant) for variant in range(checks + 1)]
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')), Replay() as replay:
+        # the first check sends the whole table, keep it out of the numbers
+        replay.check(pages[0])
+        replay.reset_metrics()
+
+        start = time.perf_counter()
+        for page in pages[1:]:
+            replay.check(page)
+        elapsed = time.perf_counter() - start
+
+        stages, counters = replay.metrics.summary()[replay.site_name]
+        rejected = len(replay.discord.rejected)
+
+    print(json.dumps({
+        'checks_per_sec': checks / elapsed,
+        'plans': counters.get('plans_found', 0) // checks,
+        'stages': {stage: [percentile(values, 0.5), percentile(values, 0.95)] for stage, values in stages.items()},
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'rss_delta_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss,
+        'rejected': rejected,
+    }))
+
+def run_pipeline_benchmark(sizes, checks, page_size=None):
+    """End to end checks per second, per stage latency and peak RSS for each listing size, fully offline."""
+    results = []
+    for size in sizes:
+        command = [sys.executable, os.path.abspath(__file__), '--pipeline-worker', str(size), '--checks', str(checks)]
+        if page_size:
+            command += ['--page-size', str(page_size)]
+        proc = subprocess.run(command, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"Pipeline benchmark failed for {size} plans:\n{proc.stderr}")
+            continue
+        results.append((size, json.loads(proc.stdout.strip().splitlines()[-1])))
+
+    print(f"{'listing':>8} {'parsed':>7} {'checks/s':>9} {'check p50':>10} {'check p95':>10} {'peak rss':>10} {'rejected':>9}")
+    print("-" * 70)
+    for size, result in results:
+        check_p50, check_p95 = result['stages'].get('check', [0, 0])
+        print(f"{size:>8} {result['plans']:>7} {result['checks_per_sec']:>9.1f} {check_p50 * 1000:>8.1f}ms "
+              f"{check_p95 * 1000:>8.1f}ms {result['peak_rss_kb'] / 1024:>8.1f}MB {result['rejected']:>9}")
+
+    print("\np50 / p95 per stage in ms")
+    print(f"{'listing':>8} " + " ".join(f"{stage:>15}" for stage in PIPELINE_STAGES[1:]))
+    for size, result in results:
+        cells = []
+        for stage in PIPELINE_STAGES[1:]:
+            p50, p95 = result['stages'].get(stage, [0, 0])
+            cells.append(f"{p50 * 1000:>7.2f}/{p95 * 1000:<7.2f}")
+        print(f"{size:>8} " + " ".join(cells))
+
+def run_alert_benchmark(users, sizes, repeat, sites=20):
+    """How long matching one alert against `users` users' rules takes, index vs checking every rule."""
+    import random
+    from alerts import AlertRule, RuleIndex, alert_events
+    from diff import diff_plans
+    from models import Bedrooms, FloorPlan
+
+    rng = random.Random(0)
+    site_names = [f"Site {i}" for i in range(sites)]
+    rules = []
+    for user_id in range(users):
+        for _ in range(3):
+            rules.append(AlertRule(
+                len(rules) + 1, user_id,
+                rng.choice(site_names + [None]),
+                rng.choice(list(Bedrooms)[1:] + [None]),
+                rng.choice([None, rng.randrange(1000, 4000) * 100]),
+                rng.choice([None, rng.randrange(400, 1200)]),
+                rng.random() < 0.3,
+            ))
+
+    start = time.perf_counter()
+    index = RuleIndex(rules)
+    build = time.perf_counter() - start
+
+    def scan(site_name, plan, opened):
+        return {rule.user_id for rule in rules
+                if rule.site in (None, site_name) and rule.bedrooms in (None, plan.bedrooms)
+                and rule.rent_ceiling >= (plan.rent_cents or float('inf'))
+                and (rule.min_sqft is None or (plan.sqft or 0) >= rule.min_sqft)
+                and (opened or not rule.available_only)}
+
+    print(f"{len(rules)} rules for {users} users over {sites} sites, index built in {build * 1000:.2f}ms")
+    print(f"{'listing':>8} {'changes':>8} {'pinged':>7} {'index':>10} {'scan':>10}")
+    print("-" * 48)
+    for size in sizes:
+        def listing(variant):
+            return [FloorPlan.create(f"Plan {i}", i % 4, 1.0, 500 + i % 700,
+                                     (1200 + (i * 37 + variant * 11 * (i % 3)) % 2500) * 100,
+                                     'Available now' if (i + variant) % 5 == 0 else 'Contact for availability')
+                    for i in range(size)]
+        old, new = listing(0), listing(1)
+        changes = diff_plans(old, new)
+        site_name = rng.choice(site_names)
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            pinged = index.users_to_ping(site_name, new, changes)
+            timings.append(time.perf_counter() - start)
+
+        scans = []
+        for _ in range(max(1, repeat // 10)):
+            start = time.perf_counter()
+            expected = set()
+            for plan, opened in alert_events(new, changes):
+                expected |= scan(site_name, plan, opened)
+            scans.append(time.perf_counter() - start)
+        if expected != pinged:
+            print(f"Warning: index and scan disagree for {size} plans")
+        print(f"{size:>8} {len(changes):>8} {len(pinged):>7} {statistics.median(timings) * 1000:>8.2f}ms {statistics.median(scans) * 1000:>8.2f}ms")
+
+def main():
+    # nothing here talks to discord, importing replay fills in placeholder settings so config loads without a .env
+    import replay  # noqa: F401
+    from extractors import EXTRACTORS
+
+    parser = argparse.ArgumentParser(description='Benchmark the floor plan extractor backends on saved HTML fixtures, whole checks, or chrome page loads')
+    parser.add_argument('fixtures', nargs='*', help=f'HTML files to parse (default: everything in {FIXTURES_DIR})')
+    parser.add_argument('--backend', action='append', choices=list(EXTRACTORS),
+                       help='Backend to benchmark, can be repeated (default: all)')
+    parser.add_argument('--scale', type=int, default=1, help='Repeat each fixture this many times to make bigger pages')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per fixture and backend')
+    parser.add_argument('--page-load', nargs=2, metavar=('URL', 'XPATH'),
+                       help='Instead of the parsers, compare full and lean chrome page loads on a live page')
+    parser.add_argument('--pipeline', action='store_true',
+                       help='Instead of the parsers, benchmark whole checks offline against synthetic listings')
+    parser.add_argument('--sizes', type=int, nargs='+', default=PIPELINE_SIZES, help='Listing sizes (plans) for --pipeline')
+    parser.add_argument('--checks', type=int, default=20, help='Checks per listing size with --pipeline')
+    parser.add_argument('--page-size', type=int, help='Split the --pipeline listings over linked pages of this many plans')
+    parser.add_argument('--pipeline-worker', type=int, metavar='SIZE', help=argparse.SUPPRESS)
+    parser.add_argument('--alerts', type=int, metavar='USERS',
+                       help='Instead of the parsers, time matching alerts against this many users\' rules (3 each)')
+    parser.add_argument('--loads', type=int, default=3, help='Page loads per profile with --page-load')
+    parser.add_argument('--worker', nargs=2, metavar=('BACKEND', 'FIXTURE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], args.worker[1], args.scale, args.repeat)
+        return
+
+    if args.pipeline_worker:
+        run_pipeline_worker(args.pipeline_worker, args.checks, args.page_size)
+        return
+
+    if args.pipeline:
+        run_pipeline_benchmark(args.sizes, args.checks, args.page_size)
+        return
+
+    if args.alerts:
+        run_alert_benchmark(args.alerts, args.sizes, args.repeat)
+        return
+
+    if args.page_load:
+        run_page_load_benchmark(args.page_load[0], args.page_load[1], args.loads)
+        return
+
+    fixtures = args.fixtures or sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html')))
+    run_benchmark(args.backend or list(EXTRACTORS), fixtures, args.scale, args.repeat)
+
+if __name__ == "__main__":
+    main()
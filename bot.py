@@ -0,0 +1,169 @@
+import heapq
+import typing
+import discord
+from discord.ext import commands
+from config import DISCORD_TOKEN, DISCORD_CHANNEL_ID, COMMAND_RATE, COMMAND_RATE_PERIOD
+from messages import format_site_status, format_plan, format_price_history, MESSAGE_LIMIT
+from alerts import get_alert_rules, parse_rule_args
+from diff import rent_value
+from render import chunk_lines, table_chunks
+from snapshots import SnapshotCache
+
+class QueryCommands(commands.Cog):
+    """!status, !cheapest, !history and !site, answered from the results the crawler last saved.
+
+    None of them fetch anything, a command can't make the crawler do extra work.
+    """
+
+    def __init__(self, snapshots=None):
+        self.snapshots = snapshots or SnapshotCache()
+
+    def _site(self, name):
+        site = self.snapshots.find_site(name)
+        if site is None:
+            raise commands.BadArgument(f"Unknown site `{name}`, try one of: {', '.join(site['name'] for site in self.snapshots.sites)}")
+        return site
+
+    @commands.command(help='Every site\'s latest results and when it gets checked next')
+    async def status(self, ctx):
+        lines = [format_site_status(site, snapshot, self.snapshots.schedule(site)) for site, snapshot in self.snapshots.all()]
+        await ctx.reply(chunk_lines(lines, MESSAGE_LIMIT)[0])
+
+    @commands.command(help='The cheapest plans, over every site or one: !cheapest, !cheapest 10, !cheapest 5 Big Complex')
+    async def cheapest(self, ctx, count: typing.Optional[int] = 5, *, site_name=None):
+        sites = [self._site(site_name)] if site_name else self.snapshots.sites
+        count = max(1, min(count, 20))
+        candidates = []
+        for site in sites:
+            snapshot = self.snapshots.get(site)
+            if snapshot is not None:
+                # each site's list is already sorted, so its first `count` are all that can make it
+                candidates.extend((plan, site['name']) for plan in snapshot.by_rent[:count])
+        if not candidates:
+            await ctx.reply("No prices yet, the sites haven't been checked")
+            return
+        cheapest = heapq.nsmallest(count, candidates, key=lambda candidate: rent_value(candidate[0]))
+        show_site = len(sites) > 1
+        await ctx.reply(chunk_lines([format_plan(plan, name if show_site else None) for plan, name in cheapest], MESSAGE_LIMIT)[0])
+
+    @commands.command(help='A plan\'s rent over time: !history A1')
+    async def history(self, ctx, *, plan_name):
+        replies = []
+        for site, snapshot in self.snapshots.all():
+            if snapshot is not None and plan_name.strip().lower() in snapshot.by_name:
+                name = snapshot.by_name[plan_name.strip().lower()][0].name
+                replies.append(format_price_history(site['name'], name, self.snapshots.price_history(site, name)))
+        if not replies:
+            await ctx.reply(f"No plan called `{plan_name}` right now, !site <name> lists them")
+            return
+        await ctx.reply(chunk_lines(replies, MESSAGE_LIMIT)[0])
+
+    @commands.command(help='One site\'s current floor plans: !site Big Complex')
+    async def site(self, ctx, *, site_name):
+        site = self._site(site_name)
+        snapshot = self.snapshots.get(site)
+        if snapshot is None or not snapshot.floor_plans:
+            await ctx.reply(f"{site['name']} hasn't been checked yet")
+            return
+        chunks = table_chunks(snapshot.floor_plans, 'compact', MESSAGE_LIMIT - 100)
+        more = f"\n…and more, {len(snapshot.floor_plans)} plans in all" if len(chunks) > 1 else ""
+        await ctx.reply(f"**{site['name']}**{more}\n{chunks[0]}")
+
+class AlertCommands(commands.Cog):
+    """!subscribe, !unsubscribe and !subscriptions, so people pick what they get pinged for."""
+
+    def __init__(self, rules=None):
+        self.rules = rules or get_alert_rules()
+
+    @commands.command(help='Get pinged for matching changes: !subscribe site="Name" beds=1 max_rent=1500 min_sqft=600 available')
+    async def subscribe(self, ctx, *, args=''):
+        try:
+            fields = parse_rule_args(args)
+        except ValueError as e:
+            await ctx.reply(str(e))
+            return
+        rule = self.rules.add(ctx.author.id, **fields)
+        await ctx.reply(f"Subscribed {rule.describe()}")
+
+    @commands.command(help='Remove one rule by its number, or all of yours: !unsubscribe 3, !unsubscribe all')
+    async def unsubscribe(self, ctx, rule_id='all'):
+        if rule_id.lower() == 'all':
+            removed = self.rules.remove(ctx.author.id)
+        elif rule_id.lstrip('#').isdigit():
+            removed = self.rules.remove(ctx.author.id, int(rule_id.lstrip('#')))
+        else:
+            await ctx.reply("Give a rule number from !subscriptions, or `all`")
+            return
+        await ctx.reply(f"Removed {removed} rule(s)" if removed else "No matching rule to remove")
+
+    @commands.command(help='List your alert rules')
+    async def subscriptions(self, ctx):
+        rules = self.rules.for_user(ctx.author.id)
+        if not rules:
+            await ctx.reply("You have no alert rules, add one with !subscribe")
+            return
+        await ctx.reply("\n".join(rule.describe() for rule in rules))
+
+class ApartmentBot(commands.Bot):
+    def __init__(self):
+        intents = discord.Intents.default()
+        intents.message_content = True
+        intents.guilds = True
+        super().__init__(command_prefix='!', intents=intents)
+        self.channel_cache = {}
+        # one budget per user over every command, so nobody can flood the bot (or get it rate limited)
+        self.command_limits = commands.CooldownMapping.from_cooldown(COMMAND_RATE, COMMAND_RATE_PERIOD, commands.BucketType.user)
+        # a before-invoke hook rather than a check, !help runs the checks of every command it lists
+        self.before_invoke(self.rate_limit)
+        self.warned_until = {}
+
+    async def setup_hook(self):
+        await self.add_cog(AlertCommands())
+        await self.add_cog(QueryCommands())
+
+    async def rate_limit(self, ctx):
+        bucket = self.command_limits.get_bucket(ctx.message)
+        retry_after = bucket.update_rate_limit()
+        if retry_after:
+            raise commands.CommandOnCooldown(bucket, retry_after, commands.BucketType.user)
+
+    async def on_command_error(self, ctx, error):
+        if isinstance(error, commands.CommandNotFound):
+            return
+        if isinstance(error, commands.CommandOnCooldown):
+            # say so once per window, replying to every extra command would be its own flood
+            now = discord.utils.utcnow().timestamp()
+            if self.warned_until.get(ctx.author.id, 0) < now:
+                self.warned_until[ctx.author.id] = now + error.retry_after
+                await ctx.reply(f"Slow down, try again in {error.retry_after:.0f}s")
+            return
+        if isinstance(error, commands.UserInputError):
+            await ctx.reply(f"{error}\nUsage: `!{ctx.command.qualified_name} {ctx.command.signature}`")
+            return
+        print(f"Error in !{ctx.command}: {error}")
+        
+    async def on_ready(self):
+        print(f'Bot logged in as {self.user}')
+        print(f'Bot is in {len(self.guilds)} guilds')
+        for guild in self.guilds:
+            print(f'  - {guild.name} (ID: {guild.id})')
+            if guild.id == 996300166606901339:
+                print(f'    Found target server! Channels: {len(guild.channels)}')
+                for channel in guild.channels:
+                    if channel.id == DISCORD_CHANNEL_ID:
+                        print(f'    Found target channel: {channel.name}')
+
+    async def get_message_channel(self, channel_id):
+        # fetch_channel is an api call, only do it once per channel
+        if channel_id not in self.channel_cache:
+            self.channel_cache[channel_id] = await self.fetch_channel(channel_id)
+        return self.channel_cache[channel_id]
+
+    async def send_message(self, target, payload):
+        channel = await self.get_message_channel(target['channel_id'])
+        embeds = [discord.Embed.from_dict(embed) for embed in payload.get('embeds', [])]
+        await channel.send(content=payload.get('content'), embeds=embeds)
+
+if __name__ == "__main__":
+    # keep the bot online to answer commands, the checks run separately (run_monitor.py)
+    ApartmentBot().run(DISCORD_TOKEN)
@@ -1,4 +1,6 @@
 import os
+import re
+import json
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,21 +9,149 @@ load_dotenv()
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DISCORD_CHANNEL_ID = int(os.getenv('DISCORD_CHANNEL_ID'))
 STATUS_CHANNEL_ID = int(os.getenv('STATUS_CHANNEL_ID'))
-# parse comma-separated user IDs from env
+# parse comma-separated user IDs from env, these get pinged for every alert (everyone else
+# sets up their own alert rules with the bot's !subscribe command)
 ping_users_str = os.getenv('PING_USERS', '')
 PING_USERS = [int(uid.strip()) for uid in ping_users_str.split(',') if uid.strip()]
+# "rest" sends through the http api (or webhooks) without a gateway login, "gateway" uses the full bot
+DISCORD_DELIVERY = os.getenv('DISCORD_DELIVERY', 'rest')
+DISCORD_API_BASE = os.getenv('DISCORD_API_BASE', 'https://discord.com/api/v10')
+# optional webhooks, used instead of the bot token for those channels
+DISCORD_WEBHOOK_URL = os.getenv('DISCORD_WEBHOOK_URL')
+STATUS_WEBHOOK_URL = os.getenv('STATUS_WEBHOOK_URL')
 
 # where to store data
 RESULTS_FILE = "floor_plans.json"
 MARKDOWN_FILE = "floor_plans.md"
+HTTP_CACHE_FILE = "http_cache.json"
+DRIVER_CACHE_FILE = "driver_cache.json"  # which chromedriver worked last time, so startup doesn't search again
+HISTORY_DB = os.getenv('HISTORY_DB', 'history.db')
+OUTBOX_DB = "outbox.db"
+SUBSCRIPTIONS_DB = "subscriptions.db"  # users' alert rules
+METRICS_LOG = "metrics.jsonl"
+# point this into node_exporter's --collector.textfile.directory to scrape it
+METRICS_PROM_FILE = os.getenv('METRICS_PROM_FILE', 'metrics.prom')
+METRICS_WINDOW = int(os.getenv('METRICS_WINDOW', '200'))  # checks per site the p50/p95 figures cover
+# per-site results go in DATA_DIR/<site>/ when monitoring several sites
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+# every fetched page, gzipped and stored once per distinct content, for `python archive.py reprocess`
+ARCHIVE = os.getenv('ARCHIVE', '1').lower() in ('1', 'true', 'yes')
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
 
 # site config
+SITE_NAME = os.getenv('SITE_NAME', 'Ariel Court Apartments')
 TARGET_URL = os.getenv('TARGET_URL')
 TARGET_XPATH = os.getenv('TARGET_XPATH')
+# optional json list of sites, overrides TARGET_URL / TARGET_XPATH
+SITES_FILE = os.getenv('SITES_FILE', 'sites.json')
+# set for sites that only render the floor plans with javascript, skips the plain http attempt
+JS_ONLY = os.getenv('JS_ONLY', '').lower() in ('1', 'true', 'yes')
+HTTP_TIMEOUT = 15
 PAGE_LOAD_TIMEOUT = 3
 WEBDRIVER_WAIT_TIMEOUT = 15
 WINDOW_SIZE = "1920,1080"
 
+# lean page loads: eager load strategy, heavy resources blocked and no fixed
+# sleep, the container just has to stop changing for CONTAINER_STABLE_MS
+LEAN_LOAD = os.getenv('LEAN_LOAD', '1').lower() in ('1', 'true', 'yes')
+CONTAINER_STABLE_MS = int(os.getenv('CONTAINER_STABLE_MS', '500'))
+# chrome devtools can only block by url, so resource types map to file extensions
+BLOCKED_RESOURCE_TYPES = os.getenv('BLOCKED_RESOURCE_TYPES', 'image,media,font').split(',')
+RESOURCE_TYPE_PATTERNS = {
+    'image': ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico', '*.bmp'],
+    'media': ['*.mp4', '*.webm', '*.ogg', '*.mp3', '*.wav', '*.m4a', '*.mov', '*.m3u8'],
+    'font': ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot'],
+    'stylesheet': ['*.css'],
+}
+BLOCKED_URL_PATTERNS = [
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*facebook.net*', '*connect.facebook.com*', '*hotjar.com*', '*clarity.ms*',
+    '*youtube.com/embed*', '*maps.googleapis.com*', '*maps.gstatic.com*',
+] + [pattern for pattern in os.getenv('BLOCKED_URL_PATTERNS', '').split(',') if pattern]
+# html parsing backend: "lxml" (fast) or "bs4" (the original BeautifulSoup parser)
+EXTRACTOR = os.getenv('EXTRACTOR', 'lxml')
+
+# paginated listings: NEXT_XPATH matches the "next page" link or "load more" button,
+# INFINITE_SCROLL keeps scrolling to the bottom instead (both per site in the sites file)
+NEXT_XPATH = os.getenv('NEXT_XPATH') or None
+INFINITE_SCROLL = os.getenv('INFINITE_SCROLL', '').lower() in ('1', 'true', 'yes')
+MAX_PAGES = int(os.getenv('MAX_PAGES', '10'))  # pages (or load more clicks / scrolls) per check
+MAX_ROWS = int(os.getenv('MAX_ROWS', '2000'))  # candidate rows parsed per check, over all pages
+
+# read the floor plans from the site's own json api instead of the page: API_PATTERN is a
+# regex for the api's url and API_MAPPING the json field mapping (see JsonExtractor)
+API_PATTERN = os.getenv('API_PATTERN') or None
+API_MAPPING = json.loads(os.getenv('API_MAPPING') or 'null')
+
+# stripped from the container html before hashing it, so tokens and timestamps
+# that change on every page load don't count as a change (sites can add their
+# own with "normalize" in the sites file). api_pattern sites get only their own,
+# these would strip the dates a json api returns as data
+CONTENT_NORMALIZE_PATTERNS = [
+    r'<input[^>]*(?:csrf|token|nonce)[^>]*>',
+    r'\s(?:nonce|data-csrf[\w-]*|data-token|data-timestamp|data-time)="[^"]*"',
+    r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?',
+    r'[?&](?:_|v|t|ts|cb)=\d+',
+]
+
+# daemon mode
+DAEMON_INTERVAL = int(os.getenv('DAEMON_INTERVAL', '600'))  # seconds between checks
+DRIVER_RECYCLE_AFTER = int(os.getenv('DRIVER_RECYCLE_AFTER', '50'))  # checks before restarting chrome
+
+def total_memory_mb():
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+# low-memory chrome for small boards (1 GB pis), "auto" turns it on below 2 GB of ram
+LOW_MEMORY = os.getenv('LOW_MEMORY', 'auto').lower()
+LOW_MEMORY = (total_memory_mb() or 4096) < 2048 if LOW_MEMORY == 'auto' else LOW_MEMORY in ('1', 'true', 'yes')
+JS_HEAP_MB = int(os.getenv('JS_HEAP_MB', '256'))  # v8 heap cap per renderer in low-memory mode
+# the watchdog restarts chrome when chromedriver + chrome use more than this (0 turns it off).
+# between checks it already recycles at BROWSER_RECYCLE_AT of the limit, so a check rarely hits it
+BROWSER_RSS_LIMIT_MB = int(os.getenv('BROWSER_RSS_LIMIT_MB', '450' if LOW_MEMORY else '0'))
+BROWSER_RECYCLE_AT = 0.75
+WATCHDOG_INTERVAL = 1.0  # seconds between memory samples
+EXIT_RETRY = 75  # exit code when chrome crashed, the check is worth retrying (EX_TEMPFAIL)
+
+# adaptive schedule: a site is polled every MIN_INTERVAL seconds after it changes and slows
+# down by SCHEDULE_BACKOFF per quiet check up to MAX_INTERVAL (sites can override both)
+SCHEDULE_FILE = "schedule.json"
+SCHEDULE_MIN_INTERVAL = int(os.getenv('SCHEDULE_MIN_INTERVAL', '120'))
+SCHEDULE_MAX_INTERVAL = int(os.getenv('SCHEDULE_MAX_INTERVAL', '3600'))
+SCHEDULE_BACKOFF = 1.5
+SCHEDULE_JITTER = 0.1  # +/- fraction added to every delay so checks don't line up
+
+# several workers (--worker) share the sites through leases in COORDINATOR_DB, put it on a
+# volume they all reach. a lease runs out LEASE_TTL seconds after its worker's last heartbeat
+COORDINATOR_DB = os.getenv('COORDINATOR_DB', 'coordinator.db')
+LEASE_TTL = int(os.getenv('LEASE_TTL', '120'))
+WORKER_POLL = int(os.getenv('WORKER_POLL', '30'))  # longest a worker sleeps before looking for due sites again
+
+# notification outbox
+OUTBOX_DEBOUNCE = int(os.getenv('OUTBOX_DEBOUNCE', '120'))  # seconds an alert waits for follow-up changes, availability and cron runs skip this
+OUTBOX_BACKOFF_BASE = 5  # seconds before the first retry, doubles every attempt
+OUTBOX_BACKOFF_MAX = 900
+OUTBOX_MAX_ATTEMPTS = 20
+OUTBOX_MAX_WAIT = 30  # how long a run waits around for retries before leaving them for next time
+
+# concurrency limits, keep these low on a raspberry pi
+MAX_CONCURRENT_CHECKS = int(os.getenv('MAX_CONCURRENT_CHECKS', '4'))  # sites checked at once
+MAX_BROWSERS = int(os.getenv('MAX_BROWSERS', '1' if LOW_MEMORY else '2'))  # chrome instances shared by those checks
+
+# rendered tables kept in memory, keyed by snapshot
+RENDER_CACHE_SIZE = 32
+# a big table is split over several discord messages, up to this many per alert
+ALERT_MAX_MESSAGES = int(os.getenv('ALERT_MAX_MESSAGES', '4'))
+# bot commands a user can run per COMMAND_RATE_PERIOD seconds
+COMMAND_RATE = int(os.getenv('COMMAND_RATE', '5'))
+COMMAND_RATE_PERIOD = float(os.getenv('COMMAND_RATE_PERIOD', '60'))
+
 # scraper setup
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
@@ -38,7 +168,93 @@ CHROME_OPTIONS = [
     "--headless"
 ]
 
+# added in low-memory mode: one renderer, no gpu, (almost) no caches and a capped js heap
+LOW_MEMORY_CHROME_OPTIONS = [
+    "--renderer-process-limit=1",
+    "--disable-features=site-per-process,BackForwardCache,Translate",
+    "--disable-gpu",
+    "--disable-software-rasterizer",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disk-cache-size=1",
+    "--media-cache-size=1",
+    "--aggressive-cache-discard",
+    f"--js-flags=--max-old-space-size={JS_HEAP_MB}",
+]
+
 CHROME_EXPERIMENTAL_OPTIONS = {
     "excludeSwitches": ["enable-automation"],
     "useAutomationExtension": False
 }
+
+def site_slug(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or 'site'
+
+def load_sites():
+    """Build the list of sites to monitor.
+
+    Uses SITES_FILE if it exists, otherwise falls back to the single
+    TARGET_URL / TARGET_XPATH site from the environment (which keeps its
+    results in RESULTS_FILE / MARKDOWN_FILE like before).
+    """
+    if not os.path.exists(SITES_FILE):
+        if not TARGET_URL:
+            return []
+        return [{
+            'name': SITE_NAME,
+            'url': TARGET_URL,
+            'xpath': TARGET_XPATH,
+            'interval': DAEMON_INTERVAL,
+            'min_interval': SCHEDULE_MIN_INTERVAL,
+            'max_interval': max(SCHEDULE_MIN_INTERVAL, SCHEDULE_MAX_INTERVAL),
+            'channel_id': DISCORD_CHANNEL_ID,
+            'status_channel_id': STATUS_CHANNEL_ID,
+            'webhook_url': DISCORD_WEBHOOK_URL,
+            'status_webhook_url': STATUS_WEBHOOK_URL,
+            'js_only': JS_ONLY,
+            'normalize': [],
+            'next_xpath': NEXT_XPATH,
+            'infinite_scroll': INFINITE_SCROLL,
+            'max_pages': MAX_PAGES,
+            'max_rows': MAX_ROWS,
+            'api_pattern': API_PATTERN,
+            'api_mapping': API_MAPPING,
+            'results_file': RESULTS_FILE,
+            'markdown_file': MARKDOWN_FILE,
+        }]
+
+    with open(SITES_FILE, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+
+    sites = []
+    for entry in entries:
+        site_dir = os.path.join(DATA_DIR, site_slug(entry['name']))
+        min_interval = int(entry.get('min_interval', SCHEDULE_MIN_INTERVAL))
+        sites.append({
+            'name': entry['name'],
+            'url': entry['url'],
+            'xpath': entry['xpath'],
+            'interval': int(entry.get('interval', DAEMON_INTERVAL)),
+            'min_interval': min_interval,
+            'max_interval': max(min_interval, int(entry.get('max_interval', SCHEDULE_MAX_INTERVAL))),
+            'channel_id': int(entry.get('channel_id', DISCORD_CHANNEL_ID)),
+            'status_channel_id': int(entry.get('status_channel_id', STATUS_CHANNEL_ID)),
+            'webhook_url': entry.get('webhook_url', DISCORD_WEBHOOK_URL),
+            'status_webhook_url': entry.get('status_webhook_url', STATUS_WEBHOOK_URL),
+            'js_only': bool(entry.get('js_only', JS_ONLY)),
+            'normalize': list(entry.get('normalize', [])),
+            'next_xpath': entry.get('next_xpath'),
+            'infinite_scroll': bool(entry.get('infinite_scroll', False)),
+            'max_pages': max(1, int(entry.get('max_pages', MAX_PAGES))),
+            'max_rows': int(entry.get('max_rows', MAX_ROWS)),
+            'api_pattern': entry.get('api_pattern'),
+            'api_mapping': entry.get('api_mapping'),
+            'results_file': os.path.join(site_dir, os.path.basename(RESULTS_FILE)),
+            'markdown_file': os.path.join(site_dir, os.path.basename(MARKDOWN_FILE)),
+        })
+    return sites
+
+SITES = load_sites()
+# chrome only keeps a network log when some site reads its floor plans from an api
+NETWORK_CAPTURE = any(site['api_pattern'] for site in SITES)
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from metrics import get_metrics
+from config import COORDINATOR_DB, LEASE_TTL, SITES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    site TEXT PRIMARY KEY,
+    owner TEXT,
+    expires_at REAL,
+    next_due REAL NOT NULL DEFAULT 0,
+    last_run REAL,
+    last_owner TEXT,
+    schedule TEXT
+);
+"""
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class Coordinator:
+    """Shares the site list between worker processes (and machines) through leases in COORDINATOR_DB.
+
+    A worker claims a due site by taking its lease, which lasts `ttl` seconds
+    and is renewed while the check runs (see LeaseKeeper). Releasing it
+    records when the site is due next, so no other worker checks it again
+    this interval. If a worker dies, its leases just run out and the sites
+    go to whoever claims them next. Claims and releases are single UPDATEs,
+    so SQLite's locking decides every race.
+
+    The adaptive schedule state of each site lives here too, so whichever
+    worker checks a site carries on with the same interval.
+    """
+
+    def __init__(self, path=COORDINATOR_DB, owner=None, ttl=LEASE_TTL, clock=time.time):
+        self.path = path
+        self.owner = owner or worker_id()
+        self.ttl = ttl
+        self.clock = clock
+        # sites this worker holds a lease on, renewed by the LeaseKeeper thread
+        self.held = set()
+        self.lock = threading.Lock()
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # a connection per call so the heartbeat thread can use it too. no WAL: the
+        # database may be on a shared volume, and WAL needs shared memory on one host
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def claim(self, sites, limit=None):
+        """Take the leases of up to `limit` due sites nobody holds. Returns [(site, saved schedule entry or None)]."""
+        now = self.clock()
+        claimed = []
+        conn = self._connect()
+        try:
+            for site in sites:
+                if limit is not None and len(claimed) >= limit:
+                    break
+                with conn:
+                    conn.execute("INSERT OR IGNORE INTO leases (site) VALUES (?)", (site['name'],))
+                    taken = conn.execute("""
+                        UPDATE leases SET owner = ?, expires_at = ?
+                        WHERE site = ? AND next_due <= ? AND (owner IS NULL OR expires_at < ?)
+                    """, (self.owner, now + self.ttl, site['name'], now, now)).rowcount
+                    if not taken:
+                        continue
+                    row = conn.execute("SELECT schedule FROM leases WHERE site = ?", (site['name'],)).fetchone()
+                claimed.append((site, json.loads(row['schedule']) if row['schedule'] else None))
+        finally:
+            conn.close()
+
+        with self.lock:
+            self.held.update(site['name'] for site, _ in claimed)
+        for site, _ in claimed:
+            get_metrics().incr('leases_claimed', site=site['name'])
+        return claimed
+
+    def renew(self):
+        """Push back the expiry of every lease this worker holds. Returns the names of any it lost."""
+        with self.lock:
+            held = list(self.held)
+        if not held:
+            return []
+        lost = []
+        now = self.clock()
+        conn = self._connect()
+        try:
+            with conn:
+                for name in held:
+                    renewed = conn.execute(
+                        "UPDATE leases SET expires_at = ? WHERE site = ? AND owner = ?",
+                        (now + self.ttl, name, self.owner)
+                    ).rowcount
+                    if not renewed:
+                        lost.append(name)
+        finally:
+            conn.close()
+
+        for name in lost:
+            # we stalled past the expiry and someone else has the site now
+            print(f"[{name}] Lost the lease, another worker took over")
+            get_metrics().incr('leases_lost', site=name)
+            with self.lock:
+                self.held.discard(name)
+        return lost
+
+    def release(self, site, next_due, schedule=None):
+        """Done with a site: give up its lease and record when it's due next."""
+        conn = self._connect()
+        try:
+            with conn:
+                released = conn.execute("""
+                    UPDATE leases SET owner = NULL, expires_at = NULL, next_due = ?, last_run = ?, last_owner = owner, schedule = ?
+                    WHERE site = ? AND owner = ?
+                """, (next_due, self.clock(), json.dumps(schedule) if schedule else None, site['name'], self.owner)).rowcount
+        finally:
+            conn.close()
+        with self.lock:
+            self.held.discard(site['name'])
+        if not released:
+            print(f"[{site['name']}] Lease had already moved on, the other worker's schedule stands")
+        return bool(released)
+
+    def release_all(self):
+        """Hand back every lease without touching the schedule, for a clean shutdown."""
+        with self.lock:
+            held = list(self.held)
+            self.held.clear()
+        conn = self._connect()
+        try:
+            with conn:
+                for name in held:
+                    conn.execute("UPDATE leases SET owner = NULL, expires_at = NULL WHERE site = ? AND owner = ?", (name, self.owner))
+        finally:
+            conn.close()
+
+    def next_due(self, sites):
+        """When the next of `sites` can be claimed: due and not leased, or the lease runs out."""
+        conn = self._connect()
+        try:
+            rows = {row['site']: row for row in conn.execute("SELECT site, next_due, expires_at, owner FROM leases")}
+        finally:
+            conn.close()
+        times = []
+        for site in sites:
+            row = rows.get(site['name'])
+            if row is None:
+                return self.clock()
+            times.append(max(row['next_due'], row['expires_at'] or 0) if row['owner'] else row['next_due'])
+        return min(times, default=None)
+
+    def leases(self):
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute("SELECT * FROM leases ORDER BY site")]
+        finally:
+            conn.close()
+
+class LeaseKeeper:
+    """Background thread renewing the coordinator's leases every ttl / 3 seconds, use it as a context manager."""
+
+    def __init__(self, coordinator, every=None):
+        self.coordinator = coordinator
+        self.every = every or coordinator.ttl / 3
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.every):
+            try:
+                self.coordinator.renew()
+            except Exception as e:
+                # a busy or briefly unreachable database, the next beat tries again before the lease runs out
+                print(f"Error renewing leases: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='Show who holds which site in the shared coordinator database')
+    parser.add_argument('--db', default=COORDINATOR_DB)
+    args = parser.parse_args()
+
+    now = time.time()
+    coordinator = Coordinator(args.db)
+    rows = {row['site']: row for row in coordinator.leases()}
+    print(f"{'site':<24} {'owner':<28} {'lease':>8} {'due in':>8} {'last run by':<28}")
+    for site in SITES:
+        row = rows.get(site['name'])
+        if row is None:
+            print(f"{site['name']:<24} {'(never claimed)':<28}")
+            continue
+        lease = f"{row['expires_at'] - now:.0f}s" if row['owner'] else '-'
+        print(f"{site['name']:<24} {row['owner'] or '-':<28} {lease:>8} {max(0, row['next_due'] - now):>7.0f}s {row['last_owner'] or '-':<28}")
+
+if __name__ == "__main__":
+    main()
@@ -2,329 +2,824 @@ import time
 import random
 import os
 import json
+import queue
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+import re
+import base64
 import shutil
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
+import startup
 from config import (
-    RESULTS_FILE, MARKDOWN_FILE, TARGET_URL, TARGET_XPATH, 
+    SITES, JS_ONLY,
     PAGE_LOAD_TIMEOUT, WEBDRIVER_WAIT_TIMEOUT, WINDOW_SIZE,
-    USER_AGENTS, CHROME_OPTIONS, CHROME_EXPERIMENTAL_OPTIONS
+    LEAN_LOAD, CONTAINER_STABLE_MS, BLOCKED_RESOURCE_TYPES, RESOURCE_TYPE_PATTERNS, BLOCKED_URL_PATTERNS,
+    USER_AGENTS, CHROME_OPTIONS, CHROME_EXPERIMENTAL_OPTIONS,
+    DRIVER_RECYCLE_AFTER, DRIVER_CACHE_FILE, MAX_CONCURRENT_CHECKS, MAX_BROWSERS, MAX_ROWS, NETWORK_CAPTURE,
+    LOW_MEMORY, LOW_MEMORY_CHROME_OPTIONS, BROWSER_RSS_LIMIT_MB, BROWSER_RECYCLE_AT, ARCHIVE, EXTRACTOR
 )
+from fetch import get_http_fetcher, content_hash
+from diff import diff_plans, summarize_changes, describe_change, rent_value
+from history import HistoryStore
+from archive import SnapshotArchive, HTML, API
+from extractors import get_extractor, JsonExtractor, PARSER_VERSION
+from metrics import get_metrics
+from memory_watchdog import MemoryWatchdog
+from render import render_markdown
+from models import plans_from_dicts, plans_to_dicts
+
+# resolves once the container exists and nothing inside it has changed for quiet_ms,
+# first watching the document for the container to show up, then just the container
+WAIT_FOR_STABLE_CONTAINER = """
+const [xpath, quietMs, done] = arguments;
+const find = () => document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+const watch = (container) => {
+    let timer = null;
+    const observer = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(settled, quietMs);
+    });
+    const settled = () => { observer.disconnect(); done(true); };
+    observer.observe(container, {childList: true, subtree: true, characterData: true});
+    timer = setTimeout(settled, quietMs);
+};
+const container = find();
+if (container) {
+    watch(container);
+} else {
+    const observer = new MutationObserver(() => {
+        const found = find();
+        if (found) { observer.disconnect(); watch(found); }
+    });
+    observer.observe(document, {childList: true, subtree: true});
+}
+"""
+
+# how many elements the container holds, a cheap way to tell whether "load more" loaded anything
+CONTAINER_SIZE = """
+const container = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+return container ? container.getElementsByTagName('*').length : 0;
+"""
+
+def blocked_url_patterns():
+    patterns = list(BLOCKED_URL_PATTERNS)
+    for resource_type in BLOCKED_RESOURCE_TYPES:
+        patterns.extend(RESOURCE_TYPE_PATTERNS.get(resource_type.strip().lower(), []))
+    return patterns
+
+# where to get chromedriver, in the order they're tried. weird hack that ai
+# suggested for getting it to work on a raspberry pi: system chromedriver first,
+# then webdriver-manager for chromium, then for chrome
+DRIVER_STRATEGIES = {
+    'system': 'system ChromeDriver',
+    'chromium': 'Chromium browser (webdriver-manager)',
+    'chrome': 'Chrome browser (webdriver-manager)',
+}
+
+def load_driver_cache(path=DRIVER_CACHE_FILE):
+    """The strategy and chromedriver that worked last time, or None if there isn't one or the binary changed."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        stat = os.stat(cached['path'])
+    except Exception:
+        return None
+    # an upgraded or deleted chromedriver means resolving it again
+    if cached.get('strategy') not in DRIVER_STRATEGIES or not os.access(cached['path'], os.X_OK) \
+            or stat.st_size != cached.get('size') or stat.st_mtime != cached.get('mtime'):
+        return None
+    return cached
+
+def save_driver_cache(strategy, binary, path=DRIVER_CACHE_FILE):
+    try:
+        stat = os.stat(binary)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'strategy': strategy, 'path': binary, 'size': stat.st_size, 'mtime': stat.st_mtime}, f, indent=2)
+        os.replace(temp_path, path)
+    except Exception as e:
+        print(f"Error saving driver cache: {e}")
+
+def forget_driver_cache(path=DRIVER_CACHE_FILE):
+    if os.path.exists(path):
+        os.remove(path)
+
+def resolve_chromedriver(strategy):
+    """Path to the chromedriver binary for a strategy. The webdriver-manager ones can hit the network."""
+    if strategy == 'system':
+        return shutil.which('chromedriver')
+
+    from webdriver_manager.chrome import ChromeDriverManager
+    if strategy == 'chromium':
+        try:
+            from webdriver_manager.core.utils import ChromeType
+            return ChromeDriverManager(chrome_type=ChromeType.CHROMIUM).install()
+        except ImportError:
+            return ChromeDriverManager(chrome_type="chromium").install()
+    return ChromeDriverManager().install()
+
+def start_chrome(chrome_options):
+    """Start chrome with the cached chromedriver if it still works, otherwise try each strategy and cache the winner."""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
+    metrics = get_metrics()
+    cached = load_driver_cache()
+    if cached:
+        try:
+            driver = webdriver.Chrome(service=Service(cached['path']), options=chrome_options)
+            print(f"Using {DRIVER_STRATEGIES[cached['strategy']]} at {cached['path']} (cached)")
+            metrics.incr('driver_cache_hits')
+            return driver
+        except Exception as e:
+            print(f"Cached ChromeDriver failed: {str(e)[:100]}... resolving it again")
+            forget_driver_cache()
+    metrics.incr('driver_cache_misses')
+
+    for strategy, label in DRIVER_STRATEGIES.items():
+        try:
+            binary = resolve_chromedriver(strategy)
+            if not binary:
+                continue
+            driver = webdriver.Chrome(service=Service(binary), options=chrome_options)
+        except Exception as e:
+            print(f"{label} not available: {str(e)[:100]}...")
+            continue
+        print(f"Using {label} at {binary}")
+        save_driver_cache(strategy, binary)
+        return driver
+
+    raise Exception("No working browser found. Install Chrome, Chromium, or system ChromeDriver.")
+
+class BrowserCrashed(Exception):
+    """Chrome died (or the memory watchdog killed it) mid-check.
+
+    Not the same as a page without floor plans: nothing is wrong with the
+    site, so the check should just be retried.
+    """
+
+def setup_driver(lean=LEAN_LOAD, capture_network=False, low_memory=LOW_MEMORY):
+    from selenium.webdriver.chrome.options import Options
 
-def setup_driver():
     chrome_options = Options()
     
     chrome_options.add_argument(f"--user-agent={random.choice(USER_AGENTS)}")
     
     for option in CHROME_OPTIONS:
         chrome_options.add_argument(option)
+    if low_memory:
+        for option in LOW_MEMORY_CHROME_OPTIONS:
+            chrome_options.add_argument(option)
     
     for key, value in CHROME_EXPERIMENTAL_OPTIONS.items():
         chrome_options.add_experimental_option(key, value)
     
     chrome_options.add_argument(f"--window-size={WINDOW_SIZE}")
 
-    driver = None
-   
-    # weird hack that ai suggested for getting
-    # it to work on a raspberry pi:
+    if lean:
+        # return from driver.get() at DOMContentLoaded instead of waiting for every subresource
+        chrome_options.page_load_strategy = 'eager'
+        if 'image' in BLOCKED_RESOURCE_TYPES:
+            chrome_options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
 
-    # try system chromedriver first
-    system_chromedriver = shutil.which('chromedriver')
-    if system_chromedriver:
-        try:
-            driver = webdriver.Chrome(
-                service=Service(system_chromedriver),
-                options=chrome_options
-            )
-            print(f"Using system ChromeDriver at {system_chromedriver}")
-        except Exception as e:
-            print(f"System ChromeDriver failed: {str(e)[:100]}...")
+    if capture_network:
+        # network events only, the page and tracing ones would just fill the buffer
+        chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        chrome_options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+
+    driver = start_chrome(chrome_options)
     
-    # and webdriver-manager if that doesn't work
-    if driver is None:
-        # try chromium first
+    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+
+    if lean:
         try:
-            try:
-                from webdriver_manager.core.utils import ChromeType
-                driver = webdriver.Chrome(
-                    service=Service(ChromeDriverManager(chrome_type=ChromeType.CHROMIUM).install()),
-                    options=chrome_options
-                )
-            except ImportError:
-                driver = webdriver.Chrome(
-                    service=Service(ChromeDriverManager(chrome_type="chromium").install()),
-                    options=chrome_options
-                )
-            print("Using Chromium browser (webdriver-manager)")
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_url_patterns()})
         except Exception as e:
-            print(f"Chromium not available: {str(e)[:100]}...")
-            
-            # and chrome if that doesnt work
-            try:
-                driver = webdriver.Chrome(
-                    service=Service(ChromeDriverManager().install()),
-                    options=chrome_options
-                )
-                print("Using Chrome browser (webdriver-manager)")
-            except Exception as e2:
-                print(f"Chrome not available: {str(e2)[:100]}...")
-                raise Exception("No working browser found. Install Chrome, Chromium, or system ChromeDriver.")
-    
-    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+            print(f"Couldn't block heavy resources: {str(e)[:100]}...")
     return driver
 
-def extract_floor_plans(url, target_xpath):
-    driver = None
-    try:
-        driver = setup_driver()
-        driver.get(url)
-        time.sleep(PAGE_LOAD_TIMEOUT)
-        
-        wait = WebDriverWait(driver, WEBDRIVER_WAIT_TIMEOUT)
-        container = wait.until(EC.presence_of_element_located((By.XPATH, target_xpath)))
-        
-        html_content = container.get_attribute('innerHTML')
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        floor_plans = []
-        plan_rows = soup.find_all(['div', 'tr'], class_=lambda x: x and any(term in x.lower() for term in ['floorplan', 'floor-plan', 'plan', 'unit']))
-        
-        if not plan_rows:
-            plan_rows = soup.find_all('tr')[1:]
-        
-        if not plan_rows:
-            plan_rows = soup.find_all('div', recursive=True)
-            plan_rows = [div for div in plan_rows if div.find_all(['span', 'p', 'div']) and len(div.get_text().strip()) > 10]
-        
-        seen_plans = set()
-        
-        for i, row in enumerate(plan_rows[:20]):
+class BrowserSession:
+    """Keeps one warm WebDriver around between checks.
+
+    The driver is started lazily, replaced if it stops responding and
+    recycled after `recycle_after` checks so chrome doesn't slowly leak.
+    With a `memory_limit_mb` a MemoryWatchdog watches chrome's memory, it's
+    recycled between checks once it gets near the limit and killed if a
+    check pushes it over.
+    """
+
+    def __init__(self, recycle_after=DRIVER_RECYCLE_AFTER, lean=LEAN_LOAD, capture_network=NETWORK_CAPTURE,
+                 memory_limit_mb=BROWSER_RSS_LIMIT_MB):
+        self.recycle_after = recycle_after
+        self.lean = lean
+        # chrome's performance log, for sites read through their json api
+        self.capture_network = capture_network
+        self.memory_limit_mb = memory_limit_mb
+        self.watchdog = None
+        self.driver = None
+        self.checks = 0
+
+    def is_alive(self):
+        from selenium.common.exceptions import WebDriverException
+        if self.driver is None:
+            return False
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    def get_driver(self):
+        if self.driver is not None:
+            if self.checks >= self.recycle_after:
+                print(f"Recycling browser after {self.checks} checks")
+                get_metrics().incr('driver_recycles')
+                self.close()
+            elif not self.is_alive():
+                print("Browser stopped responding - restarting it")
+                get_metrics().incr('driver_restarts')
+                self.close()
+            elif self.watchdog and self.watchdog.sample() > self.memory_limit_mb * BROWSER_RECYCLE_AT:
+                print(f"Recycling browser at {self.watchdog.current_mb:.0f}MB, near the {self.memory_limit_mb}MB limit")
+                get_metrics().incr('driver_memory_recycles')
+                self.close()
+
+        if self.driver is None:
+            get_metrics().incr('driver_starts')
+            self.driver = setup_driver(self.lean, self.capture_network)
+            self.checks = 0
+            if self.memory_limit_mb and getattr(self.driver, 'service', None) and self.driver.service.process:
+                self.watchdog = MemoryWatchdog(self.driver.service.process.pid, self.memory_limit_mb).start()
+
+        self.checks += 1
+        return self.driver
+
+    def load(self, url, driver=None):
+        driver = driver or self.get_driver()
+        if self.capture_network:
+            # chromedriver buffers the log until it's read, drop what earlier checks left behind
+            driver.get_log('performance')
+        # reload instead of navigating when we're already on the page
+        if driver.current_url == url:
+            driver.refresh()
+        else:
+            driver.get(url)
+        return driver
+
+    def crashed(self, error):
+        """Call from a failed check: returns a BrowserCrashed for `error` if chrome went down, after closing it."""
+        killed = self.watchdog is not None and self.watchdog.tripped
+        # no driver means chrome never started (missing, broken install), that's a plain error and not worth a retry
+        if not killed and (self.driver is None or self.is_alive()):
+            return None
+        reason = f"killed over the {self.memory_limit_mb}MB memory limit" if killed else f"stopped responding ({str(error)[:100]})"
+        self.close()
+        return BrowserCrashed(f"Chrome {reason}")
+
+    def close(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            if self.watchdog.peak_mb:
+                print(f"Browser peaked at {self.watchdog.peak_mb:.0f}MB")
+            self.watchdog = None
+        if self.driver is not None:
             try:
-                text_content = row.get_text(separator=' | ', strip=True)
-                
-                if len(text_content) < 10 or any(skip in text_content.lower() for skip in ['navigation', 'menu', 'header', 'footer']):
-                    continue
-                
-                parts = [part.strip() for part in text_content.split(' | ')]
-                
-                if len(parts) >= 6 and '$' in text_content:
-                    first_part = parts[0].strip()
-                    if len(first_part) < 2 or first_part.isdigit() or first_part in ['Studio', '1', '2', '3']:
-                        continue
-                    
-                    plan_data = {
-                        'name': parts[0],
-                        'type': parts[1] if len(parts) > 1 else '',
-                        'bedrooms': parts[1] if parts[1] in ['Studio', '1', '2', '3'] else '',
-                        'bathrooms': parts[2] if len(parts) > 2 and parts[2].replace('.', '').isdigit() else '1',
-                        'sqft': parts[3] if len(parts) > 3 and parts[3].isdigit() else '',
-                        'rent': next((part for part in parts if '$' in part), ''),
-                        'availability': parts[-1] if len(parts) > 6 and 'contact' not in parts[-1].lower() else 'Contact for availability',
-                        'raw_text': text_content
-                    }
-                    
-                    if plan_data['type'] == 'Studio':
-                        plan_data['bedrooms'] = 'Studio'
-                        plan_data['bathrooms'] = '1'
-                    elif plan_data['type'] == '1':
-                        plan_data['bedrooms'] = '1 BR'
-                        plan_data['bathrooms'] = '1 BA'
-                    
-                    unique_key = f"{plan_data['name']}-{plan_data['sqft']}-{plan_data['rent']}"
-                    if unique_key not in seen_plans:
-                        seen_plans.add(unique_key)
-                        floor_plans.append(plan_data)
-            
+                self.driver.quit()
             except Exception:
-                continue
-        
-        unique_plans = []
-        seen_keys = set()
-        for plan in floor_plans:
-            key = f"{plan['name']}-{plan['rent']}"
-            if key not in seen_keys:
-                seen_keys.add(key)
-                unique_plans.append(plan)
-        
-        def get_rent_value(plan):
-            rent = plan.get('rent', '$0')
-            try:
-                return int(''.join(filter(str.isdigit, rent)))
-            except:
-                return 0
-        
-        unique_plans.sort(key=get_rent_value)
-        return unique_plans
-        
-    except Exception as e:
-        print(f"Error extracting floor plans: {e}")
-        return []
-    
-    finally:
-        if driver:
-            driver.quit()
+                pass
+        self.driver = None
+        self.checks = 0
 
-def create_markdown_table(floor_plans):
-    if not floor_plans:
-        return "# Floor Plans\n\nNo floor plans found.\n"
-    
-    rents = [int(''.join(filter(str.isdigit, plan.get('rent', '$0')))) for plan in floor_plans if plan.get('rent')]
-    min_rent = min(rents) if rents else 0
-    max_rent = max(rents) if rents else 0
-    avg_rent = sum(rents) // len(rents) if rents else 0
-    
-    markdown = "# Ariel Court Apartments - Floor Plans\n\n"
-    markdown += f"Last updated: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}\n\n"
-    markdown += f"Pricing range: ${min_rent:,} - ${max_rent:,} (average: ${avg_rent:,})\n\n"
-    markdown += f"Total plans available: {len(floor_plans)}\n\n"
-    
-    rows_data = []
-    max_widths = [10, 3, 4, 6, 4, 12]
-    
-    for plan in floor_plans:
-        name = plan.get('name', 'Unknown').replace('|', '\\|')
-        bedrooms = plan.get('bedrooms', '').replace('|', '\\|')
-        bathrooms = plan.get('bathrooms', '').replace('|', '\\|')
-        sqft = plan.get('sqft', '').replace('|', '\\|')
-        rent = plan.get('rent', '').replace('|', '\\|')
-        availability = plan.get('availability', '').replace('|', '\\|')
-        
-        if bedrooms == 'Studio':
-            type_formatted = "Studio"
-        elif '1' in bedrooms:
-            type_formatted = "1 Bedroom"
+    @contextmanager
+    def acquire(self):
+        # same interface as BrowserPool so callers don't care which one they have
+        yield self
+
+class BrowserPool:
+    """A fixed number of BrowserSessions shared by concurrent checks.
+
+    Checks that need chrome block in acquire() until a browser is free,
+    so at most `size` chrome instances ever run at once.
+    """
+
+    def __init__(self, size=MAX_BROWSERS, recycle_after=DRIVER_RECYCLE_AFTER, capture_network=NETWORK_CAPTURE):
+        self.sessions = [BrowserSession(recycle_after, capture_network=capture_network) for _ in range(max(1, size))]
+        self.available = queue.Queue()
+        for session in self.sessions:
+            self.available.put(session)
+
+    @contextmanager
+    def acquire(self):
+        session = self.available.get()
+        try:
+            yield session
+        finally:
+            self.available.put(session)
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+def wait_for_container(driver, target_xpath, lean=LEAN_LOAD, read=True):
+    """Wait for the container to be ready and return its innerHTML (None with read=False).
+
+    Lean loads wait for the container to exist and stay unchanged for
+    CONTAINER_STABLE_MS. Otherwise it's the original fixed sleep followed
+    by waiting for the container to exist.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
+
+    if not lean:
+        with get_metrics().timer('sleep'):
+            time.sleep(PAGE_LOAD_TIMEOUT)
+        wait = WebDriverWait(driver, WEBDRIVER_WAIT_TIMEOUT)
+        container = wait.until(EC.presence_of_element_located((By.XPATH, target_xpath)))
+        return container.get_attribute('innerHTML') if read else None
+
+    driver.set_script_timeout(WEBDRIVER_WAIT_TIMEOUT)
+    try:
+        driver.execute_async_script(WAIT_FOR_STABLE_CONTAINER, target_xpath, CONTAINER_STABLE_MS)
+    except TimeoutException:
+        # a container that never stops changing (a ticker, a carousel) is still worth reading
+        try:
+            container = driver.find_element(By.XPATH, target_xpath)
+        except NoSuchElementException:
+            raise TimeoutException(f"Container {target_xpath} never appeared")
+        print(f"Container kept changing for {WEBDRIVER_WAIT_TIMEOUT}s, using it as is")
+        return container.get_attribute('innerHTML') if read else None
+    except WebDriverException:
+        # the page navigated away mid-wait (a redirect), start over on the new document
+        wait = WebDriverWait(driver, WEBDRIVER_WAIT_TIMEOUT)
+        wait.until(EC.presence_of_element_located((By.XPATH, target_xpath)))
+        driver.execute_async_script(WAIT_FOR_STABLE_CONTAINER, target_xpath, CONTAINER_STABLE_MS)
+
+    if not read:
+        return None
+    return driver.find_element(By.XPATH, target_xpath).get_attribute('innerHTML')
+
+def next_page(driver, next_xpath=None, infinite_scroll=False):
+    """Move a listing on by one page.
+
+    A next link is followed to a new document ('navigated'), anything else
+    next_xpath matches (a "load more" button) is clicked and infinite
+    scroll scrolls to the bottom, both loading more rows into the same
+    container ('appended'). Returns None on the last page.
+    """
+    from selenium.webdriver.common.by import By
+
+    if next_xpath:
+        element = next((element for element in driver.find_elements(By.XPATH, next_xpath) if element.is_displayed()), None)
+        if element is None or not element.is_enabled() or element.get_attribute('aria-disabled') == 'true':
+            return None
+        href = element.get_attribute('href')
+        if element.tag_name.lower() == 'a' and href and not href.startswith('javascript:') \
+                and href.split('#')[0] != driver.current_url.split('#')[0]:
+            driver.get(href)
+            return 'navigated'
+        driver.execute_script("arguments[0].scrollIntoView({block: 'center'}); arguments[0].click();", element)
+        return 'appended'
+    if infinite_scroll:
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        return 'appended'
+    return None
+
+def fetch_rendered_container(url, target_xpath, session=None, timings=None):
+    """Load the page in chrome and return the container's innerHTML."""
+    return fetch_rendered_pages(url, target_xpath, session, timings)[0]
+
+def fetch_rendered_pages(url, target_xpath, session=None, timings=None, next_xpath=None, infinite_scroll=False, max_pages=1):
+    """Load the page in chrome and return the container's innerHTML for each page of the listing.
+
+    Pages that only append rows to the container ("load more", infinite
+    scroll) are read once at the end, a followed next link reads the
+    container before leaving each page. Seconds spent per stage (startup,
+    navigate, ready, paginate) are added to `timings` if a dict is passed in.
+    """
+    from selenium.webdriver.common.by import By
+
+    lean = session.lean if session else LEAN_LOAD
+    timings = {} if timings is None else timings
+    driver = None
+    try:
+        start = time.perf_counter()
+        if session:
+            driver = session.get_driver()
         else:
-            type_formatted = bedrooms or "—"
-            
-        bathroom_formatted = bathrooms if bathrooms else "—"
-        sqft_formatted = f"{sqft} ft²" if sqft else "—"
-        rent_formatted = rent if rent else "—"
-        
-        if availability and 'contact' not in availability.lower():
-            avail_formatted = availability
+            driver = setup_driver(lean)
+        timings['startup'] = time.perf_counter() - start
+        startup.mark('driver_ready')
+
+        start = time.perf_counter()
+        startup.mark('first_request')
+        if session:
+            session.load(url, driver)
         else:
-            avail_formatted = "Contact for details"
-        
-        row_data = [name, type_formatted, bathroom_formatted, sqft_formatted, rent_formatted, avail_formatted]
-        rows_data.append(row_data)
-        
-        for i, cell in enumerate(row_data):
-            max_widths[i] = max(max_widths[i], len(str(cell)))
-    
-    headers = ["Floor Plan", "Bed", "Bath", "Sq.Ft.", "Rent", "Availability"]
-    header_row = "| " + " | ".join(f"{headers[i]:<{max_widths[i]}}" for i in range(len(headers))) + " |\n"
-    separator_row = "|-" + "-|-".join("-" * max_widths[i] for i in range(len(headers))) + "-|\n"
+            driver.get(url)
+        timings['navigate'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        html_content = wait_for_container(driver, target_xpath, lean)
+        timings['ready'] = time.perf_counter() - start
+
+        metrics = get_metrics()
+        metrics.incr('browser_loads')
+        for stage in ('startup', 'navigate', 'ready'):
+            metrics.observe(stage, timings[stage])
+
+        if lean:
+            print(f"Page ready: navigate {timings['navigate']:.2f}s, container stable after {timings['ready']:.2f}s "
+                  f"(saved {max(0, PAGE_LOAD_TIMEOUT - timings['ready']):.2f}s over the fixed {PAGE_LOAD_TIMEOUT}s sleep)")
+
+        pages = []
+        if next_xpath or infinite_scroll:
+            start = time.perf_counter()
+            visited = {driver.current_url}
+            for _ in range(max_pages - 1):
+                size = driver.execute_script(CONTAINER_SIZE, target_xpath)
+                moved = next_page(driver, next_xpath, infinite_scroll)
+                if moved is None or (moved == 'navigated' and driver.current_url in visited):
+                    break
+                if moved == 'navigated':
+                    visited.add(driver.current_url)
+                    pages.append(html_content)
+                    html_content = wait_for_container(driver, target_xpath, lean)
+                else:
+                    wait_for_container(driver, target_xpath, lean, read=False)
+                    # nothing new came in, that was the last of it
+                    if driver.execute_script(CONTAINER_SIZE, target_xpath) <= size:
+                        break
+                    html_content = None
+                metrics.incr('pages_fetched')
+            if html_content is None:
+                html_content = driver.find_element(By.XPATH, target_xpath).get_attribute('innerHTML')
+            timings['paginate'] = time.perf_counter() - start
+            metrics.observe('paginate', timings['paginate'])
+        pages.append(html_content)
+        return pages
     
-    markdown += header_row
-    markdown += separator_row
+    except Exception as e:
+        # the driver may have crashed, let the session start a fresh one next time
+        crashed = session.crashed(e) if session else None
+        if crashed:
+            raise crashed from e
+        raise
     
-    for row_data in rows_data:
-        padded_cells = [f"{row_data[i]:<{max_widths[i]}}" for i in range(len(row_data))]
-        markdown += "| " + " | ".join(padded_cells) + " |\n"
+    finally:
+        if driver and not session:
+            driver.quit()
+
+def fetch_container_pages(url, target_xpath, browsers=None, js_only=JS_ONLY, next_xpath=None, infinite_scroll=False, max_pages=1,
+                          accept=None):
+    """The container html of each page of a listing, as a list of strings.
+
+    Only the container of each page is kept, never a whole page or its DOM.
+    `accept(pages)` can turn down the static html, e.g. a container holding
+    just a "Loading…" placeholder, and the page is rendered in chrome instead.
+    """
+    metrics = get_metrics()
+    # try the cheap static html first, chrome only when the page needs javascript
+    if not js_only and not infinite_scroll:
+        try:
+            with metrics.timer('http'):
+                pages = list(get_http_fetcher().fetch_pages(url, target_xpath, next_xpath, max_pages))
+            if pages and (accept is None or accept(pages)):
+                print("Found floor plan container in static HTML" + (f" ({len(pages)} pages)" if len(pages) > 1 else ""))
+                metrics.incr('http_hits')
+                metrics.incr('pages_fetched', len(pages))
+                return pages
+            if pages:
+                print("No floor plans in the static HTML (filled in by javascript?), falling back to browser")
+            else:
+                print("Floor plan container not in static HTML, falling back to browser")
+            metrics.incr('http_misses')
+        except Exception as e:
+            print(f"HTTP fetch failed: {str(e)[:100]}... falling back to browser")
+            metrics.incr('http_errors')
     
-    return markdown
+    metrics.incr('pages_fetched')
+    if browsers is None:
+        return fetch_rendered_pages(url, target_xpath, None, None, next_xpath, infinite_scroll, max_pages)
+    with browsers.acquire() as session:
+        return fetch_rendered_pages(url, target_xpath, session, None, next_xpath, infinite_scroll, max_pages)
+
+def capture_responses(driver, api_pattern, timeout=WEBDRIVER_WAIT_TIMEOUT, quiet_ms=CONTAINER_STABLE_MS):
+    """Bodies of the responses whose url matches `api_pattern`, read from chrome's performance log.
+
+    Waits for at least one matching response to finish loading, then until
+    none is in flight and no new one has started for `quiet_ms`. Returned in
+    url order so the content hash doesn't depend on which finished first.
+    """
+    from selenium.common.exceptions import TimeoutException, WebDriverException
+
+    pattern = re.compile(api_pattern)
+    in_flight = {}
+    bodies = []
+    last_activity = time.monotonic()
+    deadline = last_activity + timeout
+    while time.monotonic() < deadline:
+        for entry in driver.get_log('performance'):
+            message = json.loads(entry['message'])['message']
+            params = message.get('params', {})
+            if message.get('method') == 'Network.responseReceived' and pattern.search(params['response']['url']):
+                in_flight[params['requestId']] = params['response']['url']
+                last_activity = time.monotonic()
+            elif message.get('method') in ('Network.loadingFinished', 'Network.loadingFailed') and params.get('requestId') in in_flight:
+                url = in_flight.pop(params['requestId'])
+                last_activity = time.monotonic()
+                if message['method'] == 'Network.loadingFailed':
+                    continue
+                try:
+                    body = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': params['requestId']})
+                except WebDriverException as e:
+                    print(f"Couldn't read the response from {url}: {str(e)[:100]}...")
+                    continue
+                text = base64.b64decode(body['body']).decode('utf-8') if body.get('base64Encoded') else body['body']
+                bodies.append((url, text))
+
+        if bodies and not in_flight and time.monotonic() - last_activity >= quiet_ms / 1000:
+            break
+        time.sleep(0.05)
+
+    if not bodies:
+        raise TimeoutException(f"No response matching {api_pattern} within {timeout}s")
+    return [text for _, text in sorted(bodies, key=lambda body: body[0])]
+
+def fetch_api_responses(url, api_pattern, browsers=None):
+    """Load the page in chrome and return the JSON bodies of its requests matching `api_pattern`.
+
+    The page's own scripts make the api calls, so tokens, cookies and
+    headers are whatever the site sends. Nothing is read from the DOM.
+    """
+    own_session = None
+    if browsers is None:
+        browsers = own_session = BrowserSession(capture_network=True)
+    try:
+        with browsers.acquire() as session:
+            if not session.capture_network:
+                raise ValueError("This browser wasn't started with network capture, sites with an api_pattern need it")
+            metrics = get_metrics()
+            try:
+                with metrics.timer('startup'):
+                    driver = session.get_driver()
+                startup.mark('first_request')
+                with metrics.timer('navigate'):
+                    session.load(url, driver)
+                with metrics.timer('capture'):
+                    bodies = capture_responses(driver, api_pattern)
+            except Exception as e:
+                # the driver may have crashed, let the session start a fresh one next time
+                crashed = session.crashed(e)
+                if crashed:
+                    raise crashed from e
+                raise
+            metrics.incr('browser_loads')
+            metrics.incr('api_responses', len(bodies))
+            print(f"Captured {len(bodies)} api response(s) matching {api_pattern}")
+            return bodies
+    finally:
+        if own_session:
+            own_session.close()
 
-def load_previous_results():
-    if os.path.exists(RESULTS_FILE):
+def iter_floor_plans(pages, extractor=None, max_rows=MAX_ROWS):
+    """Yield the unique floor plans on one or more pages, one at a time.
+
+    Pages are container html, or JSON api responses with a JsonExtractor.
+    They're parsed one after another, so only one page's tree is in memory
+    at once. Stops after `max_rows` candidate rows over all the pages.
+    """
+    extractor = extractor or get_extractor()
+    if isinstance(pages, str):
+        pages = [pages]
+
+    seen_plans = set()
+    rows = 0
+    try:
+        for page in pages:
+            for plan_data in extractor.plans(page):
+                if rows >= max_rows:
+                    print(f"Stopped after {max_rows} rows, the rest of the listing was skipped (raise max_rows to include it)")
+                    get_metrics().incr('row_budget_hits')
+                    return
+                rows += 1
+                if plan_data is None:
+                    continue
+
+                unique_key = (plan_data.name, plan_data.rent_cents)
+                if unique_key not in seen_plans:
+                    seen_plans.add(unique_key)
+                    yield plan_data
+    finally:
+        get_metrics().incr('rows_parsed', rows)
+
+def parse_floor_plans(html_content, extractor=None, max_rows=MAX_ROWS):
+    """All the floor plans on a page (or a list of pages) of container html, cheapest first."""
+    return sorted(iter_floor_plans(html_content, extractor, max_rows), key=rent_value)
+
+def parse_fingerprint(site):
+    """Everything besides the page that decides its floor plans, for the content hash.
+
+    With this in the hash, a new parser, backend, max_rows or api_mapping
+    parses an unchanged page again instead of reusing the old results.
+    """
+    extractor = 'json' if site['api_pattern'] else EXTRACTOR
+    return json.dumps([PARSER_VERSION, extractor, site['max_rows'], site['api_mapping']], sort_keys=True)
+
+def site_content_hash(site, pages):
+    """content_hash of a site's fetched pages, the one stored in its results.
+
+    Api bodies only get the site's own normalize patterns, the html ones would
+    strip the availability dates they carry.
+    """
+    return content_hash(pages, site['normalize'], parse_fingerprint(site), html=not site['api_pattern'])
+
+def load_previous_results(results_file):
+    if os.path.exists(results_file):
         try:
-            with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(results_file, 'r', encoding='utf-8') as f:
+                results = json.load(f)
+            # older files hold the plans as strings ('$1,395'), from_dict parses those too
+            results['floor_plans'] = plans_from_dicts(results.get('floor_plans'))
+            return results
         except Exception:
             pass
     return None
 
-def save_results(floor_plans):
+def save_results(floor_plans, results_file, page_hash=None, timestamp=None):
     try:
         results = {
-            'timestamp': datetime.now().isoformat(),
-            'floor_plans': floor_plans
+            'timestamp': timestamp or datetime.now().isoformat(),
+            'content_hash': page_hash,
+            'floor_plans': plans_to_dicts(floor_plans)
         }
-        with open(RESULTS_FILE, 'w', encoding='utf-8') as f:
+        os.makedirs(os.path.dirname(results_file) or '.', exist_ok=True)
+        # write then rename, the bot reads this file whenever it changes and shouldn't see half of it
+        temp_path = f"{results_file}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
             json.dump(results, f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, results_file)
     except Exception as e:
         print(f"Error saving results: {e}")
 
 def compare_results(old_results, new_floor_plans):
+    """Returns (has_changes, availability_opened, changes) against the previous run."""
     if not old_results:
-        return True, False
-    
-    old_plans = old_results.get('floor_plans', [])
-    
-    if len(old_plans) != len(new_floor_plans):
-        return True, False
-    
-    has_changes = False
-    availability_opened = False
+        return True, False, []
     
-    for i, (old_plan, new_plan) in enumerate(zip(old_plans, new_floor_plans)):
-        for key in ['name', 'bedrooms', 'bathrooms', 'sqft', 'rent', 'availability']:
-            old_val = old_plan.get(key, '')
-            new_val = new_plan.get(key, '')
-            if old_val != new_val:
-                has_changes = True
-                
-                # check if availability changed from contact to a number (new availability!)
-                if key == 'availability':
-                    old_is_contact = 'contact' in old_val.lower()
-                    new_has_number = new_val.replace('Availability', '').strip().isdigit()
-                    if old_is_contact and new_has_number:
-                        availability_opened = True
+    changes = diff_plans(old_results.get('floor_plans', []), new_floor_plans)
+    has_changes, availability_opened = summarize_changes(changes)
+    return has_changes, availability_opened, changes
+
+def crawl_apartments(site=None, browsers=None):
+    site = site or SITES[0]
+    name = site['name']
+    # everything timed or counted on this thread from here on belongs to this site
+    metrics = get_metrics()
+    metrics.set_site(name)
+    metrics.incr('checks')
     
-    return has_changes, availability_opened
+    print(f"[{name}] Starting apartment crawler...")
+    previous_results = load_previous_results(site['results_file'])
+    previous_hash = previous_results.get('content_hash') if previous_results and previous_results.get('floor_plans') else None
+
+    def has_plans(pages):
+        # the page we last got plans from, or one with at least one plan on it. anything else needs chrome
+        if previous_hash and site_content_hash(site, pages) == previous_hash:
+            return True
+        return next(iter_floor_plans(pages, None, site['max_rows']), None) is not None
 
-def crawl_apartments():
-    url = TARGET_URL
-    xpath = TARGET_XPATH
+    try:
+        with metrics.timer('fetch'):
+            if site['api_pattern']:
+                pages = fetch_api_responses(site['url'], site['api_pattern'], browsers)
+            else:
+                pages = fetch_container_pages(site['url'], site['xpath'], browsers, site['js_only'],
+                                              site['next_xpath'], site['infinite_scroll'], site['max_pages'], has_plans)
+    except BrowserCrashed as e:
+        print(f"[{name}] {e}, the check will be retried")
+        metrics.incr('browser_crashes')
+        raise
+    except Exception as e:
+        print(f"[{name}] Error fetching floor plans: {e}")
+        metrics.incr('fetch_errors')
+        return [], False, False, []
     
-    print("Starting apartment crawler...")
-    previous_results = load_previous_results()
-    floor_plans = extract_floor_plans(url, xpath)
+    # same page as last time, nothing to parse, diff or write
+    with metrics.timer('hash'):
+        page_hash = site_content_hash(site, pages)
+    if ARCHIVE:
+        try:
+            with metrics.timer('archive'):
+                stored = SnapshotArchive().record(name, pages, API if site['api_pattern'] else HTML, page_hash)
+            metrics.incr('archived_pages', stored)
+        except Exception as e:
+            # losing a snapshot only costs a later reprocess one check
+            print(f"[{name}] Error archiving pages: {e}")
+    if previous_hash and previous_hash == page_hash:
+        print(f"[{name}] ✅ Page unchanged since last check")
+        metrics.incr('unchanged_pages')
+        try:
+            with metrics.timer('history'):
+                HistoryStore().touch_site(name)
+        except Exception as e:
+            print(f"[{name}] Error recording history: {e}")
+        return previous_results['floor_plans'], False, False, []
+    
+    try:
+        with metrics.timer('parse'):
+            extractor = JsonExtractor(site['api_mapping']) if site['api_pattern'] else None
+            floor_plans = parse_floor_plans(pages, extractor, site['max_rows'])
+    except Exception as e:
+        print(f"[{name}] Error extracting floor plans: {e}")
+        floor_plans = []
     
     if not floor_plans:
-        print("No floor plans extracted")
-        return [], False
+        print(f"[{name}] No floor plans extracted")
+        metrics.incr('empty_results')
+        return [], False, False, []
     
-    print(f"Extracted {len(floor_plans)} floor plans")
-    has_changes, availability_opened = compare_results(previous_results, floor_plans)
+    print(f"[{name}] Extracted {len(floor_plans)} floor plans")
+    metrics.incr('plans_found', len(floor_plans))
+    with metrics.timer('diff'):
+        has_changes, availability_opened, changes = compare_results(previous_results, floor_plans)
+    metrics.incr('changes', len(changes))
     
     if availability_opened:
-        print("🚨 APARTMENT AVAILABLE!")
+        print(f"[{name}] 🚨 APARTMENT AVAILABLE!")
     elif has_changes:
-        print("🔥 Changes detected!")
+        print(f"[{name}] 🔥 Changes detected!")
     else:
-        print("✅ No changes detected")
+        print(f"[{name}] ✅ No changes detected")
+    for change in changes:
+        print(f"[{name}]   {describe_change(change)}")
     
-    save_results(floor_plans)
+    with metrics.timer('save'):
+        save_results(floor_plans, site['results_file'], page_hash)
     
-    markdown_content = create_markdown_table(floor_plans)
     try:
-        with open(MARKDOWN_FILE, 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
-        print(f"Results saved to {MARKDOWN_FILE}")
+        with metrics.timer('history'):
+            history = HistoryStore()
+            # first run with history, keep what the old json file knew about
+            history.import_results(name, previous_results)
+            history.record_snapshot(name, floor_plans)
     except Exception as e:
-        print(f"Error saving markdown: {e}")
+        print(f"[{name}] Error recording history: {e}")
     
-    return floor_plans, has_changes, availability_opened
+    try:
+        with metrics.timer('markdown'):
+            markdown_content = render_markdown(floor_plans, name)
+            with open(site['markdown_file'], 'w', encoding='utf-8') as f:
+                f.write(markdown_content)
+        print(f"[{name}] Results saved to {site['markdown_file']}")
+    except Exception as e:
+        print(f"[{name}] Error saving markdown: {e}")
+    
+    return floor_plans, has_changes, availability_opened, changes
+
+def crawl_sites(sites, browsers=None, max_workers=MAX_CONCURRENT_CHECKS):
+    """Crawl several sites concurrently, returns (site, result) pairs in the same order.
+
+    A site whose check was cut short by a chrome crash gets its BrowserCrashed
+    as the result instead, so it isn't mistaken for a page with no floor plans.
+    """
+    def crawl_one(site):
+        metrics = get_metrics()
+        try:
+            with metrics.timer('check', site=site['name']):
+                return crawl_apartments(site, browsers)
+        except BrowserCrashed as e:
+            return e
+        except Exception as e:
+            print(f"[{site['name']}] Crawl error: {e}")
+            metrics.incr('crawl_errors', site=site['name'])
+            return [], False, False, []
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sites)))) as executor:
+        return list(zip(sites, executor.map(crawl_one, sites)))
 
 def main():
-    floor_plans, has_changes, availability_opened = crawl_apartments()
+    browsers = BrowserPool()
+    try:
+        results = crawl_sites(SITES, browsers)
+    finally:
+        browsers.close()
+        get_metrics().flush()
     
-    if floor_plans:
-        print("\n" + "="*60)
-        print("CURRENT FLOOR PLANS")
-        print("="*60)
-        
-        markdown_content = create_markdown_table(floor_plans)
-        print(markdown_content)
+    for site, result in results:
+        if isinstance(result, BrowserCrashed):
+            continue
+        floor_plans = result[0]
+        if floor_plans and os.path.exists(site['markdown_file']):
+            print("\n" + "="*60)
+            print(f"CURRENT FLOOR PLANS - {site['name']}")
+            print("="*60)
+            
+            # crawl_apartments already rendered it, no need to build the table twice
+            with open(site['markdown_file'], 'r', encoding='utf-8') as f:
+                print(f.read())
     
 if __name__ == "__main__":
     main()
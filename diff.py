@@ -0,0 +1,214 @@
+from collections import namedtuple
+from models import Bedrooms, FloorPlan, is_available
+
+# change kinds
+ADDED = 'added'
+REMOVED = 'removed'
+RENT_UP = 'rent_up'
+RENT_DOWN = 'rent_down'
+SQFT_CHANGED = 'sqft_changed'
+AVAILABILITY_OPENED = 'availability_opened'
+AVAILABILITY_CLOSED = 'availability_closed'
+DETAILS_CHANGED = 'details_changed'
+
+# `old` / `new` hold the whole FloorPlan for ADDED / REMOVED and the field value otherwise,
+# `delta` is in cents for rent and square feet for sqft
+Change = namedtuple('Change', ['kind', 'name', 'field', 'old', 'new', 'delta'])
+
+COMPARED_FIELDS = ('rent_cents', 'sqft', 'availability', 'bedrooms', 'bathrooms')
+
+def rent_value(plan):
+    """Whole dollars, for sorting."""
+    return plan.rent_dollars
+
+def _index(plans):
+    groups = {}
+    for plan in plans:
+        groups.setdefault(plan.name.strip().lower(), []).append(plan)
+    return groups
+
+def _match_group(old_plans, new_plans):
+    """Pair up plans that share a name.
+
+    Most names are unique so this is usually a 1:1 pair. When a site lists the
+    same plan several times (different units), pair by identical sqft + rent,
+    then by sqft, then in listing order.
+    """
+    if len(old_plans) == 1 and len(new_plans) == 1:
+        return [(old_plans[0], new_plans[0])], [], []
+
+    pairs = []
+    old_left = list(old_plans)
+    new_left = list(new_plans)
+    for same in (lambda a, b: a.sqft == b.sqft and a.rent_cents == b.rent_cents,
+                 lambda a, b: a.sqft == b.sqft,
+                 lambda a, b: True):
+        for new_plan in list(new_left):
+            match = next((old_plan for old_plan in old_left if same(old_plan, new_plan)), None)
+            if match is not None:
+                pairs.append((match, new_plan))
+                old_left.remove(match)
+                new_left.remove(new_plan)
+    return pairs, old_left, new_left
+
+def _field_change(name, field, old, new):
+    """The Change for one field going from old to new, or None if it didn't really change."""
+    if old == new:
+        return None
+
+    if field == 'rent_cents':
+        if old and new:
+            kind = RENT_UP if new > old else RENT_DOWN
+            return Change(kind, name, field, old, new, new - old)
+        return Change(DETAILS_CHANGED, name, field, old, new, None)
+
+    if field == 'sqft':
+        delta = new - old if old is not None and new is not None else None
+        return Change(SQFT_CHANGED, name, field, old, new, delta)
+
+    if field == 'availability':
+        was_open, now_open = is_available(old), is_available(new)
+        if now_open and not was_open:
+            kind = AVAILABILITY_OPENED
+        elif was_open and not now_open:
+            kind = AVAILABILITY_CLOSED
+        else:
+            kind = DETAILS_CHANGED
+        return Change(kind, name, field, old, new, None)
+
+    return Change(DETAILS_CHANGED, name, field, old, new, None)
+
+def _compare_plan(old_plan, new_plan):
+    changes = []
+    for field in COMPARED_FIELDS:
+        change = _field_change(new_plan.name, field, getattr(old_plan, field), getattr(new_plan, field))
+        if change:
+            changes.append(change)
+    return changes
+
+def diff_plans(old_plans, new_plans):
+    """Diff two floor plan lists by plan identity instead of position.
+
+    Plans are indexed by name, so this is linear in the number of plans (only
+    plans sharing a name get compared with each other). Returns a list of
+    Change events in the order of the new listing, followed by removals.
+    """
+    old_index = _index(old_plans)
+    new_index = _index(new_plans)
+
+    changes = []
+    for key, new_group in new_index.items():
+        old_group = old_index.get(key, [])
+        pairs, removed, added = _match_group(old_group, new_group)
+        for old_plan, new_plan in pairs:
+            changes.extend(_compare_plan(old_plan, new_plan))
+        for plan in added:
+            changes.append(Change(ADDED, plan.name, None, None, plan, None))
+        for plan in removed:
+            changes.append(Change(REMOVED, plan.name, None, plan, None, None))
+
+    for key, old_group in old_index.items():
+        if key not in new_index:
+            for plan in old_group:
+                changes.append(Change(REMOVED, plan.name, None, plan, None, None))
+
+    return changes
+
+def merge_changes(earlier, later):
+    """Net effect of two consecutive change lists, used to coalesce queued alerts.
+
+    Changes that cancel out (rent up and back down, a plan that opens and
+    closes again, listed and unlisted) disappear entirely.
+    """
+    merged = {}
+    for change in list(earlier) + list(later):
+        plan = change.name.strip().lower()
+
+        if change.kind in (ADDED, REMOVED):
+            previous = merged.pop((plan, None), None)
+            # the add / remove supersedes any field changes to the plan
+            for key in [key for key in merged if key[0] == plan]:
+                del merged[key]
+            if previous is None:
+                merged[(plan, None)] = change
+            elif previous.kind == REMOVED and change.kind == ADDED:
+                for field_change in _compare_plan(previous.old, change.new):
+                    merged[(plan, field_change.field)] = field_change
+            elif not (previous.kind == ADDED and change.kind == REMOVED):
+                merged[(plan, None)] = change
+            continue
+
+        added = merged.get((plan, None))
+        if added is not None and added.kind == ADDED:
+            # still a new plan, just with the latest values
+            merged[(plan, None)] = added._replace(new=added.new.with_field(change.field, change.new))
+            continue
+
+        previous = merged.pop((plan, change.field), None)
+        combined = _field_change(change.name, change.field, previous.old if previous else change.old, change.new)
+        if combined:
+            merged[(plan, change.field)] = combined
+
+    return list(merged.values())
+
+def summarize_changes(changes):
+    """Returns (has_changes, availability_opened) for a list of changes.
+
+    A newly listed plan that is already available counts as an opening too.
+    """
+    availability_opened = any(
+        change.kind == AVAILABILITY_OPENED or
+        (change.kind == ADDED and change.new.available)
+        for change in changes
+    )
+    return bool(changes), availability_opened
+
+def change_to_json(change):
+    """A Change as plain JSON (the outbox keeps pending changes in SQLite)."""
+    old = change.old.to_dict() if change.kind == REMOVED else change.old
+    new = change.new.to_dict() if change.kind == ADDED else change.new
+    return [change.kind, change.name, change.field, old, new, change.delta]
+
+def change_from_json(data):
+    kind, name, field, old, new, delta = data
+    if kind == REMOVED:
+        old = FloorPlan.from_dict(old)
+    if kind == ADDED:
+        new = FloorPlan.from_dict(new)
+    return Change(kind, name, field, old, new, delta)
+
+def _dollars(cents):
+    return FloorPlan('', rent_cents=cents).rent or '—'
+
+def _display(field, value):
+    if value is None or value == '':
+        return '—'
+    if field == 'rent_cents':
+        return _dollars(value)
+    if field == 'bedrooms':
+        return Bedrooms(value).label or '—'
+    if field == 'bathrooms':
+        return f"{value:g}"
+    return str(value)
+
+def describe_change(change):
+    name = change.name or 'Unknown'
+    if change.kind == ADDED:
+        plan = change.new
+        details = ', '.join(part for part in (plan.sqft and f"{plan.sqft} ft²", plan.rent, plan.availability) if part)
+        return f"🆕 {name} listed ({details})" if details else f"🆕 {name} listed"
+    if change.kind == REMOVED:
+        return f"❌ {name} removed"
+    if change.kind in (RENT_UP, RENT_DOWN):
+        arrow = "📈" if change.kind == RENT_UP else "📉"
+        sign = '+' if change.delta > 0 else '-'
+        return f"{arrow} {name}: rent {_dollars(change.old)} → {_dollars(change.new)} ({sign}{_dollars(abs(change.delta))})"
+    if change.kind == SQFT_CHANGED:
+        delta = f" ({change.delta:+,} ft²)" if change.delta is not None else ""
+        return f"📐 {name}: {_display('sqft', change.old)} → {_display('sqft', change.new)} ft²{delta}"
+    if change.kind == AVAILABILITY_OPENED:
+        return f"🚨 {name}: now available ({change.new})"
+    if change.kind == AVAILABILITY_CLOSED:
+        return f"🔒 {name}: no longer available ({change.new or 'unlisted'})"
+    field = 'rent' if change.field == 'rent_cents' else change.field
+    return f"✏️ {name}: {field} {_display(change.field, change.old)} → {_display(change.field, change.new)}"
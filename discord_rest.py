@@ -0,0 +1,73 @@
+from config import DISCORD_TOKEN, DISCORD_API_BASE
+
+class DiscordHTTPError(Exception):
+    """A failed request. `retry_after` is set (in seconds) when Discord rate limited us."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+class RestSender:
+    """Sends messages through Discord's REST API or channel webhooks, no gateway login.
+
+    Keeps one pooled aiohttp session for its lifetime, so a daemon can reuse
+    it across checks. Close it with `await sender.close()`.
+    """
+
+    def __init__(self, token=DISCORD_TOKEN, api_base=DISCORD_API_BASE):
+        self.token = token
+        self.api_base = api_base.rstrip('/')
+        self.session = None
+        # target -> (url, headers), resolved once per channel / webhook
+        self.endpoints = {}
+
+    async def _get_session(self):
+        if self.session is None or self.session.closed:
+            # imported on first send, it's a big import and most checks reach the first page request without it
+            import aiohttp
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10),
+                timeout=aiohttp.ClientTimeout(total=30),
+                headers={'User-Agent': 'ApartmentBot (https://github.com/Eric-Laurence/apartment-discord-bot, 1.0)'}
+            )
+        return self.session
+
+    def _endpoint(self, target):
+        key = (target['channel_id'], target.get('webhook_url'))
+        if key not in self.endpoints:
+            if target.get('webhook_url'):
+                # webhooks don't need the bot token, wait=true makes errors show up in the response
+                self.endpoints[key] = (f"{target['webhook_url']}?wait=true", {})
+            else:
+                self.endpoints[key] = (
+                    f"{self.api_base}/channels/{target['channel_id']}/messages",
+                    {'Authorization': f"Bot {self.token}"}
+                )
+        return self.endpoints[key]
+
+    async def send_message(self, target, payload):
+        """Post one message. Returns how many seconds until the channel's rate limit
+        bucket resets if this request used it up, otherwise None."""
+        session = await self._get_session()
+        url, headers = self._endpoint(target)
+        async with session.post(url, json=payload, headers=headers) as response:
+            if response.status == 429:
+                retry_after = response.headers.get('Retry-After')
+                try:
+                    retry_after = (await response.json()).get('retry_after', retry_after)
+                except Exception:
+                    pass
+                raise DiscordHTTPError(429, f"Rate limited on channel {target['channel_id']}", float(retry_after or 1))
+            if response.status >= 400:
+                body = await response.text()
+                raise DiscordHTTPError(response.status, f"Discord returned {response.status} for channel {target['channel_id']}: {body[:200]}")
+
+            if response.headers.get('X-RateLimit-Remaining') == '0':
+                return float(response.headers.get('X-RateLimit-Reset-After', 1))
+            return None
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,324 @@
+import re
+import json
+from config import EXTRACTOR
+from models import Bedrooms, FloorPlan, parse_bathrooms, parse_rent_cents
+
+# class name fragments that mark a floor plan row
+ROW_CLASS_TERMS = ['floorplan', 'floor-plan', 'plan', 'unit']
+SEPARATOR = ' | '
+# bump when a parser change would read the same page differently, so unchanged pages get parsed again
+PARSER_VERSION = 1
+
+# tags whose contents get_text() leaves out, and so does the lxml backend
+SKIPPED_TEXT_TAGS = ('script', 'style', 'template', 'rt', 'rp')
+
+class TextIndex:
+    """Every text node of a document in order, so any element's text is a slice of one list.
+
+    The nested div fallback looks at the text of every div, and each div
+    holds all the divs inside it. Joining each one's subtree again is
+    quadratic in the nesting, so the document is walked once, each element
+    gets its [start, end) span of the text nodes, and lengths come from
+    prefix sums.
+    """
+
+    def __init__(self):
+        self.texts = []
+        self.spans = {}
+
+    def add(self, text):
+        self.texts.append(text)
+
+    def finish(self):
+        self.stripped = [text.strip() for text in self.texts]
+        self.offsets = [0]
+        for text in self.texts:
+            self.offsets.append(self.offsets[-1] + len(text))
+        # nearest text node with something besides whitespace, at or after / at or before each index
+        count = len(self.texts)
+        self.next_content = [count] * (count + 1)
+        for i in range(count - 1, -1, -1):
+            self.next_content[i] = i if self.stripped[i] else self.next_content[i + 1]
+        self.previous_content = [-1] * count
+        for i in range(count):
+            self.previous_content[i] = i if self.stripped[i] else (self.previous_content[i - 1] if i else -1)
+        return self
+
+    def text_length(self, span):
+        """len(''.join(the span's text).strip()), without joining anything."""
+        start, end = span
+        first = self.next_content[start]
+        if first >= end:
+            return 0
+        last = self.previous_content[end - 1]
+        leading = len(self.texts[first]) - len(self.texts[first].lstrip())
+        trailing = len(self.texts[last]) - len(self.texts[last].rstrip())
+        return self.offsets[last + 1] - self.offsets[first] - leading - trailing
+
+    def row_text(self, span):
+        """The span's stripped text nodes joined with SEPARATOR, like get_text(separator, strip=True)."""
+        return SEPARATOR.join(filter(None, self.stripped[span[0]:span[1]]))
+
+class RowExtractor:
+    """Base for the html backends: find candidate rows, then read a plan out of each row's text."""
+
+    def plans(self, page):
+        """Yield a FloorPlan (or None when the row isn't a plan) per candidate row on a page."""
+        for text_content in self.row_texts(page):
+            try:
+                yield plan_from_text(text_content)
+            except Exception:
+                yield None
+
+class BeautifulSoupExtractor(RowExtractor):
+    """The original html.parser + BeautifulSoup row heuristics."""
+
+    name = 'bs4'
+
+    def row_texts(self, html_content):
+        """Yield the ' | ' separated text of each candidate floor plan row, in document order."""
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html_content, 'html.parser')
+
+        plan_rows = soup.find_all(['div', 'tr'], class_=lambda x: x and any(term in x.lower() for term in ROW_CLASS_TERMS))
+
+        if not plan_rows:
+            plan_rows = soup.find_all('tr')[1:]
+
+        if plan_rows:
+            for row in plan_rows:
+                yield row.get_text(separator=SEPARATOR, strip=True)
+            return
+
+        index = self._text_index(soup)
+        for div in soup.find_all('div', recursive=True):
+            span = index.spans[id(div)]
+            if div.find(['span', 'p', 'div']) is not None and index.text_length(span) > 10:
+                yield index.row_text(span)
+
+    def _text_index(self, soup):
+        """A TextIndex of the strings get_text() would return, spans keyed by id(tag)."""
+        from bs4 import Tag
+        wanted = {id(string) for string in soup.strings}
+        index = TextIndex()
+        stack = [(soup, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                index.spans[id(node)] = (index.spans[id(node)], len(index.texts))
+            elif isinstance(node, Tag):
+                index.spans[id(node)] = len(index.texts)
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.contents))
+            elif id(node) in wanted:
+                index.add(str(node))
+        return index.finish()
+
+class LxmlExtractor(RowExtractor):
+    """Same heuristics as BeautifulSoupExtractor, evaluated with compiled XPath on lxml.
+
+    Text collection skips the same nodes BeautifulSoup's get_text() does
+    (comments and the contents of script/style/template/rt/rp), so both
+    backends produce identical rows.
+    """
+
+    name = 'lxml'
+
+    def __init__(self):
+        from lxml import etree
+        lower = "translate(@class, 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')"
+        class_match = ' or '.join(f"contains({lower}, '{term}')" for term in ROW_CLASS_TERMS)
+        self.class_rows = etree.XPath(f"//*[self::div or self::tr][{class_match}]")
+        self.table_rows = etree.XPath("//tr")
+        self.nested_divs = etree.XPath("//div[.//span or .//p or .//div]")
+        self.texts = etree.XPath(
+            ".//text()[not(ancestor::script or ancestor::style or ancestor::template or ancestor::rt or ancestor::rp)]",
+            smart_strings=False
+        )
+
+    def _parse(self, html_content):
+        from lxml import html as lxml_html
+        # wrap the fragment so the container's own top level elements are searchable descendants
+        return lxml_html.fragment_fromstring(html_content or '', create_parent='lxml-root')
+
+    def row_texts(self, html_content):
+        root = self._parse(html_content)
+
+        plan_rows = self.class_rows(root)
+
+        if not plan_rows:
+            plan_rows = self.table_rows(root)[1:]
+
+        if plan_rows:
+            for row in plan_rows:
+                yield SEPARATOR.join(text for text in (part.strip() for part in self.texts(row)) if text)
+            return
+
+        index = self._text_index(root)
+        for div in self.nested_divs(root):
+            span = index.spans[div]
+            if index.text_length(span) > 10:
+                yield index.row_text(span)
+
+    def _text_index(self, root):
+        """A TextIndex of the text nodes self.texts() would find, spans keyed by element."""
+        index = TextIndex()
+        # (node, done, inside a skipped tag)
+        stack = [(root, False, False)]
+        while stack:
+            node, done, skipped = stack.pop()
+            if done:
+                index.spans[node] = (index.spans[node], len(index.texts))
+                # a tail belongs to the parent, it counts unless the parent's text doesn't
+                if node.tail and not skipped:
+                    index.add(node.tail)
+                continue
+            if not isinstance(node.tag, str):
+                # comments and processing instructions have no text of their own, just a tail
+                if node.tail and not skipped:
+                    index.add(node.tail)
+                continue
+            index.spans[node] = len(index.texts)
+            inside = skipped or node.tag in SKIPPED_TEXT_TAGS
+            if node.text and not inside:
+                index.add(node.text)
+            stack.append((node, True, skipped))
+            stack.extend((child, False, inside) for child in reversed(node))
+        return index.finish()
+
+class JsonExtractor:
+    """Floor plans straight from a site's JSON API responses, through a declarative field mapping.
+
+    `mapping` has an "items" path to the list of plans and a path per
+    FloorPlan field (name, bedrooms, bathrooms, sqft, rent or rent_cents,
+    availability). Paths are dotted keys and list indexes, "*" in the items
+    path flattens nested lists:
+
+        {"items": "data.buildings.*.floorPlans", "name": "name", "bedrooms": "beds",
+         "sqft": "squareFeet.min", "rent": "rent.min", "availability": "availableDate"}
+    """
+
+    name = 'json'
+
+    def __init__(self, mapping):
+        if not mapping or 'name' not in mapping:
+            raise ValueError("api_mapping needs at least a 'name' path")
+        self.mapping = mapping
+
+    def plans(self, page):
+        data = json.loads(page)
+        for item in json_items(data, self.mapping.get('items', '')):
+            try:
+                yield self.plan_from_item(item)
+            except Exception:
+                yield None
+
+    def plan_from_item(self, item):
+        field = lambda key: json_lookup(item, self.mapping[key]) if self.mapping.get(key) else None
+        name = field('name')
+        if name in (None, ''):
+            return None
+
+        bedrooms = field('bedrooms')
+        if isinstance(bedrooms, (int, float)) and not isinstance(bedrooms, bool):
+            bedrooms = Bedrooms(min(max(int(bedrooms), 0), 4))
+        else:
+            bedrooms = Bedrooms.parse(bedrooms)
+
+        bathrooms = field('bathrooms')
+        bathrooms = float(bathrooms) if isinstance(bathrooms, (int, float)) else parse_bathrooms(bathrooms)
+
+        sqft = field('sqft')
+        sqft = int(sqft) if isinstance(sqft, (int, float)) else _first_int(sqft)
+
+        if self.mapping.get('rent_cents'):
+            rent_cents = field('rent_cents')
+            rent_cents = int(rent_cents) if rent_cents not in (None, '') else None
+        else:
+            rent = field('rent')
+            rent_cents = int(round(rent * 100)) if isinstance(rent, (int, float)) else parse_rent_cents(rent)
+        # a 0 rent is how a lot of these apis say "call us"
+        rent_cents = rent_cents or None
+
+        availability = field('availability')
+        if availability is True:
+            availability = 'Available now'
+        elif availability in (None, False, ''):
+            availability = 'Contact for availability'
+
+        return FloorPlan.create(str(name).strip(), bedrooms, bathrooms, sqft, rent_cents, str(availability).strip())
+
+def _first_int(value):
+    match = re.search(r'\d[\d,]*', str(value or ''))
+    return int(match.group().replace(',', '')) if match else None
+
+def json_lookup(data, path):
+    """Follow a dotted path ("rent.min", "units.0.name") into parsed JSON, None if it isn't there."""
+    for key in path.split('.') if path else []:
+        if isinstance(data, list):
+            if not key.lstrip('-').isdigit() or not -len(data) <= int(key) < len(data):
+                return None
+            data = data[int(key)]
+        elif isinstance(data, dict):
+            data = data.get(key)
+        else:
+            return None
+    return data
+
+def json_items(data, path):
+    """The list of objects at `path`, where "*" segments flatten the lists along the way."""
+    nodes = [data]
+    for key in path.split('.') if path else []:
+        if key == '*':
+            nodes = [child for node in nodes if isinstance(node, list) for child in node]
+        else:
+            nodes = [json_lookup(node, key) for node in nodes]
+    items = []
+    for node in nodes:
+        if isinstance(node, list):
+            items.extend(node)
+        elif isinstance(node, dict):
+            items.append(node)
+    return items
+
+EXTRACTORS = {
+    BeautifulSoupExtractor.name: BeautifulSoupExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+}
+
+_extractors = {}
+
+def get_extractor(name=EXTRACTOR):
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor '{name}', choose from: {', '.join(EXTRACTORS)}")
+    if name not in _extractors:
+        _extractors[name] = EXTRACTORS[name]()
+    return _extractors[name]
+
+def plan_from_text(text_content):
+    """Turn a row's ' | ' separated text into a FloorPlan, or None if it doesn't look like one."""
+    if len(text_content) < 10 or any(skip in text_content.lower() for skip in ['navigation', 'menu', 'header', 'footer']):
+        return None
+
+    parts = [part.strip() for part in text_content.split(SEPARATOR)]
+
+    if len(parts) < 6 or '$' not in text_content:
+        return None
+
+    first_part = parts[0].strip()
+    if len(first_part) < 2 or first_part.isdigit() or first_part in ['Studio', '1', '2', '3']:
+        return None
+
+    plan_type = parts[1]
+    bedrooms = Bedrooms.parse(plan_type) if plan_type in ['Studio', '1', '2', '3'] else Bedrooms.UNKNOWN
+    # studios and one bedrooms on these sites are always one bath
+    bathrooms = 1.0 if bedrooms in (Bedrooms.STUDIO, Bedrooms.ONE) else parse_bathrooms(parts[2]) if parts[2].replace('.', '').isdigit() else 1.0
+
+    return FloorPlan.create(
+        parts[0],
+        bedrooms,
+        bathrooms,
+        int(parts[3]) if parts[3].isdigit() else None,
+        parse_rent_cents(next(part for part in parts if '$' in part)),
+        parts[-1] if len(parts) > 6 and 'contact' not in parts[-1].lower() else 'Contact for availability',
+    )
@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import random
+import html
+import hashlib
+import threading
+import startup
+from urllib.parse import urljoin
+from metrics import get_metrics
+from config import HTTP_CACHE_FILE, HTTP_TIMEOUT, USER_AGENTS, CONTENT_NORMALIZE_PATTERNS
+
+_default_normalizers = [re.compile(pattern, re.IGNORECASE) for pattern in CONTENT_NORMALIZE_PATTERNS]
+_whitespace = re.compile(r'\s+')
+
+def normalize_content(html_content, extra_patterns=(), html=True):
+    """Strip volatile fragments (csrf tokens, timestamps, cache busters) and collapse whitespace.
+
+    With `html` off only `extra_patterns` apply, the defaults would also strip
+    dates a json api returns as data (availableDate and the like).
+    """
+    normalizers = (_default_normalizers if html else []) + [re.compile(pattern, re.IGNORECASE) for pattern in extra_patterns]
+    for normalizer in normalizers:
+        html_content = normalizer.sub('', html_content)
+    return _whitespace.sub(' ', html_content).strip()
+
+def content_hash(pages, extra_patterns=(), fingerprint='', html=True):
+    """Hash of the normalized container html, `pages` is one page's html or a list of them.
+
+    `fingerprint` is hashed in too, for whatever else decides what the pages parse to.
+    Pass html=False for json api bodies, see normalize_content.
+    """
+    if isinstance(pages, str):
+        pages = [pages]
+    digest = hashlib.sha256()
+    if fingerprint:
+        digest.update(fingerprint.encode('utf-8') + b'\x00')
+    for i, page in enumerate(pages):
+        if i:
+            digest.update(b'\x00')
+        digest.update(normalize_content(page, extra_patterns, html).encode('utf-8'))
+    return digest.hexdigest()
+
+def _container_html(doc, target_xpath):
+    from lxml import html as lxml_html
+
+    matches = doc.xpath(target_xpath)
+    if not matches or not hasattr(matches[0], 'tag'):
+        return None
+
+    container = matches[0]
+    if not container.text_content().strip():
+        return None
+
+    inner = html.escape(container.text, quote=False) if container.text else ''
+    inner += ''.join(lxml_html.tostring(child, encoding='unicode', with_tail=True) for child in container)
+    return inner
+
+def find_container(page_content, target_xpath):
+    """Evaluate the target xpath against static html and return the container's innerHTML.
+
+    Returns None when the container is missing or empty, which usually means
+    the site fills it in with javascript.
+    """
+    from lxml import html as lxml_html
+
+    return _container_html(lxml_html.document_fromstring(page_content), target_xpath)
+
+def find_next_url(doc, next_xpath, page_url):
+    """The absolute url of the page's "next" link, or None on the last page.
+
+    A match without an href (a "load more" button) can't be followed
+    without javascript, so that counts as the last page too.
+    """
+    matches = doc.xpath(next_xpath)
+    for element in matches:
+        href = element.get('href') if hasattr(element, 'get') else None
+        if href and not href.startswith(('javascript:', '#')):
+            return urljoin(page_url, href)
+    if matches:
+        print(f"Next page match for {next_xpath} has no link to follow over plain http, set js_only to click it in chrome")
+    return None
+
+class HttpFetcher:
+    """Fetches pages over a pooled requests session using conditional GETs.
+
+    The ETag / Last-Modified validators and the last container html are kept
+    in HTTP_CACHE_FILE, so an unchanged page only costs a 304.
+    """
+
+    def __init__(self, cache_file=HTTP_CACHE_FILE, timeout=HTTP_TIMEOUT):
+        # requests and lxml are loaded here, not at import, so runs that never fetch over http don't pay for them
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.cache_file = cache_file
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': random.choice(USER_AGENTS),
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.9',
+        })
+        self.cache = self._load_cache()
+        self.dirty = False
+        # several sites can be fetched at once from worker threads
+        self.lock = threading.Lock()
+
+    def _load_cache(self):
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception:
+                pass
+        return {}
+
+    def _save_cache(self):
+        """Write the cache out if a fetch changed it, once per listing rather than per page."""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            try:
+                # write then rename, a half-written cache would lose every validator on the next start
+                temp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.cache, f, ensure_ascii=False)
+                os.replace(temp_path, self.cache_file)
+            except Exception as e:
+                print(f"Error saving http cache: {e}")
+
+    def fetch_pages(self, url, target_xpath, next_xpath=None, max_pages=1):
+        """Yield the container html of each page of a listing, following next_xpath links up to max_pages.
+
+        Yields nothing when the first page has no container. Raises ValueError
+        when a later page lacks it, the listing would be cut short and every
+        plan past that page would look removed. Each page is a separate
+        conditional GET, so unchanged pages of a long listing are 304s.
+        """
+        visited = set()
+        try:
+            while url and url not in visited and len(visited) < max_pages:
+                visited.add(url)
+                container, next_url = self._fetch(url, target_xpath, next_xpath)
+                if container is None:
+                    if len(visited) > 1:
+                        raise ValueError(f"Floor plan container missing on page {len(visited)} ({url})")
+                    return
+                yield container
+                url = next_url
+        finally:
+            self._save_cache()
+
+    def _fetch(self, url, target_xpath, next_xpath=None):
+        """Returns (container html or None, next page url or None)."""
+        from lxml import html as lxml_html
+
+        with self.lock:
+            entry = dict(self.cache.get(url, {}))
+        headers = {}
+        # only send validators if we still have the container (and next link) they belong to
+        if entry.get('container') and entry.get('xpath') == target_xpath and entry.get('next_xpath') == next_xpath:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        startup.mark('first_request')
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and headers:
+            print("Page not modified since last check (304)")
+            get_metrics().incr('http_not_modified')
+            return entry['container'], entry.get('next_url')
+        response.raise_for_status()
+
+        doc = lxml_html.document_fromstring(response.content)
+        container = _container_html(doc, target_xpath)
+        next_url = find_next_url(doc, next_xpath, url) if next_xpath and container is not None else None
+        with self.lock:
+            if container is None:
+                self.cache.pop(url, None)
+            else:
+                self.cache[url] = {
+                    'xpath': target_xpath,
+                    'next_xpath': next_xpath,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'container': container,
+                    'next_url': next_url,
+                }
+            self.dirty = True
+        return container, next_url
+
+    def close(self):
+        self.session.close()
+
+_http_fetcher = None
+_http_fetcher_lock = threading.Lock()
+
+def get_http_fetcher():
+    global _http_fetcher
+    with _http_fetcher_lock:
+        if _http_fetcher is None:
+            _http_fetcher = HttpFetcher()
+    return _http_fetcher
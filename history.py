@@ -0,0 +1,362 @@
+import os
+import json
+import sqlite3
+import argparse
+from datetime import date, datetime
+from models import Bedrooms, FloorPlan, plans_from_dicts, format_rent, parse_bathrooms, parse_sqft, parse_rent_cents, parse_available_on
+from config import HISTORY_DB, SITES, SITE_NAME
+
+OBSERVATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS observations (
+    id INTEGER PRIMARY KEY,
+    plan_id INTEGER NOT NULL REFERENCES plans(id),
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    seen_count INTEGER NOT NULL DEFAULT 1,
+    bedrooms INTEGER,
+    bathrooms REAL,
+    sqft INTEGER,
+    rent_cents INTEGER,
+    availability TEXT,
+    available INTEGER NOT NULL,
+    available_on TEXT
+)
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    last_checked TEXT
+);
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY,
+    site_id INTEGER NOT NULL REFERENCES sites(id),
+    plan_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (site_id, plan_key)
+);
+CREATE INDEX IF NOT EXISTS idx_plans_name ON plans (site_id, name);
+""" + OBSERVATIONS_TABLE + """;
+CREATE INDEX IF NOT EXISTS idx_observations_plan ON observations (plan_id, first_seen);
+CREATE INDEX IF NOT EXISTS idx_observations_last_seen ON observations (last_seen);
+"""
+
+OBSERVED_FIELDS = ('bedrooms', 'bathrooms', 'sqft', 'rent_cents', 'availability')
+
+def observed_values(plan):
+    """A plan's OBSERVED_FIELDS as stored in the observations table: numbers, and the site's availability label."""
+    return (int(plan.bedrooms), plan.bathrooms, plan.sqft, plan.rent_cents, plan.availability)
+
+def plan_from_row(row):
+    """A FloorPlan from an observations row (joined with its plan's name), nothing parsed again."""
+    return FloorPlan(
+        row['name'],
+        Bedrooms(row['bedrooms']) if row['bedrooms'] is not None else Bedrooms.UNKNOWN,
+        row['bathrooms'],
+        row['sqft'],
+        row['rent_cents'],
+        row['availability'] or '',
+        bool(row['available']),
+        date.fromisoformat(row['available_on']) if row['available_on'] else None,
+    )
+
+def plan_keys(floor_plans):
+    """Stable per-site key for each plan: name + sqft, numbered when a site lists duplicates."""
+    counts = {}
+    keys = []
+    for plan in floor_plans:
+        key = f"{plan.name.strip().lower()}|{'' if plan.sqft is None else plan.sqft}"
+        counts[key] = counts.get(key, 0) + 1
+        keys.append(key if counts[key] == 1 else f"{key}#{counts[key]}")
+    return keys
+
+class HistoryStore:
+    """Append-only SQLite history of every floor plan observation.
+
+    Each check adds an observation per plan, except that an observation identical
+    to the plan's previous one (seen on the previous check) just extends that
+    row's last_seen, so a plan that sits unchanged for months is a single row.
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+        finally:
+            conn.close()
+
+    def _migrate(self, conn):
+        """Turn an observations table from before the typed columns (rent as '$1,395' and so on) into the current one.
+
+        Each row's display strings are parsed once, here, and never again.
+        """
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(observations)")}
+        if 'rent_cents' in columns:
+            return
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # another process may have done it while we waited for the lock
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(observations)")}
+            if 'rent_cents' in columns:
+                return
+            print(f"Converting {self.path} to typed columns...")
+            conn.execute("ALTER TABLE observations RENAME TO observations_strings")
+            conn.execute(OBSERVATIONS_TABLE)
+            for row in conn.execute("SELECT * FROM observations_strings ORDER BY id").fetchall():
+                plan = FloorPlan.create('', Bedrooms.parse(row['bedrooms']), parse_bathrooms(row['bathrooms']),
+                                        parse_sqft(row['sqft']), parse_rent_cents(row['rent']), row['availability'] or '')
+                # a label like 'Available 11/15' meant the 15th after the day it was seen, not after today
+                available_on = parse_available_on(plan.availability, datetime.fromisoformat(row['first_seen']).date()) if plan.available else None
+                conn.execute(
+                    "INSERT INTO observations (id, plan_id, first_seen, last_seen, seen_count, " + ", ".join(OBSERVED_FIELDS) +
+                    ", available, available_on) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (row['id'], row['plan_id'], row['first_seen'], row['last_seen'], row['seen_count']) + observed_values(plan) +
+                    (int(plan.available), available_on.isoformat() if available_on else None)
+                )
+            conn.execute("DROP TABLE observations_strings")
+        # the old indexes went with the old table
+        conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # a connection per call keeps this safe to use from the crawl worker threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def has_site(self, site_name):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT last_checked FROM sites WHERE name = ?", (site_name,)).fetchone()
+        finally:
+            conn.close()
+        return row is not None and row['last_checked'] is not None
+
+    def record_snapshot(self, site_name, floor_plans, timestamp=None):
+        conn = self._connect()
+        try:
+            with conn:
+                self._record_snapshot(conn, site_name, floor_plans, timestamp or datetime.now().isoformat())
+        finally:
+            conn.close()
+
+    def _record_snapshot(self, conn, site_name, floor_plans, timestamp):
+        conn.execute("INSERT OR IGNORE INTO sites (name) VALUES (?)", (site_name,))
+        site = conn.execute("SELECT id, last_checked FROM sites WHERE name = ?", (site_name,)).fetchone()
+        previous_check = site['last_checked']
+
+        for plan, key in zip(floor_plans, plan_keys(floor_plans)):
+            conn.execute("INSERT OR IGNORE INTO plans (site_id, plan_key, name) VALUES (?, ?, ?)",
+                         (site['id'], key, plan.name))
+            plan_id = conn.execute("SELECT id FROM plans WHERE site_id = ? AND plan_key = ?",
+                                   (site['id'], key)).fetchone()['id']
+
+            values = observed_values(plan)
+            last = conn.execute(
+                "SELECT id, last_seen, " + ", ".join(OBSERVED_FIELDS) +
+                " FROM observations WHERE plan_id = ? ORDER BY first_seen DESC LIMIT 1",
+                (plan_id,)
+            ).fetchone()
+
+            # run-length: same values as on the previous check, just extend the run
+            if last and last['last_seen'] == previous_check and tuple(last[field] for field in OBSERVED_FIELDS) == values:
+                conn.execute("UPDATE observations SET last_seen = ?, seen_count = seen_count + 1 WHERE id = ?",
+                             (timestamp, last['id']))
+            else:
+                conn.execute(
+                    "INSERT INTO observations (plan_id, first_seen, last_seen, " + ", ".join(OBSERVED_FIELDS) +
+                    ", available, available_on) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (plan_id, timestamp, timestamp) + values +
+                    (int(plan.available), plan.available_on.isoformat() if plan.available_on else None)
+                )
+
+        conn.execute("UPDATE sites SET last_checked = ? WHERE id = ?", (timestamp, site['id']))
+
+    def touch_site(self, site_name, timestamp=None):
+        """Record a check that found the page unchanged by extending the current observations."""
+        conn = self._connect()
+        try:
+            with conn:
+                self._touch_site(conn, site_name, timestamp or datetime.now().isoformat())
+        finally:
+            conn.close()
+
+    def _touch_site(self, conn, site_name, timestamp):
+        site = conn.execute("SELECT id, last_checked FROM sites WHERE name = ?", (site_name,)).fetchone()
+        if site is None or site['last_checked'] is None:
+            return
+        conn.execute("""
+            UPDATE observations SET last_seen = ?, seen_count = seen_count + 1
+            WHERE last_seen = ? AND plan_id IN (SELECT id FROM plans WHERE site_id = ?)
+        """, (timestamp, site['last_checked'], site['id']))
+        conn.execute("UPDATE sites SET last_checked = ? WHERE id = ?", (timestamp, site['id']))
+
+    def rebuild_since(self, site_name, since, checks):
+        """Replace what a site's checks at or after `since` recorded with `checks`, for archive.py reprocess.
+
+        `checks` are (timestamp, floor plans) oldest first, with None for the
+        plans of a check that saw the same page as the one before it. It all
+        happens in one transaction, so the bot never reads a half-rebuilt history.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                self._forget_since(conn, site_name, since)
+                for timestamp, floor_plans in checks:
+                    if floor_plans is None:
+                        self._touch_site(conn, site_name, timestamp)
+                    else:
+                        self._record_snapshot(conn, site_name, floor_plans, timestamp)
+        finally:
+            conn.close()
+
+    def _forget_since(self, conn, site_name, since):
+        """Drop the observations of checks at or after `since`.
+
+        Runs are contiguous, so one that started earlier and went on past
+        `since` was seen on the last check before it, and ends there now.
+        """
+        site = conn.execute("SELECT id FROM sites WHERE name = ?", (site_name,)).fetchone()
+        if site is None:
+            return
+        plan_ids = "SELECT id FROM plans WHERE site_id = ?"
+        # the last check before `since`, every check left its time in some first_seen or last_seen
+        previous_check = conn.execute(f"""
+            SELECT MAX(seen) FROM (
+                SELECT first_seen AS seen FROM observations WHERE first_seen < ? AND plan_id IN ({plan_ids})
+                UNION ALL
+                SELECT last_seen FROM observations WHERE last_seen < ? AND plan_id IN ({plan_ids})
+            )
+        """, (since, site['id'], since, site['id'])).fetchone()[0]
+        conn.execute(f"DELETE FROM observations WHERE first_seen >= ? AND plan_id IN ({plan_ids})", (since, site['id']))
+        # seen_count can't be wound back without the checks, it stays a little high for these
+        conn.execute(f"UPDATE observations SET last_seen = ? WHERE last_seen >= ? AND plan_id IN ({plan_ids})",
+                     (previous_check, since, site['id']))
+        conn.execute("UPDATE sites SET last_checked = ? WHERE id = ?", (previous_check, site['id']))
+
+    def import_results(self, site_name, results):
+        """Seed a site's history from a saved floor_plans.json (with its plans loaded as FloorPlans), only if the site has none yet."""
+        if not results or self.has_site(site_name):
+            return False
+        self.record_snapshot(site_name, results.get('floor_plans', []), results.get('timestamp'))
+        return True
+
+    def price_history(self, site_name, plan_name):
+        """Rent runs for a plan, oldest first: (first_seen, last_seen, rent_cents, sqft)."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT o.first_seen, o.last_seen, o.rent_cents, o.sqft
+                FROM observations o
+                JOIN plans p ON p.id = o.plan_id
+                JOIN sites s ON s.id = p.site_id
+                WHERE s.name = ? AND p.name = ? COLLATE NOCASE
+                ORDER BY o.first_seen
+            """, (site_name, plan_name)).fetchall()
+        finally:
+            conn.close()
+
+        # collapse observations that only differ in availability
+        history = []
+        for row in rows:
+            if history and history[-1]['rent_cents'] == row['rent_cents'] and history[-1]['sqft'] == row['sqft']:
+                history[-1]['last_seen'] = max(history[-1]['last_seen'], row['last_seen'])
+                continue
+            history.append(dict(row))
+        return history
+
+    def last_availability_opened(self, site_name, plan_name=None):
+        """The most recent time a plan went from unavailable (or unlisted) to available."""
+        query = """
+            SELECT p.name, o.first_seen, o.availability, o.rent_cents FROM (
+                SELECT *, LAG(available) OVER (PARTITION BY plan_id ORDER BY first_seen) AS was_available
+                FROM observations
+                WHERE plan_id IN (
+                    SELECT p.id FROM plans p JOIN sites s ON s.id = p.site_id
+                    WHERE s.name = ? {plan_filter}
+                )
+            ) o
+            JOIN plans p ON p.id = o.plan_id
+            WHERE o.available = 1 AND (o.was_available IS NULL OR o.was_available = 0)
+            ORDER BY o.first_seen DESC
+            LIMIT 1
+        """
+        params = [site_name]
+        plan_filter = ""
+        if plan_name:
+            plan_filter = "AND p.name = ? COLLATE NOCASE"
+            params.append(plan_name)
+
+        conn = self._connect()
+        try:
+            row = conn.execute(query.format(plan_filter=plan_filter), params).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def current_snapshot(self, site_name):
+        """FloorPlans seen on the site's latest check, cheapest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT p.name, o.bedrooms, o.bathrooms, o.sqft, o.rent_cents, o.availability, o.available, o.available_on
+                FROM sites s
+                JOIN plans p ON p.site_id = s.id
+                JOIN observations o ON o.plan_id = p.id AND o.last_seen = s.last_checked
+                WHERE s.name = ?
+                ORDER BY o.rent_cents
+            """, (site_name,)).fetchall()
+        finally:
+            conn.close()
+        return [plan_from_row(row) for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the floor plan history database')
+    parser.add_argument('--site', default=SITES[0]['name'] if SITES else SITE_NAME,
+                       help='Site name (default: first configured site)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help='Import an existing floor_plans.json')
+    import_parser.add_argument('results_file', nargs='?', help='Defaults to the site\'s results file')
+    prices_parser = subparsers.add_parser('prices', help='Price history of a plan')
+    prices_parser.add_argument('plan')
+    opened_parser = subparsers.add_parser('opened', help='When availability last opened')
+    opened_parser.add_argument('plan', nargs='?')
+    subparsers.add_parser('current', help='Current snapshot')
+    args = parser.parse_args()
+
+    store = HistoryStore()
+
+    if args.command == 'import':
+        site = next((site for site in SITES if site['name'] == args.site), None)
+        results_file = args.results_file or (site['results_file'] if site else None)
+        if not results_file or not os.path.exists(results_file):
+            print("Error: No results file to import")
+            return
+        with open(results_file, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+        results['floor_plans'] = plans_from_dicts(results.get('floor_plans'))
+        if store.import_results(args.site, results):
+            print(f"Imported {len(results.get('floor_plans', []))} floor plans for {args.site}")
+        else:
+            print(f"{args.site} already has history, skipping import")
+
+    elif args.command == 'prices':
+        for run in store.price_history(args.site, args.plan):
+            print(f"{run['first_seen'][:16]} → {run['last_seen'][:16]}  {format_rent(run['rent_cents']) or '—':>10}  {run['sqft'] or '—'} ft²")
+
+    elif args.command == 'opened':
+        opened = store.last_availability_opened(args.site, args.plan)
+        if opened:
+            print(f"{opened['name']} opened {opened['first_seen'][:16]} ({opened['availability']}, {format_rent(opened['rent_cents']) or '—'})")
+        else:
+            print("No availability openings recorded")
+
+    elif args.command == 'current':
+        for plan in store.current_snapshot(args.site):
+            print(f"{plan.name:<12} {plan.sqft or '—':>6} ft²  {plan.rent or '—':>10}  {plan.availability}")
+
+if __name__ == "__main__":
+    main()
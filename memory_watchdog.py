@@ -0,0 +1,106 @@
+import os
+import signal
+import threading
+from config import WATCHDOG_INTERVAL
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def _parent_pids():
+    """pid -> parent pid for every process we can see, from /proc (linux only, empty elsewhere)."""
+    parents = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return parents
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # the command name can contain spaces, the fields after it can't
+                parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return parents
+
+def process_tree(pid):
+    """`pid` and all its descendants, parents first."""
+    children = {}
+    for child, parent in _parent_pids().items():
+        children.setdefault(parent, []).append(child)
+    tree = []
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+def process_memory_mb(pid):
+    """A process's proportional set size, so pages chrome's processes share aren't counted once per process.
+
+    Falls back to plain RSS on kernels without smaps_rollup, 0 if the process is gone.
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE / 1024 / 1024
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+def tree_memory_mb(pid):
+    return sum(process_memory_mb(member) for member in process_tree(pid))
+
+class MemoryWatchdog:
+    """Samples the memory of chromedriver and every chrome process under it from a background thread.
+
+    Past `limit_mb` it kills the chrome processes itself. That fails the
+    current check with a crash we know about and can retry, where the OOM
+    killer would take chrome down at some random point (or something else).
+    """
+
+    def __init__(self, pid, limit_mb, every=WATCHDOG_INTERVAL):
+        self.pid = pid
+        self.limit_mb = limit_mb
+        self.every = every
+        self.current_mb = 0.0
+        self.peak_mb = 0.0
+        self.tripped = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='memory-watchdog', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.every):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Memory watchdog error: {e}")
+
+    def sample(self):
+        """Measure the tree now, killing chrome if it's over the limit. Returns the total in MB."""
+        tree = process_tree(self.pid)
+        self.current_mb = sum(process_memory_mb(member) for member in tree)
+        self.peak_mb = max(self.peak_mb, self.current_mb)
+        if self.limit_mb and self.current_mb > self.limit_mb and not self.tripped:
+            self.tripped = True
+            print(f"Chrome is using {self.current_mb:.0f}MB, over the {self.limit_mb}MB limit - killing it")
+            # leave chromedriver alone, the session quits it normally once the check notices
+            for member in tree[1:]:
+                try:
+                    os.kill(member, signal.SIGKILL)
+                except OSError:
+                    pass
+        return self.current_mb
@@ -0,0 +1,158 @@
+import time
+from datetime import datetime
+from diff import describe_change
+from render import chunk_lines, table_chunks
+from alerts import get_alert_rules
+from models import format_rent
+from config import PING_USERS, SITE_NAME, ALERT_MAX_MESSAGES
+
+# what discord accepts in one message
+MESSAGE_LIMIT = 2000
+EMBED_FIELD_LIMIT = 1024
+EMBED_FIELDS_LIMIT = 25
+# all embeds in a message together, minus room for the "not shown" footer
+EMBED_TOTAL_LIMIT = 6000 - 200
+
+def build_status_message(changes_detected, availability_opened, site_name):
+    if changes_detected:
+        if availability_opened:
+            status_msg = "🚨 Check completed - APARTMENT AVAILABLE!"
+        else:
+            status_msg = "🏠 Check completed - Changes detected"
+    else:
+        status_msg = "✅ Check completed - No changes detected"
+    return f"{status_msg} ({site_name})"
+
+def _pack_embeds(first, fields, max_messages=ALERT_MAX_MESSAGES):
+    """Spread fields over as many embeds as Discord's limits need, one embed per message."""
+    embeds = [first]
+    size = len(first['title']) + len(first['description']) + sum(len(f['name']) + len(f['value']) for f in first['fields'])
+    for i, field in enumerate(fields):
+        field_size = len(field['name']) + len(field['value'])
+        if len(embeds[-1]['fields']) >= EMBED_FIELDS_LIMIT or size + field_size > EMBED_TOTAL_LIMIT:
+            if len(embeds) >= max_messages:
+                embeds[-1]['footer'] = {'text': f"…{len(fields) - i} more section(s) not shown, see the markdown file for everything"}
+                break
+            embeds.append({'title': f"{first['title']} (continued)", 'color': first['color'], 'fields': []})
+            size = len(embeds[-1]['title'])
+        embeds[-1]['fields'].append(field)
+        size += field_size
+    return embeds
+
+def build_update_embeds(floor_plans, site_name, complete_table=False, changes=None):
+    """The alert as plain dict embeds, one per message, usable with the REST API and discord.Embed.from_dict.
+
+    The table (or list of changes) is split over as many fields and
+    messages as it takes to stay inside Discord's limits.
+    """
+    embed = {
+        'title': "🏠 Apartment Update Detected!",
+        'description': f"Floor plan changes found at {site_name}",
+        'color': 0xff6b35,
+        'timestamp': datetime.now().astimezone().isoformat(),
+        'fields': [],
+    }
+    if not floor_plans:
+        return [embed]
+
+    rents = [plan.rent_dollars for plan in floor_plans if plan.rent_cents is not None]
+    min_rent = min(rents) if rents else 0
+    max_rent = max(rents) if rents else 0
+
+    embed['fields'].append({
+        'name': "📊 Summary",
+        'value': f"**{len(floor_plans)}** plans available\n**${min_rent:,} - ${max_rent:,}** price range",
+        'inline': False
+    })
+
+    # send just what changed, the full table only goes out on the first check
+    if changes:
+        name = "🔀 What Changed"
+        values = chunk_lines([describe_change(change) for change in changes], EMBED_FIELD_LIMIT)
+    else:
+        name = "📋 Current Floor Plans"
+        values = table_chunks(floor_plans, 'complete' if complete_table else 'compact', EMBED_FIELD_LIMIT)
+
+    fields = [{'name': name if i == 0 else f"{name} (cont.)", 'value': value, 'inline': False}
+              for i, value in enumerate(values)]
+    return _pack_embeds(embed, fields)
+
+def ping_user_ids(floor_plans, site_name, changes=None):
+    """PING_USERS plus everyone whose alert rules match the alert, in a stable order."""
+    try:
+        matched = get_alert_rules().index().users_to_ping(site_name, floor_plans, changes)
+    except Exception as e:
+        # a broken rules database shouldn't hold up the alert itself
+        print(f"Error matching alert rules: {e}")
+        matched = set()
+    return PING_USERS + sorted(matched - set(PING_USERS))
+
+def build_alert_messages(floor_plans, availability_opened=False, complete_table=False, site_name=SITE_NAME, changes=None):
+    """The alert payloads, in order, pinging only the users it matters to.
+
+    The mentions go in the messages' content, spread over as many messages
+    as it takes to keep each under MESSAGE_LIMIT: the first one, then the
+    continuation embeds, then messages of just mentions if there are still more.
+    """
+    header = "🚨 **APARTMENT AVAILABLE!**" if availability_opened else "🏠 **Apartment Update**"
+    mentions = [f"<@{user_id}>" for user_id in ping_user_ids(floor_plans, site_name, changes)]
+    # chunk_lines puts a newline between mentions, a space reads better and is the same length
+    pings = [chunk.replace("\n", " ") for chunk in chunk_lines(mentions, MESSAGE_LIMIT - len(header) - 1)]
+
+    embeds = build_update_embeds(floor_plans, site_name, complete_table, changes)
+    payloads = [{'content': f"{header} {pings[0]}" if pings else header, 'embeds': embeds[:1]}]
+    payloads.extend({'embeds': [embed]} for embed in embeds[1:])
+    for i, chunk in enumerate(pings[1:], 1):
+        if i < len(payloads):
+            payloads[i]['content'] = chunk
+        else:
+            payloads.append({'content': chunk})
+    return payloads
+
+def status_target(site):
+    return {'channel_id': site['status_channel_id'], 'webhook_url': site.get('status_webhook_url')}
+
+def alert_target(site):
+    return {'channel_id': site['channel_id'], 'webhook_url': site.get('webhook_url')}
+
+def _when(timestamp):
+    """An iso timestamp as '10-18 14:03'."""
+    try:
+        return datetime.fromisoformat(timestamp).strftime('%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return 'unknown'
+
+def _minutes(seconds):
+    if seconds < 60:
+        return "now" if seconds <= 0 else "in <1 min"
+    return f"in {seconds / 60:.0f} min"
+
+def format_site_status(site, snapshot, schedule, now=None):
+    """One site's line for !status."""
+    if snapshot is None:
+        return f"**{site['name']}**: not checked yet"
+    parts = [f"{len(snapshot.floor_plans)} plans", f"{len(snapshot.available)} available"]
+    if snapshot.by_rent:
+        parts.append(f"{snapshot.by_rent[0].rent} - {snapshot.by_rent[-1].rent}")
+    parts.append(f"changed {_when(snapshot.timestamp)}")
+    if schedule.get('next_due'):
+        parts.append(f"next check {_minutes(schedule['next_due'] - (now or time.time()))}")
+    if schedule.get('failures'):
+        parts.append(f"⚠️ last {schedule['failures']} check(s) failed")
+    return f"**{site['name']}**: " + " · ".join(parts)
+
+def format_plan(plan, site_name=None):
+    details = ", ".join(part for part in (plan.bedrooms.label, plan.sqft and f"{plan.sqft:,} ft²") if part)
+    line = f"{plan.rent or '—'} · {plan.name}" + (f" ({details})" if details else "")
+    line += f" · {plan.availability or 'Contact for availability'}"
+    return line + (f" · {site_name}" if site_name else "")
+
+def format_price_history(site_name, plan_name, history):
+    if not history:
+        return f"**{plan_name}** at {site_name}: no history yet"
+    lines = [f"**{plan_name}** at {site_name}"]
+    for run in history:
+        first, last = run['first_seen'][:10], run['last_seen'][:10]
+        span = first if first == last else f"{first} → {last}"
+        lines.append(f"{span}: {format_rent(run['rent_cents']) or '—'}" + (f" ({run['sqft']:,} ft²)" if run['sqft'] else ""))
+    return "\n".join(lines)
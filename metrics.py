@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime
+from config import METRICS_LOG, METRICS_PROM_FILE, METRICS_WINDOW
+
+# used when something is measured outside of any site's check (discord login, shared chrome)
+GLOBAL_SITE = 'global'
+# enough of the log's tail to seed the rolling window without reading years of history
+TAIL_BYTES = 4 * 1024 * 1024
+
+_prom_line = re.compile(r'^(\w+)\{(.*)\}\s+(\S+)$')
+_prom_label = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def percentile(values, fraction):
+    """Nearest rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _unescape(value):
+    return value.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\')
+
+def _tail_records(path, max_bytes=TAIL_BYTES):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - max_bytes))
+        lines = f.read().decode('utf-8', errors='replace').splitlines()
+    if size > max_bytes:
+        # the first line is probably cut in half
+        lines = lines[1:]
+
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+class Metrics:
+    """Per-site stage timings and counters for each check.
+
+    Code anywhere in a check calls timer()/observe()/incr() and the numbers
+    land on the site set with set_site() for the current thread (crawl_sites
+    checks each site on its own thread). flush() appends one JSON line per
+    site to METRICS_LOG and rewrites the Prometheus textfile: p50/p95 per
+    stage over the last METRICS_WINDOW checks, plus counters that keep
+    counting across runs.
+    """
+
+    def __init__(self, log_file=METRICS_LOG, prom_file=METRICS_PROM_FILE, window=METRICS_WINDOW):
+        self.log_file = log_file
+        self.prom_file = prom_file
+        self.window = window
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # site -> {'stages': {stage: seconds}, 'counters': {counter: n}} since the last flush
+        self.pending = {}
+        # site -> last `window` flushed records, loaded from the log on first use
+        self.recent = None
+        # (site, counter) -> running total, and (site, stage) -> [sum, count], carried over in the prom file
+        self.totals, self.stage_totals = self._load_totals()
+
+    def set_site(self, name):
+        self.local.site = name
+
+    def _site(self, site):
+        return site or getattr(self.local, 'site', None) or GLOBAL_SITE
+
+    def _entry(self, site):
+        return self.pending.setdefault(site, {'stages': {}, 'counters': {}})
+
+    def observe(self, stage, seconds, site=None):
+        """Add time spent in a stage. Stages hit more than once in a check add up."""
+        site = self._site(site)
+        with self.lock:
+            stages = self._entry(site)['stages']
+            stages[stage] = stages.get(stage, 0) + seconds
+
+    @contextmanager
+    def timer(self, stage, site=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, site)
+
+    def incr(self, counter, n=1, site=None):
+        site = self._site(site)
+        with self.lock:
+            counters = self._entry(site)['counters']
+            counters[counter] = counters.get(counter, 0) + n
+
+    def _load_totals(self):
+        totals = defaultdict(int)
+        stage_totals = defaultdict(lambda: [0.0, 0])
+        if not os.path.exists(self.prom_file):
+            return totals, stage_totals
+
+        try:
+            with open(self.prom_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    match = _prom_line.match(line.strip())
+                    if not match:
+                        continue
+                    name, labels, value = match.groups()
+                    labels = {key: _unescape(val) for key, val in _prom_label.findall(labels)}
+                    if name == 'apartment_monitor_events_total':
+                        totals[(labels['site'], labels['event'])] = int(float(value))
+                    elif name == 'apartment_monitor_stage_seconds_sum':
+                        stage_totals[(labels['site'], labels['stage'])][0] = float(value)
+                    elif name == 'apartment_monitor_stage_seconds_count':
+                        stage_totals[(labels['site'], labels['stage'])][1] = int(float(value))
+        except Exception as e:
+            print(f"Error reading metrics file: {e}")
+        return totals, stage_totals
+
+    def recent_records(self):
+        """site -> the last `window` checks from the log, oldest first."""
+        with self.lock:
+            if self.recent is None:
+                self.recent = defaultdict(lambda: deque(maxlen=self.window))
+                for record in _tail_records(self.log_file):
+                    if 'site' in record:
+                        self.recent[record['site']].append(record)
+            return self.recent
+
+    def flush(self):
+        """Write out everything recorded since the last flush."""
+        recent = self.recent_records()
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        timestamp = datetime.now().isoformat()
+        records = []
+        for site, entry in pending.items():
+            record = {'time': timestamp, 'site': site, 'stages': entry['stages'], 'counters': entry['counters']}
+            records.append(record)
+            with self.lock:
+                recent[site].append(record)
+                for counter, n in entry['counters'].items():
+                    self.totals[(site, counter)] += n
+                for stage, seconds in entry['stages'].items():
+                    self.stage_totals[(site, stage)][0] += seconds
+                    self.stage_totals[(site, stage)][1] += 1
+
+        try:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"Error writing metrics log: {e}")
+
+        try:
+            self._write_prom()
+        except Exception as e:
+            print(f"Error writing metrics file: {e}")
+
+    def summary(self):
+        """site -> ({stage: [seconds, ...]}, {counter: total}) over the rolling window."""
+        summary = {}
+        for site, records in self.recent_records().items():
+            stages = defaultdict(list)
+            counters = defaultdict(int)
+            for record in records:
+                for stage, seconds in record.get('stages', {}).items():
+                    stages[stage].append(seconds)
+                for counter, n in record.get('counters', {}).items():
+                    counters[counter] += n
+            summary[site] = (stages, counters)
+        return summary
+
+    def _write_prom(self):
+        lines = [
+            "# HELP apartment_monitor_stage_seconds Seconds spent in each stage of a check, quantiles over the last checks",
+            "# TYPE apartment_monitor_stage_seconds summary",
+        ]
+        summary = self.summary()
+        for site, (stages, _) in sorted(summary.items()):
+            for stage, values in sorted(stages.items()):
+                labels = f'site="{_escape(site)}",stage="{_escape(stage)}"'
+                for fraction in (0.5, 0.95):
+                    lines.append(f'apartment_monitor_stage_seconds{{{labels},quantile="{fraction}"}} {percentile(values, fraction):.6f}')
+        for (site, stage), (total, count) in sorted(self.stage_totals.items()):
+            labels = f'site="{_escape(site)}",stage="{_escape(stage)}"'
+            lines.append(f'apartment_monitor_stage_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'apartment_monitor_stage_seconds_count{{{labels}}} {count}')
+
+        lines.append("# HELP apartment_monitor_events_total Things counted during checks (rows parsed, driver restarts, send failures, ...)")
+        lines.append("# TYPE apartment_monitor_events_total counter")
+        for (site, counter), total in sorted(self.totals.items()):
+            lines.append(f'apartment_monitor_events_total{{site="{_escape(site)}",event="{_escape(counter)}"}} {total}')
+
+        lines.append("# HELP apartment_monitor_last_flush_timestamp_seconds When the metrics were last written")
+        lines.append("# TYPE apartment_monitor_last_flush_timestamp_seconds gauge")
+        lines.append(f"apartment_monitor_last_flush_timestamp_seconds {time.time():.0f}")
+
+        # node_exporter's textfile collector can read the file at any moment, so swap it in whole
+        temp_path = f"{self.prom_file}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prom_file)
+
+    def format_stats(self):
+        """The --stats report: p50/p95 per stage and counter totals per site."""
+        summary = self.summary()
+        if not summary:
+            return f"No metrics recorded yet in {self.log_file}"
+
+        output = []
+        for site, (stages, counters) in sorted(summary.items()):
+            checks = len(self.recent_records()[site])
+            output.append(f"{site} (last {checks} check{'s' if checks != 1 else ''})")
+            output.append(f"  {'stage':<14} {'n':>5} {'p50':>9} {'p95':>9} {'max':>9}")
+            for stage, values in sorted(stages.items(), key=lambda item: -percentile(item[1], 0.5)):
+                output.append(f"  {stage:<14} {len(values):>5} {percentile(values, 0.5):>8.3f}s "
+                              f"{percentile(values, 0.95):>8.3f}s {max(values):>8.3f}s")
+            if counters:
+                output.append("  " + ", ".join(f"{counter} {total}" for counter, total in sorted(counters.items())))
+            output.append("")
+        return "\n".join(output).rstrip()
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+    return _metrics
+
+def set_metrics(metrics):
+    """Swap in a different Metrics, the replay harness uses this to keep its numbers out of the real files."""
+    global _metrics
+    with _metrics_lock:
+        _metrics = metrics
@@ -0,0 +1,188 @@
+import re
+from datetime import date
+from enum import IntEnum
+from typing import NamedTuple, Optional
+
+_money = re.compile(r'\$?\s*(\d[\d,]*)(?:\.(\d{1,2}))?')
+_number = re.compile(r'\d+(?:\.\d+)?')
+_month_names = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+_numeric_date = re.compile(r'\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b')
+# no \b at the end, a timestamp's date part is followed by a T (2026-11-01T00:00:00Z)
+_iso_date = re.compile(r'\b(\d{4})-(\d{2})-(\d{2})(?!\d)')
+_named_date = re.compile(r'\b(' + '|'.join(_month_names) + r')[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?(?:,?\s+(\d{4}))?', re.IGNORECASE)
+
+class Bedrooms(IntEnum):
+    UNKNOWN = -1
+    STUDIO = 0
+    ONE = 1
+    TWO = 2
+    THREE = 3
+    FOUR_PLUS = 4
+
+    @classmethod
+    def parse(cls, text):
+        text = str(text or '').strip().lower()
+        if not text:
+            return cls.UNKNOWN
+        if 'studio' in text:
+            return cls.STUDIO
+        match = _number.search(text)
+        if not match:
+            return cls.UNKNOWN
+        return cls(min(int(float(match.group())), 4))
+
+    @property
+    def label(self):
+        if self == Bedrooms.UNKNOWN:
+            return ''
+        if self == Bedrooms.STUDIO:
+            return 'Studio'
+        if self == Bedrooms.FOUR_PLUS:
+            return '4+ BR'
+        return f"{int(self)} BR"
+
+def parse_rent_cents(text):
+    """'$1,395' -> 139500. Only the first amount counts, so a '$1,395 - $1,500' range gives its low end."""
+    match = _money.search(str(text or ''))
+    if not match:
+        return None
+    return int(match.group(1).replace(',', '')) * 100 + int((match.group(2) or '0').ljust(2, '0'))
+
+def format_rent(rent_cents):
+    """139500 -> '$1,395' the way a listing shows it, '' for None."""
+    if rent_cents is None:
+        return ''
+    dollars, cents = divmod(rent_cents, 100)
+    return f"${dollars:,}.{cents:02d}" if cents else f"${dollars:,}"
+
+def parse_sqft(text):
+    digits = str(text or '').replace(',', '').strip()
+    return int(digits) if digits.isdigit() else None
+
+def parse_bathrooms(text):
+    match = _number.search(str(text or ''))
+    return float(match.group()) if match else None
+
+def is_available(availability):
+    return bool(availability) and 'contact' not in availability.lower()
+
+def _make_date(year, month, day, today):
+    if year is None:
+        # no year given: the next time that date comes around, give or take a couple of months
+        year = today.year
+        try:
+            if (today - date(year, month, day)).days > 60:
+                year += 1
+        except ValueError:
+            return None
+    elif year < 100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def parse_available_on(text, today=None):
+    """The move-in date in an availability label ('Available 11/15', 'Nov 15th'), or None."""
+    text = str(text or '')
+    today = today or date.today()
+    match = _iso_date.search(text)
+    if match:
+        return _make_date(int(match.group(1)), int(match.group(2)), int(match.group(3)), today)
+    match = _numeric_date.search(text)
+    if match:
+        year = int(match.group(3)) if match.group(3) else None
+        return _make_date(year, int(match.group(1)), int(match.group(2)), today)
+    match = _named_date.search(text)
+    if match:
+        year = int(match.group(3)) if match.group(3) else None
+        return _make_date(year, _month_names.index(match.group(1)[:3].lower()) + 1, int(match.group(2)), today)
+    return None
+
+class FloorPlan(NamedTuple):
+    """One floor plan, parsed once when it's extracted.
+
+    A namedtuple, so it's slotted, immutable and compares by value. Rent is
+    in cents and sqft in square feet (None when the site doesn't say),
+    `availability` keeps the site's own label for display and `available`
+    / `available_on` are what was parsed out of it.
+    """
+
+    name: str
+    bedrooms: Bedrooms = Bedrooms.UNKNOWN
+    bathrooms: Optional[float] = None
+    sqft: Optional[int] = None
+    rent_cents: Optional[int] = None
+    availability: str = ''
+    available: bool = False
+    available_on: Optional[date] = None
+
+    @classmethod
+    def create(cls, name, bedrooms=Bedrooms.UNKNOWN, bathrooms=None, sqft=None, rent_cents=None, availability=''):
+        """Build a plan and parse its availability label."""
+        return cls(name, Bedrooms(bedrooms), bathrooms, sqft, rent_cents, availability,
+                   is_available(availability), parse_available_on(availability) if is_available(availability) else None)
+
+    @property
+    def rent_dollars(self):
+        return (self.rent_cents or 0) // 100
+
+    @property
+    def rent(self):
+        """Rent the way a listing shows it, '$1,395'."""
+        return format_rent(self.rent_cents)
+
+    @property
+    def bathrooms_label(self):
+        return f"{self.bathrooms:g}" if self.bathrooms is not None else ''
+
+    def with_field(self, field, value):
+        """A copy with one field changed, keeping the parsed availability in step with its label."""
+        if field == 'availability':
+            return FloorPlan.create(self.name, self.bedrooms, self.bathrooms, self.sqft, self.rent_cents, value)
+        return self._replace(**{field: value})
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'bedrooms': int(self.bedrooms),
+            'bathrooms': self.bathrooms,
+            'sqft': self.sqft,
+            'rent_cents': self.rent_cents,
+            'availability': self.availability,
+            'available': self.available,
+            'available_on': self.available_on.isoformat() if self.available_on else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if 'rent_cents' not in data:
+            return cls.from_legacy(data)
+        return cls(
+            data['name'],
+            Bedrooms(data.get('bedrooms', -1)),
+            data.get('bathrooms'),
+            data.get('sqft'),
+            data.get('rent_cents'),
+            data.get('availability', ''),
+            data.get('available', False),
+            date.fromisoformat(data['available_on']) if data.get('available_on') else None,
+        )
+
+    @classmethod
+    def from_legacy(cls, data):
+        """A plan from the old all-strings format ({'rent': '$1,395', 'sqft': '540', ...})."""
+        return cls.create(
+            data.get('name', ''),
+            Bedrooms.parse(data.get('bedrooms')),
+            parse_bathrooms(data.get('bathrooms')),
+            parse_sqft(data.get('sqft')),
+            parse_rent_cents(data.get('rent')),
+            data.get('availability', ''),
+        )
+
+def plans_to_dicts(floor_plans):
+    return [plan.to_dict() for plan in floor_plans]
+
+def plans_from_dicts(data):
+    return [FloorPlan.from_dict(plan) for plan in data or []]
@@ -0,0 +1,251 @@
+import json
+import time
+import random
+import asyncio
+import sqlite3
+from metrics import get_metrics
+from models import plans_from_dicts, plans_to_dicts
+from diff import merge_changes, summarize_changes, change_to_json, change_from_json
+from messages import build_alert_messages, build_status_message, status_target, alert_target
+from config import (
+    OUTBOX_DB, OUTBOX_DEBOUNCE, OUTBOX_BACKOFF_BASE, OUTBOX_BACKOFF_MAX,
+    OUTBOX_MAX_ATTEMPTS, OUTBOX_MAX_WAIT
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    site TEXT NOT NULL,
+    target TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    not_before REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_site ON outbox (site, kind);
+CREATE INDEX IF NOT EXISTS idx_outbox_not_before ON outbox (not_before);
+"""
+
+STATUS = 'status'
+ALERT = 'alert'
+
+def _bucket(target):
+    # discord rate limits per channel (and per webhook)
+    return target.get('webhook_url') or str(target['channel_id'])
+
+class Outbox:
+    """Durable queue of pending Discord messages.
+
+    Messages survive crashes and restarts in OUTBOX_DB until Discord accepts
+    them. Queued alerts for the same site are merged into one, and an alert
+    whose changes cancel out before it is sent (a price that goes up and back
+    down within OUTBOX_DEBOUNCE seconds) is dropped. Sending respects each
+    channel's rate limit bucket and backs off exponentially on errors.
+    """
+
+    def __init__(self, path=OUTBOX_DB, clock=time.time, debounce=OUTBOX_DEBOUNCE):
+        self.path = path
+        self.clock = clock
+        self.debounce = debounce
+        # bucket -> time its rate limit resets, only kept in memory since limits last seconds
+        self.rate_limits = {}
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def enqueue_update(self, site, floor_plans, changes_detected, availability_opened=False, complete_table=False, changes=None):
+        """Queue the status message and, if anything changed, the alert for one check."""
+        now = self.clock()
+        with self.conn:
+            # only the latest status per site is worth sending
+            self.conn.execute("DELETE FROM outbox WHERE site = ? AND kind = ?", (site['name'], STATUS))
+            self._insert(STATUS, site, status_target(site), {
+                'content': build_status_message(changes_detected, availability_opened, site['name'])
+            }, now, now)
+
+            if changes_detected:
+                self._enqueue_alert(site, floor_plans, availability_opened, complete_table, changes or [], now)
+
+    def _insert(self, kind, site, target, state, created_at, not_before):
+        self.conn.execute(
+            "INSERT INTO outbox (kind, site, target, state, created_at, not_before) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, site['name'], json.dumps(target), json.dumps(state), created_at, not_before)
+        )
+
+    def _enqueue_alert(self, site, floor_plans, availability_opened, complete_table, changes, now):
+        pending = self.conn.execute(
+            "SELECT id, state, created_at FROM outbox WHERE site = ? AND kind = ? ORDER BY id DESC LIMIT 1",
+            (site['name'], ALERT)
+        ).fetchone()
+        if pending is not None and json.loads(pending['state']).get('parts_sent'):
+            # already half sent, changing it now would leave the sent parts out of date
+            pending = None
+
+        if pending is None:
+            # no changes on a detected update means the first check, which sends the whole table
+            state = {
+                'floor_plans': plans_to_dicts(floor_plans),
+                'changes': [change_to_json(change) for change in changes],
+                'first_check': not changes,
+                'complete_table': complete_table,
+            }
+            # availability openings go out right away, everything else waits out the debounce window
+            not_before = now if availability_opened else now + self.debounce
+            self._insert(ALERT, site, alert_target(site), state, now, not_before)
+            return
+
+        state = json.loads(pending['state'])
+        # a queued first check alert shows the whole table, so it only needs the latest plans
+        merged = [] if state['first_check'] else merge_changes([change_from_json(change) for change in state['changes']], changes)
+        if not merged and not state['first_check']:
+            print(f"[{site['name']}] Queued changes cancelled out, dropping the alert")
+            get_metrics().incr('alerts_cancelled', site=site['name'])
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (pending['id'],))
+            return
+
+        state['floor_plans'] = plans_to_dicts(floor_plans)
+        state['changes'] = [change_to_json(change) for change in merged]
+        state['complete_table'] = state['complete_table'] or complete_table
+        opened = summarize_changes(merged)[1]
+        self.conn.execute(
+            "UPDATE outbox SET state = ?, not_before = CASE WHEN ? THEN MIN(not_before, ?) ELSE not_before END WHERE id = ?",
+            (json.dumps(state), opened, now, pending['id'])
+        )
+        print(f"[{site['name']}] Merged update into the queued alert")
+        get_metrics().incr('alerts_merged', site=site['name'])
+
+    def _payloads(self, kind, site_name, state):
+        if kind == STATUS:
+            return [{'content': state['content']}]
+
+        changes = [change_from_json(change) for change in state['changes']]
+        availability_opened = summarize_changes(changes)[1]
+        return build_alert_messages(plans_from_dicts(state['floor_plans']), availability_opened, state['complete_table'], site_name, changes)
+
+    def next_attempt(self):
+        """When the next queued message becomes sendable, or None if the outbox is empty."""
+        next_time = None
+        for row in self.conn.execute("SELECT target, not_before FROM outbox"):
+            ready = max(row['not_before'], self.rate_limits.get(_bucket(json.loads(row['target'])), 0))
+            if next_time is None or ready < next_time:
+                next_time = ready
+        return next_time
+
+    async def _drain_bucket(self, sender, bucket, rows):
+        sent = 0
+        for row in rows:
+            if self.rate_limits.get(bucket, 0) > self.clock():
+                break
+            row_sent, blocked = await self._send_row(sender, bucket, row)
+            sent += row_sent
+            if blocked:
+                # later messages for this channel wait so they keep their order
+                break
+        return sent
+
+    async def _send_row(self, sender, bucket, row):
+        """Send whatever is left of one queued row (a big alert is several messages).
+
+        Returns (messages sent, whether the bucket is now blocked).
+        """
+        metrics = get_metrics()
+        target = json.loads(row['target'])
+        state = json.loads(row['state'])
+        payloads = self._payloads(row['kind'], row['site'], state)
+        sent = 0
+
+        for part in range(state.get('parts_sent', 0), len(payloads)):
+            now = self.clock()
+            if self.rate_limits.get(bucket, 0) > now:
+                return sent, True
+
+            start = time.perf_counter()
+            try:
+                reset_after = await sender.send_message(target, payloads[part])
+            except Exception as e:
+                metrics.observe('send', time.perf_counter() - start, site=row['site'])
+                metrics.incr('send_failures', site=row['site'])
+                status = getattr(e, 'status', None)
+                retry_after = getattr(e, 'retry_after', None)
+                attempts = row['attempts'] + 1
+
+                if status == 429 and retry_after is not None:
+                    # not the message's fault, wait for the bucket and try again without counting it
+                    self.rate_limits[bucket] = now + retry_after
+                    with self.conn:
+                        self.conn.execute("UPDATE outbox SET not_before = ? WHERE id = ?", (now + retry_after, row['id']))
+                    print(f"Rate limited on {target['channel_id']}, retrying in {retry_after:.1f}s")
+                    metrics.incr('rate_limited', site=row['site'])
+                    return sent, True
+
+                if (status is not None and 400 <= status < 500) or attempts >= OUTBOX_MAX_ATTEMPTS:
+                    # bad request or missing permissions won't fix themselves
+                    print(f"Dropping {row['kind']} message for {row['site']} after {attempts} attempt(s): {e}")
+                    metrics.incr('messages_dropped', site=row['site'])
+                    with self.conn:
+                        self.conn.execute("DELETE FROM outbox WHERE id = ?", (row['id'],))
+                    return sent, False
+
+                # back off the whole channel so later messages keep their order
+                delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX) * random.uniform(0.8, 1.2)
+                self.rate_limits[bucket] = now + delay
+                with self.conn:
+                    self.conn.execute(
+                        "UPDATE outbox SET attempts = ?, not_before = ?, last_error = ? WHERE id = ?",
+                        (attempts, now + delay, str(e)[:500], row['id'])
+                    )
+                print(f"Error sending {row['kind']} message for {row['site']}, retrying in {delay:.0f}s: {e}")
+                return sent, True
+
+            metrics.observe('send', time.perf_counter() - start, site=row['site'])
+            metrics.incr('messages_sent', site=row['site'])
+            sent += 1
+            with self.conn:
+                if part + 1 < len(payloads):
+                    # remember the progress so a retry doesn't repeat the parts already sent
+                    state['parts_sent'] = part + 1
+                    self.conn.execute("UPDATE outbox SET state = ? WHERE id = ?", (json.dumps(state), row['id']))
+                else:
+                    self.conn.execute("DELETE FROM outbox WHERE id = ?", (row['id'],))
+            if reset_after:
+                self.rate_limits[bucket] = self.clock() + reset_after
+        return sent, False
+
+    async def drain_once(self, sender):
+        """Send everything that's due, channels in parallel and each channel in order."""
+        now = self.clock()
+        rows = self.conn.execute("SELECT * FROM outbox WHERE not_before <= ? ORDER BY id", (now,)).fetchall()
+
+        buckets = {}
+        for row in rows:
+            buckets.setdefault(_bucket(json.loads(row['target'])), []).append(row)
+
+        results = await asyncio.gather(*(self._drain_bucket(sender, bucket, bucket_rows)
+                                         for bucket, bucket_rows in buckets.items()))
+        return sum(results)
+
+    async def drain(self, sender, max_wait=OUTBOX_MAX_WAIT):
+        """Drain until the outbox is empty or the next retry is more than max_wait seconds away."""
+        deadline = self.clock() + max_wait
+        sent = 0
+        while True:
+            sent += await self.drain_once(sender)
+            next_attempt = self.next_attempt()
+            if next_attempt is None or next_attempt > deadline:
+                break
+            await asyncio.sleep(max(0, next_attempt - self.clock()))
+
+        pending = len(self)
+        if pending:
+            print(f"Sent {sent} Discord message(s), {pending} still queued")
+        else:
+            print(f"Sent {sent} Discord message(s)")
+        return sent
@@ -0,0 +1,165 @@
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from config import RENDER_CACHE_SIZE
+from models import Bedrooms, plans_to_dicts
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_availability_prefix = re.compile(r'^availability\s*', re.IGNORECASE)
+
+def snapshot_hash(floor_plans):
+    return hashlib.sha256(json.dumps(plans_to_dicts(floor_plans), sort_keys=True).encode('utf-8')).hexdigest()
+
+def _cached(floor_plans, key, build):
+    """Build something derived from a snapshot once, later calls with the same plans get the cached copy."""
+    key = (snapshot_hash(floor_plans),) + key
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    value = build()
+    with _cache_lock:
+        _cache[key] = value
+        while len(_cache) > RENDER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+def _rents(floor_plans):
+    return [plan.rent_dollars for plan in floor_plans if plan.rent_cents is not None]
+
+def _short_name(plan):
+    return plan.name[:10]
+
+def _short_rent(plan):
+    return plan.rent.replace(',', '') or '—'
+
+def _short_availability(plan):
+    if not plan.available:
+        return 'Contact'
+    # 'Availability 2' -> '2', the rest of the site's labels ('Now', 'Available 11/15') are short already
+    return _availability_prefix.sub('', plan.availability) or plan.availability
+
+def _short_type(plan):
+    return plan.bedrooms.label.replace(' ', '') or '—'
+
+def _sqft(plan):
+    return '—' if plan.sqft is None else plan.sqft
+
+# (header, cell) per column of the tables sent to discord
+DISCORD_COLUMNS = {
+    # mobile friendly
+    'compact': [
+        ('Plan', _short_name),
+        ('SqFt', _sqft),
+        ('Rent', _short_rent),
+        ('Avail', _short_availability),
+    ],
+    'complete': [
+        ('Plan', _short_name),
+        ('Type', _short_type),
+        ('Bath', lambda plan: plan.bathrooms_label or '—'),
+        ('SqFt', _sqft),
+        ('Rent', _short_rent),
+        ('Avail', _short_availability),
+    ],
+}
+
+def _markdown_type(plan):
+    if plan.bedrooms == Bedrooms.ONE:
+        return "1 Bedroom"
+    return plan.bedrooms.label or "—"
+
+def _markdown_availability(plan):
+    return plan.availability if plan.available else "Contact for details"
+
+# (header, minimum width, cell) per column of the markdown file
+MARKDOWN_COLUMNS = [
+    ("Floor Plan", 10, lambda plan: plan.name or 'Unknown'),
+    ("Bed", 3, _markdown_type),
+    ("Bath", 4, lambda plan: plan.bathrooms_label or "—"),
+    ("Sq.Ft.", 6, lambda plan: f"{plan.sqft} ft²" if plan.sqft else "—"),
+    ("Rent", 4, lambda plan: plan.rent or "—"),
+    ("Availability", 12, _markdown_availability),
+]
+
+def table_lines(floor_plans, fmt='compact'):
+    """The monospaced table for discord as (header, separator, rows), rendered once per snapshot."""
+    def build():
+        columns = DISCORD_COLUMNS[fmt]
+        rows = [[str(cell(plan)) for _, cell in columns] for plan in floor_plans]
+        widths = [max([len(header)] + [len(row[i]) for row in rows]) for i, (header, _) in enumerate(columns)]
+
+        def line(cells):
+            return " ".join(f"{cell:<{width}}" for cell, width in zip(cells, widths)).rstrip()
+
+        header = line([header for header, _ in columns])
+        separator = " ".join("─" * width for width in widths)
+        return header, separator, tuple(line(row) for row in rows)
+    return _cached(floor_plans, ('table', fmt), build)
+
+def render_table(floor_plans, fmt='compact'):
+    """The whole table as one code block."""
+    header, separator, rows = table_lines(floor_plans, fmt)
+    return "\n".join(["```", header, separator, *rows, "```"])
+
+def chunk_lines(lines, limit, prefix='', suffix=''):
+    """Join lines into as few chunks as possible, each at most `limit` characters with its prefix and suffix.
+
+    A line that can't fit in a chunk on its own is cut short.
+    """
+    budget = limit - len(prefix) - len(suffix)
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        line = line[:budget]
+        if current and size + 1 + len(line) > budget:
+            chunks.append(prefix + "\n".join(current) + suffix)
+            current = []
+            size = 0
+        size += len(line) + (1 if current else 0)
+        current.append(line)
+    if current:
+        chunks.append(prefix + "\n".join(current) + suffix)
+    return chunks
+
+def table_chunks(floor_plans, fmt, limit):
+    """The table split into code blocks of at most `limit` characters, each repeating the header."""
+    header, separator, rows = table_lines(floor_plans, fmt)
+    return chunk_lines(rows, limit, prefix=f"```\n{header}\n{separator}\n", suffix="\n```")
+
+def render_markdown(floor_plans, site_name):
+    """The floor_plans.md file. Only the "last updated" line is rebuilt for a snapshot that was rendered before."""
+    if not floor_plans:
+        return "# Floor Plans\n\nNo floor plans found.\n"
+
+    def build():
+        rents = _rents(floor_plans)
+        min_rent = min(rents) if rents else 0
+        max_rent = max(rents) if rents else 0
+        avg_rent = sum(rents) // len(rents) if rents else 0
+
+        rows = [[str(cell(plan)).replace('|', '\\|') for _, _, cell in MARKDOWN_COLUMNS] for plan in floor_plans]
+        widths = [max([minimum] + [len(row[i]) for row in rows]) for i, (_, minimum, _) in enumerate(MARKDOWN_COLUMNS)]
+
+        def line(cells):
+            return "| " + " | ".join(f"{cell:<{width}}" for cell, width in zip(cells, widths)) + " |"
+
+        body = [
+            f"Pricing range: ${min_rent:,} - ${max_rent:,} (average: ${avg_rent:,})",
+            "",
+            f"Total plans available: {len(floor_plans)}",
+            "",
+            line([header for header, _, _ in MARKDOWN_COLUMNS]),
+            "|-" + "-|-".join("-" * width for width in widths) + "-|",
+        ]
+        body.extend(line(row) for row in rows)
+        return "\n".join(body) + "\n"
+
+    body = _cached(floor_plans, ('markdown', site_name), build)
+    return f"# {site_name} - Floor Plans\n\nLast updated: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}\n\n{body}"
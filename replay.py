@@ -0,0 +1,358 @@
+import os
+import sys
+import json
+import glob
+import socket
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# config won't load without discord settings, and nothing here talks to the real discord
+for key, value in {'DISCORD_TOKEN': 'replay', 'DISCORD_CHANNEL_ID': '1', 'STATUS_CHANNEL_ID': '2'}.items():
+    os.environ.setdefault(key, value)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# snapshots are usually just the container's html, this is the page they get wrapped in
+CONTAINER_ID = 'replay-container'
+CONTAINER_XPATH = f"//*[@id='{CONTAINER_ID}']"
+# the "next page" link wrap_container adds when a snapshot is split over several pages
+NEXT_XPATH = "//a[@rel='next']"
+
+# the limits discord enforces on a create message request
+CONTENT_LIMIT = 2000
+EMBEDS_LIMIT = 10
+EMBED_TOTAL_LIMIT = 6000
+EMBED_FIELDS_LIMIT = 25
+EMBED_TEXT_LIMITS = {'title': 256, 'description': 4096}
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 1024
+
+def synthetic_listing(count, variant=0):
+    """Container html with `count` floor plan cards. Each variant bumps the rent of one plan."""
+    cards = []
+    for i in range(count):
+        rent = 1200 + (i * 37) % 1800 + (25 if variant and i == variant % count else 0)
+        bedrooms = ['Studio', '1', '2', '3'][i % 4]
+        availability = f"Availability {i % 3}" if i % 5 == 0 else "Contact Us"
+        cards.append(
+            f'<div class="fp-container FloorPlanCard" data-plan="{i}">'
+            f'<div class="fp-name"><h3>Plan {i:05d}</h3></div>'
+            f'<ul class="fp-details"><li>{bedrooms}</li><li>{1 + i % 2}</li><li>{400 + i % 900}</li>'
+            f'<li><span class="rent">${rent:,}</span></li><li><a href="/apply?plan={i}">Apply Now</a></li>'
+            f'<li>{availability}</li></ul></div>'
+        )
+    return "\n".join(cards)
+
+def synthetic_pages(count, variant=0, page_size=50):
+    """synthetic_listing split into pages of `page_size` plans."""
+    cards = synthetic_listing(count, variant).split("\n")
+    return ["\n".join(cards[i:i + page_size]) for i in range(0, len(cards), page_size)] or ['']
+
+def wrap_container(html_content, next_url=None):
+    next_link = f'<a rel="next" href="{next_url}">Next</a>' if next_url else ''
+    return f'<html><body><div id="{CONTAINER_ID}">{html_content}</div>{next_link}</body></html>'
+
+def check_message(payload):
+    """What discord would reject about a message, or None if it's fine."""
+    if len(payload.get('content') or '') > CONTENT_LIMIT:
+        return f"content longer than {CONTENT_LIMIT}"
+    embeds = payload.get('embeds') or []
+    if len(embeds) > EMBEDS_LIMIT:
+        return f"more than {EMBEDS_LIMIT} embeds"
+
+    total = 0
+    for embed in embeds:
+        for key, limit in EMBED_TEXT_LIMITS.items():
+            if len(embed.get(key) or '') > limit:
+                return f"embed {key} longer than {limit}"
+            total += len(embed.get(key) or '')
+        fields = embed.get('fields') or []
+        if len(fields) > EMBED_FIELDS_LIMIT:
+            return f"more than {EMBED_FIELDS_LIMIT} embed fields"
+        for field in fields:
+            if len(field['name']) > FIELD_NAME_LIMIT:
+                return f"field name longer than {FIELD_NAME_LIMIT}"
+            if len(field['value']) > FIELD_VALUE_LIMIT:
+                return f"field '{field['name']}' is {len(field['value'])} characters, over {FIELD_VALUE_LIMIT}"
+            total += len(field['name']) + len(field['value'])
+    if total > EMBED_TOTAL_LIMIT:
+        return f"embeds total {total} characters, over {EMBED_TOTAL_LIMIT}"
+    return None
+
+class SnapshotServer:
+    """Serves one snapshot at a time over local http, with an ETag so conditional GETs work like a real site.
+
+    A snapshot split over several pages is served as ?page=2, ?page=3, ...
+    """
+
+    def __init__(self):
+        self.pages = [b'']
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                number = int(query.get('page', ['1'])[0])
+                if not 1 <= number <= len(server.pages):
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                page = server.pages[number - 1]
+                etag = f'"{hashlib.sha256(page).hexdigest()[:16]}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(page)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/floorplans"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def serve(self, *pages):
+        self.pages = [page.encode('utf-8') for page in pages]
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FakeDiscord:
+    """A local stand-in for the parts of Discord's http API the bot uses.
+
+    Accepts channel messages and webhook posts, rejects payloads over
+    Discord's size limits with a 400 like the real thing, and keeps
+    everything it was sent in `messages`.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.rejected = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runner = None
+        self.port = None
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self.port}/api/v10"
+
+    def webhook_url(self, name):
+        return f"http://127.0.0.1:{self.port}/api/webhooks/{name}/token"
+
+    async def _handle(self, request):
+        from aiohttp import web
+        payload = await request.json()
+        channel = request.match_info.get('channel_id') or f"webhook:{request.match_info.get('webhook_id')}"
+
+        problem = check_message(payload)
+        if problem:
+            self.rejected.append({'channel': channel, 'payload': payload, 'error': problem})
+            return web.json_response({'code': 50035, 'message': f"Invalid Form Body: {problem}"}, status=400)
+
+        self.messages.append({'channel': channel, 'payload': payload})
+        return web.json_response(
+            {'id': str(len(self.messages)), 'channel_id': channel, 'content': payload.get('content', '')},
+            headers={'X-RateLimit-Remaining': '4', 'X-RateLimit-Reset-After': '1.0'}
+        )
+
+    async def _start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post('/api/v10/channels/{channel_id}/messages', self._handle)
+        app.router.add_post('/api/webhooks/{webhook_id}/{token}', self._handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        await web.SockSite(self.runner, sock).start()
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+class Replay:
+    """The whole monitor pipeline pointed at local stand-ins.
+
+    Each check() serves a snapshot from a local http server and runs it
+    through run_check: fetch, hash, parse, diff, results/markdown/history
+    files, the outbox and the Discord messages, which land in a FakeDiscord.
+    All state files go in a temporary directory (or `workdir`), so a replay
+    never touches the real ones. Use it as a context manager.
+    """
+
+    def __init__(self, xpath=None, workdir=None, complete_table=False, site_name='Replay', subscribers=0):
+        self.xpath = xpath
+        self.complete_table = complete_table
+        self.site_name = site_name
+        self.subscribers = subscribers
+        self.tempdir = None if workdir else tempfile.TemporaryDirectory(prefix='apartment-replay-')
+        self.workdir = os.path.abspath(workdir or self.tempdir.name)
+        self.previous_cwd = None
+
+    def __enter__(self):
+        from metrics import Metrics, set_metrics
+        from discord_rest import RestSender
+        from outbox import Outbox
+        from alerts import AlertRules, set_alert_rules
+
+        os.makedirs(self.workdir, exist_ok=True)
+        self.previous_cwd = os.getcwd()
+        # every state file is a relative path, so this keeps them all in the workdir
+        os.chdir(self.workdir)
+
+        self.server = SnapshotServer()
+        self.server.start()
+        self.discord = FakeDiscord()
+        self.discord.start()
+
+        self.site = {
+            'name': self.site_name,
+            'url': self.server.url,
+            'xpath': self.xpath or CONTAINER_XPATH,
+            'interval': 600,
+            'min_interval': 600,
+            'max_interval': 600,
+            'channel_id': 1,
+            'status_channel_id': 2,
+            'webhook_url': None,
+            'status_webhook_url': None,
+            'js_only': False,
+            'normalize': [],
+            'next_xpath': None if self.xpath else NEXT_XPATH,
+            'infinite_scroll': False,
+            'max_pages': 1000,
+            'max_rows': 100000,
+            'api_pattern': None,
+            'api_mapping': None,
+            'results_file': os.path.join(self.workdir, 'floor_plans.json'),
+            'markdown_file': os.path.join(self.workdir, 'floor_plans.md'),
+        }
+        self.metrics = Metrics(log_file='metrics.jsonl', prom_file='metrics.prom')
+        set_metrics(self.metrics)
+        # add rules here to see who an alert would ping
+        self.rules = AlertRules()
+        for i in range(self.subscribers):
+            # 18-digit ids like real discord users, so the mentions are as long as the real ones
+            self.rules.add(100000000000000000 + i)
+        set_alert_rules(self.rules)
+        self.loop = asyncio.new_event_loop()
+        self.sender = RestSender(token='replay', api_base=self.discord.api_base)
+        # no debounce, every check's alert goes out before the next one
+        self.outbox = Outbox(debounce=0)
+        return self
+
+    def check(self, html_content):
+        """Run one check against this snapshot, returns the messages Discord got for it.
+
+        `html_content` can also be a list of container html, served as pages
+        linked together with "next" links.
+        """
+        from run_monitor import run_check
+
+        if self.xpath:
+            self.server.serve(html_content)
+        else:
+            pages = [html_content] if isinstance(html_content, str) else html_content
+            self.server.serve(*(wrap_container(page, f"?page={i + 2}" if i + 1 < len(pages) else None)
+                                for i, page in enumerate(pages)))
+        before, rejected_before = len(self.discord.messages), len(self.discord.rejected)
+        run_check(self.complete_table, None, [self.site], self.loop, self.sender, self.outbox)
+        for rejection in self.discord.rejected[rejected_before:]:
+            print(f"Discord would reject a message: {rejection['error']}")
+        return self.discord.messages[before:]
+
+    def reset_metrics(self):
+        """Start the numbers over, e.g. after a warm-up check."""
+        from metrics import Metrics, set_metrics
+        for path in ('metrics.jsonl', 'metrics.prom'):
+            if os.path.exists(path):
+                os.remove(path)
+        self.metrics = Metrics(log_file='metrics.jsonl', prom_file='metrics.prom')
+        set_metrics(self.metrics)
+
+    def __exit__(self, *exc_info):
+        self.loop.run_until_complete(self.sender.close())
+        self.loop.close()
+        self.outbox.close()
+        self.discord.stop()
+        self.server.stop()
+        os.chdir(self.previous_cwd)
+        if self.tempdir:
+            self.tempdir.cleanup()
+
+def describe_message(message):
+    payload = message['payload']
+    lines = [f"  -> {message['channel']}: {(payload.get('content') or '').strip()}"]
+    for embed in payload.get('embeds') or []:
+        lines.append(f"     embed '{embed.get('title')}' with {', '.join(field['name'] for field in embed.get('fields', []))}")
+    return "\n".join(lines)
+
+def snapshot_paths(paths):
+    snapshots = []
+    for path in paths:
+        if os.path.isdir(path):
+            snapshots.extend(sorted(glob.glob(os.path.join(path, '*.html'))))
+        else:
+            snapshots.append(path)
+    return snapshots
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay saved HTML snapshots through the whole pipeline with a fake Discord')
+    parser.add_argument('snapshots', nargs='*', help=f'HTML files or directories, replayed in order (default: {FIXTURES_DIR})')
+    parser.add_argument('--xpath', help='The snapshots are whole pages, find the container with this xpath '
+                                        '(default: each snapshot is just the container html)')
+    parser.add_argument('--complete', action='store_true', help='Use the complete table in alerts')
+    parser.add_argument('--workdir', help='Keep the results, history and markdown files here instead of a temp directory')
+    parser.add_argument('--dump', help='Write every message Discord received to this JSON file')
+    parser.add_argument('--subscribers', type=int, default=0,
+                        help='Add this many users with a rule matching everything, to check that alerts pinging them all still fit')
+    args = parser.parse_args()
+
+    snapshots = [os.path.abspath(path) for path in snapshot_paths(args.snapshots or [FIXTURES_DIR])]
+    if not snapshots:
+        print("No snapshots to replay")
+        sys.exit(1)
+
+    with Replay(args.xpath, args.workdir, args.complete, subscribers=args.subscribers) as replay:
+        for i, snapshot in enumerate(snapshots, 1):
+            with open(snapshot, 'r', encoding='utf-8') as f:
+                html_content = f.read()
+            print(f"\n=== [{i}/{len(snapshots)}] {os.path.basename(snapshot)} ===")
+            messages = replay.check(html_content)
+            for message in messages:
+                print(describe_message(message))
+
+        print(f"\nReplayed {len(snapshots)} snapshot(s), Discord got {len(replay.discord.messages)} message(s)"
+              f" and rejected {len(replay.discord.rejected)}")
+        if args.dump:
+            dump_path = os.path.join(replay.previous_cwd, args.dump)
+            with open(dump_path, 'w', encoding='utf-8') as f:
+                json.dump({'messages': replay.discord.messages, 'rejected': replay.discord.rejected}, f, indent=2, ensure_ascii=False)
+            print(f"Messages written to {dump_path}")
+        if replay.discord.rejected:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,246 @@
+import startup
 import asyncio
 import sys
+import time
 import argparse
-from crawl import crawl_apartments
-from discord_bot import send_notification
+from crawl import crawl_sites, BrowserPool, BrowserCrashed
+from discord_bot import send_notifications, drain_outbox
+from discord_rest import RestSender
+from outbox import Outbox
+from scheduler import Scheduler
+from coordinator import Coordinator, LeaseKeeper
+from metrics import get_metrics, GLOBAL_SITE
+from config import SITES, MAX_CONCURRENT_CHECKS, WORKER_POLL, EXIT_RETRY
 
-def main():
-    parser = argparse.ArgumentParser(description='Monitor apartment floor plans')
-    parser.add_argument('--complete', action='store_true', 
-                       help='Show complete table with all columns (Type and Bath)')
-    args = parser.parse_args()
-    
-    try:
-        floor_plans, has_changes, availability_opened = crawl_apartments()
-        
+startup.mark('imports')
+
+# what run_check returns
+OK = 'ok'
+EMPTY = 'empty'  # some site had no floor plans
+CRASHED = 'crashed'  # chrome went down during some site's check, worth a retry
+_startup_recorded = False
+
+def record_startup():
+    """Add this process's cold start (to imports done and to the first request) to the metrics, once."""
+    global _startup_recorded
+    if _startup_recorded or startup.since_start('first_request') is None:
+        return
+    _startup_recorded = True
+    metrics = get_metrics()
+    metrics.observe('startup_imports', startup.since_start('imports'), site=GLOBAL_SITE)
+    metrics.observe('cold_start', startup.since_start('first_request'), site=GLOBAL_SITE)
+
+def run_check(complete_table=False, browsers=None, sites=SITES, loop=None, sender=None, outbox=None, scheduler=None):
+    results = crawl_sites(sites, browsers)
+
+    updates = []
+    status = OK
+    for site, result in results:
+        name = site['name']
+        if isinstance(result, BrowserCrashed):
+            print(f"[{name}] Browser crashed, no result this time")
+            status = CRASHED
+            if scheduler:
+                delay = scheduler.record(site, failed=True)
+                print(f"[{name}] Retrying in {delay / 60:.1f} min")
+            continue
+
+        floor_plans, has_changes, availability_opened, changes = result
         if floor_plans:
-            print(f"Found {len(floor_plans)} floor plans")
+            print(f"[{name}] Found {len(floor_plans)} floor plans")
             if availability_opened:
-                print("APARTMENT AVAILABLE - sending urgent notification")
+                print(f"[{name}] APARTMENT AVAILABLE - sending urgent notification")
             elif has_changes:
-                print("Changes detected - sending Discord notification")
+                print(f"[{name}] Changes detected - sending Discord notification")
             else:
-                print("No changes detected")
-                
-            asyncio.run(send_notification(floor_plans, has_changes, availability_opened, args.complete))
+                print(f"[{name}] No changes detected")
+            updates.append((site, floor_plans, has_changes, availability_opened, changes))
         else:
-            print("Error: No floor plans found")
+            print(f"[{name}] Error: No floor plans found")
+            if status == OK:
+                status = EMPTY
+
+        if scheduler:
+            delay = scheduler.record(site, changed=has_changes, failed=not floor_plans)
+            print(f"[{name}] Next check in {delay / 60:.1f} min")
+
+    if updates:
+        sending = send_notifications(updates, complete_table, sender, outbox)
+        if loop:
+            loop.run_until_complete(sending)
+        else:
+            asyncio.run(sending)
+    record_startup()
+    get_metrics().flush()
+    return status
+
+def run_daemon(complete_table=False, interval=None):
+    browsers = BrowserPool()
+    sites = SITES
+    # one event loop for the whole run so the discord http session stays pooled
+    loop = asyncio.new_event_loop()
+    sender = RestSender()
+    outbox = Outbox()
+    print(f"Running in daemon mode for {len(sites)} site(s)")
+
+    scheduler = Scheduler(sites, fixed_interval=interval)
+    try:
+        while True:
+            due = scheduler.due()
+            if due:
+                try:
+                    run_check(complete_table, browsers, due, loop, sender, outbox, scheduler)
+                except Exception as e:
+                    # keep the daemon alive, the pool restarts chrome if it died
+                    print(f"Monitor error: {e}")
+                    for site in scheduler.due():
+                        if site in due:
+                            scheduler.record(site, failed=True)
+
+            # retry / debounced notifications can be due before the next check
+            try:
+                loop.run_until_complete(drain_outbox(outbox, sender))
+            except Exception as e:
+                print(f"Notification error: {e}")
+            get_metrics().flush()
+
+            wake = scheduler.next_wake()
+            next_attempt = outbox.next_attempt()
+            if next_attempt is not None:
+                wake = min(wake, max(next_attempt, outbox.clock() + 1))
+            time.sleep(max(0, wake - scheduler.clock()))
+    except KeyboardInterrupt:
+        print("Stopping daemon")
+    finally:
+        browsers.close()
+        loop.run_until_complete(sender.close())
+        loop.close()
+        outbox.close()
+
+def run_worker(complete_table=False, interval=None):
+    """Daemon mode for one of several workers sharing SITES through the coordinator's leases.
+
+    Each pass claims up to MAX_CONCURRENT_CHECKS due sites that no other
+    worker holds, checks them while a heartbeat keeps the leases alive, then
+    hands them back with their next due time.
+    """
+    browsers = BrowserPool()
+    loop = asyncio.new_event_loop()
+    sender = RestSender()
+    outbox = Outbox()
+    coordinator = Coordinator()
+    # the schedule comes with each lease, nothing is kept locally
+    scheduler = Scheduler(SITES, path=None, fixed_interval=interval)
+    print(f"Running as worker {coordinator.owner} for {len(SITES)} site(s)")
+
+    try:
+        with LeaseKeeper(coordinator):
+            while True:
+                claimed = coordinator.claim(SITES, MAX_CONCURRENT_CHECKS)
+                for site, schedule in claimed:
+                    if schedule:
+                        scheduler.state[site['name']].update(schedule)
+                    print(f"[{site['name']}] Claimed by {coordinator.owner}")
+
+                if claimed:
+                    sites = [site for site, _ in claimed]
+                    try:
+                        run_check(complete_table, browsers, sites, loop, sender, outbox, scheduler)
+                    except Exception as e:
+                        print(f"Monitor error: {e}")
+                        for site in sites:
+                            scheduler.record(site, failed=True)
+                    finally:
+                        for site in sites:
+                            entry = scheduler.state[site['name']]
+                            coordinator.release(site, entry['next_due'], entry)
+
+                try:
+                    loop.run_until_complete(drain_outbox(outbox, sender))
+                except Exception as e:
+                    print(f"Notification error: {e}")
+                get_metrics().flush()
+
+                # other workers move the due times too, so don't sleep longer than WORKER_POLL
+                now = coordinator.clock()
+                wake = min(coordinator.next_due(SITES) or now + WORKER_POLL, now + WORKER_POLL)
+                next_attempt = outbox.next_attempt()
+                if next_attempt is not None:
+                    wake = min(wake, max(next_attempt, now + 1))
+                time.sleep(max(0, wake - now))
+    except KeyboardInterrupt:
+        print("Stopping worker")
+    finally:
+        coordinator.release_all()
+        browsers.close()
+        loop.run_until_complete(sender.close())
+        loop.close()
+        outbox.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Monitor apartment floor plans')
+    parser.add_argument('--complete', action='store_true',
+                       help='Show complete table with all columns (Type and Bath)')
+    parser.add_argument('--daemon', action='store_true',
+                       help='Keep running and check on a schedule, reusing warm browsers')
+    parser.add_argument('--worker', action='store_true',
+                       help='Like --daemon, but share the sites with other workers through leases in COORDINATOR_DB')
+    parser.add_argument('--interval', type=int,
+                       help='Fixed seconds between checks in daemon mode, turns off the adaptive schedule')
+    parser.add_argument('--stats', action='store_true',
+                       help='Print p50/p95 time per stage and counters for each site, then exit')
+    parser.add_argument('--scheduled', action='store_true',
+                       help='Only check the sites the adaptive schedule says are due (for running from cron every minute)')
+    parser.add_argument('--profile-startup', action='store_true',
+                       help='After the check, print how long it took from process start to imports, chrome and the first request')
+    args = parser.parse_args()
+
+    if args.stats:
+        print(get_metrics().format_stats())
+        return
+
+    if not SITES:
+        print("Error: No sites configured, set TARGET_URL or create a sites file")
+        sys.exit(1)
+
+    if args.worker:
+        run_worker(args.complete, args.interval)
+        return
+
+    if args.daemon:
+        run_daemon(args.complete, args.interval)
+        return
+
+    sites = SITES
+    scheduler = None
+    if args.scheduled:
+        scheduler = Scheduler(SITES)
+        sites = scheduler.due()
+        if not sites:
+            print("No sites due yet")
+            return
+
+    browsers = BrowserPool()
+    # every site is checked before anything is sent and the run doesn't stay for another check,
+    # so no later update could merge into a debounced alert. waiting only delays it a whole cron interval
+    outbox = Outbox(debounce=0)
+    try:
+        status = run_check(args.complete, browsers, sites, outbox=outbox, scheduler=scheduler)
+        if status == CRASHED:
+            sys.exit(EXIT_RETRY)
+        if status != OK:
             sys.exit(1)
-            
+
     except Exception as e:
         print(f"Monitor error: {e}")
         sys.exit(1)
 
+    finally:
+        browsers.close()
+        outbox.close()
+        get_metrics().flush()
+        if args.profile_startup:
+            print(startup.report())
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import random
+from config import SCHEDULE_FILE, SCHEDULE_BACKOFF, SCHEDULE_JITTER
+
+class Scheduler:
+    """Adaptive per-site polling schedule.
+
+    Right after a site changes it's checked every `min_interval` seconds,
+    then each quiet check stretches its interval by SCHEDULE_BACKOFF up to
+    `max_interval`. Failed checks retry on their own exponential backoff
+    without touching the quiet interval. Every delay gets +/- SCHEDULE_JITTER
+    so sites don't all fire at once.
+
+    State is saved to `path` after every check so a restart picks up the
+    same schedule (with no path it's only kept in memory, workers keep it
+    in the coordinator instead). `clock` and `rng` can be swapped out to drive it with a
+    fake clock.
+    """
+
+    def __init__(self, sites, path=SCHEDULE_FILE, clock=time.time, rng=random.random, fixed_interval=None):
+        self.sites = {site['name']: site for site in sites}
+        self.path = path
+        self.clock = clock
+        self.rng = rng
+        # --interval pins every site to one fixed interval
+        self.fixed_interval = fixed_interval
+
+        saved = self._load()
+        now = clock()
+        self.state = {}
+        for name, site in self.sites.items():
+            entry = saved.get(name, {})
+            _, high = self._bounds(site)
+            self.state[name] = {
+                'interval': self._clamp(site, entry.get('interval', site['interval'])),
+                # a max_interval lowered since the last run shouldn't leave a site waiting on the old one
+                'next_due': min(entry.get('next_due', now), now + high),
+                'last_change': entry.get('last_change'),
+                'failures': entry.get('failures', 0),
+            }
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception:
+                pass
+        return {}
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            # write then rename so a crash mid-write doesn't lose the schedule
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"Error saving schedule: {e}")
+
+    def _bounds(self, site):
+        if self.fixed_interval:
+            return self.fixed_interval, self.fixed_interval
+        return site['min_interval'], site['max_interval']
+
+    def _clamp(self, site, delay):
+        low, high = self._bounds(site)
+        return max(low, min(delay, high))
+
+    def due(self):
+        """Sites whose next check is due now."""
+        now = self.clock()
+        return [site for name, site in self.sites.items() if self.state[name]['next_due'] <= now]
+
+    def next_wake(self):
+        """When the earliest site is due, or None without any sites."""
+        return min((entry['next_due'] for entry in self.state.values()), default=None)
+
+    def record(self, site, changed=False, failed=False):
+        """Reschedule a site after a check, returns the seconds until its next one."""
+        entry = self.state[site['name']]
+        low, high = self._bounds(site)
+        now = self.clock()
+
+        if failed:
+            entry['failures'] += 1
+            delay = min(low * 2 ** (entry['failures'] - 1), high)
+        else:
+            entry['failures'] = 0
+            if changed:
+                # things are moving, look again soon
+                entry['last_change'] = now
+                entry['interval'] = low
+            else:
+                entry['interval'] = min(entry['interval'] * SCHEDULE_BACKOFF, high)
+            delay = entry['interval']
+
+        delay = self._clamp(site, delay * (1 + SCHEDULE_JITTER * (2 * self.rng() - 1)))
+        entry['next_due'] = now + delay
+        self._save()
+        return delay
@@ -0,0 +1,90 @@
+import os
+import json
+import threading
+from diff import rent_value
+from history import HistoryStore
+from models import plans_from_dicts
+from config import SITES, SCHEDULE_FILE
+
+class SiteSnapshot:
+    """One site's latest results, with the lookups the bot's commands need worked out once."""
+
+    def __init__(self, site, results):
+        self.site = site
+        self.timestamp = results.get('timestamp')
+        self.floor_plans = plans_from_dicts(results.get('floor_plans'))
+        self.by_rent = sorted((plan for plan in self.floor_plans if plan.rent_cents is not None), key=rent_value)
+        self.available = [plan for plan in self.floor_plans if plan.available]
+        self.by_name = {}
+        for plan in self.floor_plans:
+            self.by_name.setdefault(plan.name.strip().lower(), []).append(plan)
+        # plan name -> price history, filled in as people ask
+        self.history = {}
+
+class SnapshotCache:
+    """What the crawler last wrote for each site, kept in memory for the bot's commands.
+
+    Every lookup stats the site's results file and only reloads it when its
+    size or mtime changed, so answers are as fresh as the last crawl without
+    reading anything the crawl didn't rewrite. Nothing here ever fetches a page.
+    """
+
+    def __init__(self, sites=SITES, schedule_file=SCHEDULE_FILE, history=None):
+        self.sites = sites
+        self.schedule_file = schedule_file
+        self.history_store = history
+        self.snapshots = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def _reload(self, key, path, load):
+        """The cached value for `path`, rebuilt with load(contents) when the file changed."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            if self.versions.get(key) == version:
+                return self.snapshots[key]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = load(json.load(f))
+        except Exception as e:
+            # caught mid-write by an older crawler, keep answering from what we had
+            print(f"Error loading {path}: {e}")
+            with self.lock:
+                return self.snapshots.get(key)
+        with self.lock:
+            self.snapshots[key] = value
+            self.versions[key] = version
+        return value
+
+    def find_site(self, name):
+        return next((site for site in self.sites if site['name'].lower() == name.strip().lower()), None)
+
+    def get(self, site):
+        """The site's SiteSnapshot, or None before its first successful check."""
+        return self._reload(('results', site['name']), site['results_file'], lambda results: SiteSnapshot(site, results))
+
+    def all(self):
+        """(site, snapshot or None) for every site."""
+        return [(site, self.get(site)) for site in self.sites]
+
+    def schedule(self, site):
+        """The scheduler's saved state for a site (next_due, last_change, failures), or {}."""
+        state = self._reload('schedule', self.schedule_file, lambda state: state)
+        return (state or {}).get(site['name'], {})
+
+    def price_history(self, site, plan_name):
+        """The plan's rent history, read from the history database once per results file version."""
+        snapshot = self.get(site)
+        key = plan_name.strip().lower()
+        if snapshot is not None and key in snapshot.history:
+            return snapshot.history[key]
+        if self.history_store is None:
+            self.history_store = HistoryStore()
+        history = self.history_store.price_history(site['name'], plan_name.strip())
+        if snapshot is not None:
+            snapshot.history[key] = history
+        return history
@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+# libraries that are slow to import, the report shows which ones a run actually needed
+HEAVY_MODULES = ('selenium', 'webdriver_manager', 'bs4', 'discord', 'aiohttp', 'requests', 'lxml')
+
+_imported_at = time.perf_counter()
+_marks = {}
+_loaded = {}
+
+def process_age():
+    """Seconds since this process started (from /proc, so linux only, 0 elsewhere)."""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # the command name can contain spaces, the fields after it can't
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'))
+    except Exception:
+        return 0.0
+
+# the interpreter's own startup happens before any of our code runs
+_process_started = _imported_at - process_age()
+
+def mark(name):
+    """Remember when startup first got to `name` ('imports', 'first_request', ...)."""
+    if name not in _marks:
+        _marks[name] = time.perf_counter()
+        _loaded[name] = [module for module in HEAVY_MODULES if module in sys.modules]
+
+def since_start(name):
+    """Seconds from process start to a mark, or None if it wasn't reached."""
+    if name not in _marks:
+        return None
+    return _marks[name] - _process_started
+
+def report():
+    """The --profile-startup report: time from process start to each mark, in the order they were hit."""
+    lines = ["Startup profile (from process start)"]
+    lines.append(f"  {'python':<16} {(_imported_at - _process_started) * 1000:>8.0f}ms")
+    for name, when in sorted(_marks.items(), key=lambda item: item[1]):
+        lines.append(f"  {name:<16} {(when - _process_started) * 1000:>8.0f}ms  loaded: {', '.join(_loaded[name]) or 'none'}")
+    if 'first_request' in _loaded:
+        skipped = [module for module in HEAVY_MODULES if module not in _loaded['first_request']]
+        lines.append(f"Not imported before the first request: {', '.join(skipped) or 'none'}")
+    return "\n".join(lines)
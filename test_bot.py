@@ -1,5 +1,5 @@
 import asyncio
-from discord_bot import ApartmentBot
+from bot import ApartmentBot
 from config import DISCORD_TOKEN
 
 async def test_bot():